@@ -5,5 +5,7 @@ with dynamic ad insertion that maintains consistent file sizes.
 
 The application consists of:
 - A main FastAPI app (main.py)
+- HTTP ranges, conditional requests and responses (byte_ranges.py,
+  conditional.py, responses.py)
 - Audio processing modules for loading media and inserting ads
 """
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+HTTP byte ranges for serving rendered episodes.
+
+Parses Range headers as described by RFC 7233 and builds the bodies of
+multiple range responses, so the episode endpoint can answer every form of
+range request without rendering or copying more than the ranges need.
+
+Key Components:
+    ByteRange: A satisfiable range of bytes, end exclusive
+    RangeNotSatisfiable: Raised when no requested range can be served
+    parse_range: Parses a Range header against the size of a file
+    unsatisfied_range: The Content-Range header of a 416 response
+    make_boundary: Makes a boundary for a multipart body
+    multipart_byteranges: Builds a multipart/byteranges body from views
+
+Technical Details:
+    - Handles first-last, open ended first- and suffix -length ranges, in
+      comma separated lists with optional whitespace
+    - Headers that are malformed or use a unit other than bytes are ignored,
+      so the whole file is served, as the RFC requires
+    - Ranges are clamped to the file, and overlapping or adjacent ranges are
+      merged, so a client can't make a response larger than the file by
+      asking for the same bytes many times
+    - Requests with more than MAX_RANGES ranges are rejected rather than
+      served as many tiny parts
+    - Parsing only needs the file's size, which is known before rendering,
+      so unsatisfiable ranges are answered without touching the splicer
+    - Multipart bodies are lists of part headers and the views holding each
+      range, so they can be streamed without joining the ranges into a copy
+"""
+
+import secrets
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from typing import TypeVar
+
+# Most distinct ranges served in one response, after merging.
+MAX_RANGES = 16
+
+_UNIT = "bytes"
+
+# What stands for each range's bytes in a multipart body.
+_Part = TypeVar("_Part")
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header asks for no bytes that can be served."""
+
+
+@dataclass(frozen=True)
+class ByteRange:
+    """A range of bytes of a file.
+
+    Args:
+        start (int): Offset of the first byte
+        end (int): Offset just past the last byte
+    """
+
+    start: int
+    end: int
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def content_range(self, size: int) -> str:
+        """Format the range for a Content-Range header.
+
+        Args:
+            size (int): Size in bytes of the whole file
+
+        Returns:
+            str: The header's value, such as "bytes 0-99/1000"
+        """
+        return f"{_UNIT} {self.start}-{self.end - 1}/{size}"
+
+
+def unsatisfied_range(size: int) -> str:
+    """Format the Content-Range header of a 416 response.
+
+    Args:
+        size (int): Size in bytes of the whole file
+
+    Returns:
+        str: The header's value, such as "bytes */1000"
+    """
+    return f"{_UNIT} */{size}"
+
+
+def _parse_spec(spec: str, size: int) -> ByteRange | None:
+    """Parse one range of a Range header.
+
+    Returns:
+        ByteRange | None: The range clamped to the file, or None if it
+            doesn't overlap the file
+
+    Raises:
+        ValueError: If the range is malformed
+    """
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first + last).isdigit():
+        raise ValueError(f"Malformed byte range: {spec!r}")
+    if not first:
+        # A suffix range asks for the last bytes of the file.
+        suffix = int(last)
+        if suffix == 0:
+            return None
+        return ByteRange(max(size - suffix, 0), size)
+    start = int(first)
+    end = size if not last else min(int(last) + 1, size)
+    if last and int(last) < start:
+        raise ValueError(f"Byte range ends before it starts: {spec!r}")
+    if start >= size:
+        return None
+    return ByteRange(start, end)
+
+
+def _merge(ranges: Iterable[ByteRange]) -> list[ByteRange]:
+    merged: list[ByteRange] = []
+    for byte_range in sorted(ranges, key=lambda r: r.start):
+        if merged and byte_range.start <= merged[-1].end:
+            last = merged.pop()
+            byte_range = ByteRange(last.start, max(last.end, byte_range.end))
+        merged.append(byte_range)
+    return merged
+
+
+def parse_range(header: str | None, size: int) -> list[ByteRange] | None:
+    """Parse a Range header against the size of a file.
+
+    Args:
+        header (str | None): Value of the Range header, if any
+        size (int): Size in bytes of the file being served
+
+    Returns:
+        list[ByteRange] | None: The ranges to serve, in order, without
+            overlaps. None if the whole file should be served, because there
+            was no header or it couldn't be parsed.
+
+    Raises:
+        RangeNotSatisfiable: If none of the ranges overlap the file, or
+            there are more than MAX_RANGES of them
+    """
+    if not header:
+        return None
+    unit, sep, specs = header.partition("=")
+    if not sep or unit.strip().lower() != _UNIT:
+        return None
+    try:
+        ranges = [_parse_spec(spec, size) for spec in specs.split(",") if spec.strip()]
+    except ValueError:
+        return None
+    if not ranges:
+        return None
+
+    satisfiable = _merge(r for r in ranges if r is not None)
+    if not satisfiable:
+        raise RangeNotSatisfiable(f"No range in {header!r} overlaps {size} bytes")
+    if len(satisfiable) > MAX_RANGES:
+        raise RangeNotSatisfiable(
+            f"{len(satisfiable)} ranges requested, at most {MAX_RANGES} are served"
+        )
+    return satisfiable
+
+
+def make_boundary() -> str:
+    """Make a boundary to separate the parts of a multipart body.
+
+    Returns:
+        str: A random boundary, which can't appear by chance in the audio
+    """
+    return secrets.token_hex(16)
+
+
+def multipart_byteranges(
+    parts: Iterable[tuple[ByteRange, Sequence[_Part]]],
+    size: int,
+    media_type: str,
+    boundary: str,
+) -> list[bytes | _Part]:
+    """Build a multipart/byteranges body, without copying the ranges.
+
+    Args:
+        parts (Iterable[tuple[ByteRange, Sequence[_Part]]]): Each range with
+            the buffers that together hold its bytes, or anything else
+            standing for them that the response knows how to send, such as
+            the range itself to send from a file
+        size (int): Size in bytes of the whole file
+        media_type (str): Content type of the file
+        boundary (str): Boundary from make_boundary, which must also be
+            given in the response's Content-Type
+
+    Returns:
+        list[bytes | _Part]: The body's buffers in order, which the range
+            buffers are included in as given
+
+    Example:
+        ```python
+        boundary = make_boundary()
+        body = multipart_byteranges(
+            [(r, [view[r.start : r.end]]) for r in ranges],
+            len(view),
+            "audio/mpeg",
+            boundary,
+        )
+        content_length = sum(len(part) for part in body)
+        ```
+    """
+    body: list[bytes | _Part] = []
+    for byte_range, buffers in parts:
+        body.append(
+            (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: {byte_range.content_range(size)}\r\n\r\n"
+            ).encode("latin-1")
+        )
+        body.extend(buffers)
+    body.append(f"\r\n--{boundary}--\r\n".encode("latin-1"))
+    return body
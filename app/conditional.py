@@ -0,0 +1,65 @@
+"""
+HTTP conditional requests for serving rendered episodes.
+
+Evaluates the If-None-Match and If-Range headers of RFC 7232 and RFC 7233
+against an episode's entity tag, so clients holding a copy of the same
+render can revalidate it or resume downloading it without the render being
+sent again or mixed with another.
+
+Key Components:
+    none_match: Whether a request's If-None-Match lets the body be sent
+    if_range_matches: Whether a request's If-Range lets its ranges be served
+
+Technical Details:
+    - If-None-Match uses the weak comparison, so a tag sent back with a W/
+      prefix by a proxy still matches, and "*" matches any render
+    - If-Range uses the strong comparison, as ranges of one render are only
+      safe to combine with another copy of the exact same bytes
+    - Episodes carry no Last-Modified date, so an If-Range date never
+      matches and the whole file is sent
+"""
+
+import re
+
+# An entity tag, with the W/ prefix of weak tags outside its opaque tag.
+_ENTITY_TAG = re.compile(r'(W/)?("[^"]*")')
+
+
+def _entity_tags(header: str) -> list[str]:
+    # Weak tags are compared by their opaque tag alone.
+    return [match.group(2) for match in _ENTITY_TAG.finditer(header)]
+
+
+def none_match(header: str | None, etag: str) -> bool:
+    """Check whether an If-None-Match header matches an entity tag.
+
+    Args:
+        header (str | None): Value of the If-None-Match header, if any
+        etag (str): Strong entity tag of the episode, quotes included
+
+    Returns:
+        bool: True if the client already has the episode, so it should be
+            answered with 304 Not Modified
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in _entity_tags(header)
+
+
+def if_range_matches(header: str | None, etag: str) -> bool:
+    """Check whether an If-Range header lets a request's ranges be served.
+
+    Args:
+        header (str | None): Value of the If-Range header, if any
+        etag (str): Strong entity tag of the episode, quotes included
+
+    Returns:
+        bool: True if there's no condition or the client's copy is the same
+            render, False if the whole episode should be sent instead
+    """
+    if not header:
+        return True
+    # Weak tags and dates never match, as they don't identify exact bytes.
+    return header.strip() == etag
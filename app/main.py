@@ -7,29 +7,48 @@ This module provides endpoints for:
 - Streaming audio content with ad insertion and byte range support
 
 The application uses MediaLoader for handling audio files and AudioSplicer for
-inserting ads into the audio stream. All responses are configured to avoid
-caching to ensure different ad insertions on refresh.
+inserting ads into the audio stream. Responses are configured to avoid
+caching to ensure different ad insertions on refresh, except that episodes
+carry ETags, so a copy can be reused while it's still the listener's render.
 
 Endpoints:
     GET / - Serves the main HTML page
+    GET /ready - Reports whether every ad has been rendered into the cache
     GET /rss - Generates RSS feed for the podcast
     GET /pretend_podcast_that_is_actually_music - Serves music with dynamic ad
         insertion and byte range support.
+    HEAD /pretend_podcast_that_is_actually_music - Reports the episode's size
+        without rendering it.
 """
 
+import asyncio
 import logging
 import os
 import sys
+from collections.abc import Sequence
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import BinaryIO
 from urllib.parse import urljoin
 
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 
 from feedgen.feed import FeedGenerator  # type: ignore
 
-from app.size_preserving_podcast_splicer import media_loader, audio_splicer
+from app import byte_ranges, conditional
+from app.responses import SendfileResponse, chunked
+from app.size_preserving_podcast_splicer import (
+    media_loader,
+    audio_splicer,
+    render_engine,
+)
 
 root = logging.getLogger()
 root.setLevel(logging.DEBUG)
@@ -40,16 +59,102 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 root.addHandler(handler)
 
-loader = media_loader.MediaLoader()
-splicer = audio_splicer.AudioSplicer()
+logger = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).parent.parent.resolve()
 STATIC_DIR = BASE_DIR / "static"
+# Rendered episodes are kept here so they survive restarts.
+CACHE_DIR = BASE_DIR / "cache"
+
+# Seconds a client is asked to wait before retrying when renders are backed up.
+RETRY_AFTER_SECONDS = 5
+# Whether to render every ad into the music at startup, so that listeners are
+# always served from the cache once the app reports it's ready.
+WARM_UP_CACHE = True
+# Seconds each listener keeps hearing the same ad, across all the requests of
+# their downloads, before they may be given another.
+AD_ROTATION_SECONDS = media_loader.DEFAULT_ROTATION_SECONDS
+# Query parameter a client can identify its listener by, instead of its
+# address and user agent.
+LISTENER_PARAM = "listener"
+# Header a trusted proxy puts each client's address in, replacing any the
+# client sent, such as Fly-Client-IP on fly.io. If unset, clients are told
+# apart by the address they connect from, which uvicorn takes from
+# X-Forwarded-For when the connection is from FORWARDED_ALLOW_IPS.
+CLIENT_IP_HEADER = os.environ.get("CLIENT_IP_HEADER")
+# Seconds between checks of the ads directory for added, changed or removed
+# ads, which are then loaded and, if WARM_UP_CACHE is set, rendered.
+AD_RELOAD_SECONDS = 60
+
+engine = render_engine.RenderEngine()
+splicer = audio_splicer.AudioSplicer(cache_dir=CACHE_DIR, engine=engine)
+# Size episodes from the renders they need, rather than a rough estimate.
+# Decode the music and ads once, so renders don't decode MP3s every time.
+loader = media_loader.MediaLoader(
+    size_estimator=splicer.required_size, pcm_dir=CACHE_DIR / "pcm"
+)
 
 EPISODE_PATH = "/pretend_podcast_that_is_actually_music"
 RSS_PATH = "/rss"
 
-app = FastAPI()
+# Lets clients and proxies keep episodes, but only reuse them once the ETag
+# confirms the listener would still get the same render, as the ad rotates.
+_REVALIDATE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Warm the cache and reload the ads in the background while the app runs.
+
+    Starts rendering every ad into the music when the app starts, if
+    WARM_UP_CACHE is set, and checks for changes to the ads every
+    AD_RELOAD_SECONDS. Stops the render engine and splicer when it shuts down.
+    """
+    tasks = [asyncio.create_task(_reload_ads())]
+    if WARM_UP_CACHE:
+        tasks.append(asyncio.create_task(_warm_up()))
+    yield
+    for task in tasks:
+        task.cancel()
+    engine.shutdown()
+    splicer.close()
+
+
+async def _warm_up() -> None:
+    """Render every ad into the music, for the current target size."""
+    await splicer.warm_up_async(
+        loader.music_track,
+        loader.ads,
+        loader.target_bytes_size(),
+        concurrency=engine.max_workers,
+    )
+
+
+async def _reload_ads() -> None:
+    """Reload the ads whenever the ads directory changes.
+
+    New ads change the target size, and so the cache key of every render,
+    so they're rendered again if WARM_UP_CACHE is set.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(AD_RELOAD_SECONDS)
+        try:
+            reloaded = await loop.run_in_executor(None, loader.reload_ads)
+        except Exception as e:
+            logger.error(f"Failed to reload ads: {e}")
+            continue
+        if reloaded:
+            logger.info(f"Reloaded {len(loader.ads)} ads")
+            if WARM_UP_CACHE:
+                await _warm_up()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/")
@@ -77,6 +182,29 @@ async def read_root():
     )
 
 
+@app.get("/ready")
+async def ready():
+    """Report whether every ad can be served from the cache.
+
+    Lets health checks hold traffic back until the cache is warm, so that
+    listeners never wait on a render.
+
+    Returns:
+        JSONResponse: {"ready": bool} with status 200 once every ad is
+            cached, or status 503 before then
+    """
+    target_size_bytes = loader.target_bytes_size()
+    is_ready = all(
+        splicer.is_cached(loader.music_track, ad, target_size_bytes)
+        for ad in loader.ads
+    )
+    return JSONResponse(
+        {"ready": is_ready},
+        status_code=200 if is_ready else 503,
+        headers={"Cache-Control": "no-cache, no-store, must-revalidate"},
+    )
+
+
 @app.get(RSS_PATH)
 async def rss(request: Request):
     """Generate a dynamic RSS feed for the pretend podcast.
@@ -144,74 +272,270 @@ async def pretend_podcast_that_is_actually_music(request: Request):
 
     Returns:
         Response: Audio content with appropriate headers:
-            - For partial content: status 206 with Content-Range header
+            - For partial content: status 206 with Content-Range header, or
+              a multipart/byteranges body for several ranges
+            - For ranges outside the file: status 416 with Content-Range
+            - If If-None-Match matches the ETag: status 304 with no body
             - For full content: status 200
+            - If too many renders are queued: status 503 with Retry-After
             - Always includes:
                 - Content-Disposition for filename
                 - Content-Length
                 - Accept-Ranges: bytes
-                - Cache-Control headers preventing caching
+                - ETag of the render, from its cache key
+                - Cache-Control headers requiring revalidation
 
     Technical Details:
-        - Supports byte range requests for partial content delivery
+        - Supports byte range requests for partial content delivery, only
+          rendering the ad for ranges that overlap it
+        - Parses every form of range with byte_ranges, and refuses ranges
+          outside the file before looking at the cache
+        - Streams full responses, sending the start of the file while the
+          region around the ad is still being encoded
+        - Sends renders cached on disk, and ranges of them, straight from
+          their files, with sendfile where the server supports it
+        - Streams everything else in chunks of views of the cached render,
+          so no response copies the audio
         - Dynamically inserts ads while maintaining target file size
-        - Uses no-cache headers to ensure fresh ad insertion on each request
+        - Gives each listener the same ad for AD_ROTATION_SECONDS, so every
+          range request of a download is served from the same render
+        - Renders off the event loop, so other requests are served meanwhile
+        - Tags each render with a strong ETag from its cache key, so
+          If-None-Match and If-Range are answered without the splicer, and
+          resumed downloads only get ranges of the render they started
+        - Uses no-cache headers so clients don't keep an ad past its rotation
         - Returns audio/mpeg content type
     """
-    audio_bytes = splicer.insert_ad_and_pad(
-        loader.music_track,
-        loader.random_ad(),
-        loader.target_bytes_size(),
-    )
+    ad = loader.sticky_ad(_listener_key(request), AD_ROTATION_SECONDS)
+    target_size_bytes = loader.target_bytes_size()
+    etag = splicer.etag(loader.music_track, ad, target_size_bytes)
+    headers = _episode_headers(etag)
 
-    audio_size = len(audio_bytes)
-    music_file_name = os.path.basename(loader.music_track.probe["format"]["filename"])
+    if conditional.none_match(request.headers.get("if-none-match"), etag):
+        return _not_modified(etag)
 
-    # Parse range header if present
     range_header = request.headers.get("range")
+    if not conditional.if_range_matches(request.headers.get("if-range"), etag):
+        # The client's copy is of another render, so it needs the whole file.
+        range_header = None
+
+    # Every render is the target size, so ranges are checked before rendering.
+    try:
+        ranges = byte_ranges.parse_range(range_header, target_size_bytes)
+    except byte_ranges.RangeNotSatisfiable as e:
+        logger.info(f"Refusing episode range: {e}")
+        headers["Content-Range"] = byte_ranges.unsatisfied_range(target_size_bytes)
+        return Response(status_code=416, headers=headers)
+
+    # Renders cached on disk are sent straight from their file.
+    cached_file = splicer.cached_file(loader.music_track, ad, target_size_bytes)
+    if cached_file is not None:
+        file, view = cached_file
+        return _file_response(file, view, ranges, headers)
+
+    try:
+        if ranges is not None:
+            # Only ranges overlapping the ad need it rendered.
+            parts = []
+            for byte_range in ranges:
+                audio_size, views = await splicer.read_range_async(
+                    loader.music_track,
+                    ad,
+                    target_size_bytes,
+                    byte_range.start,
+                    byte_range.end,
+                )
+                parts.append((byte_range, views))
+        else:
+            audio_size, chunks = await splicer.stream_ad_and_pad_async(
+                loader.music_track, ad, target_size_bytes
+            )
+    except render_engine.RenderQueueFull as e:
+        logger.warning(f"Turning away episode request: {e}")
+        return Response(
+            status_code=503,
+            headers={
+                "Retry-After": str(RETRY_AFTER_SECONDS),
+                "Cache-Control": "no-cache, no-store, must-revalidate",
+                "Pragma": "no-cache",
+                "Expires": "0",
+            },
+        )
 
-    if range_header:
-        start_byte = 0
-        end_byte = audio_size - 1
+    if ranges is not None:
+        return _ranges_response(parts, audio_size, headers)
 
-        if range_header.startswith("bytes="):
-            range_data = range_header.split("=")[1]
-            ranges = range_data.split("-")
+    # If no range header, stream the full content
+    headers["Content-Length"] = str(audio_size)
 
-            if ranges[0]:
-                start_byte = int(ranges[0])
-            if ranges[1]:
-                end_byte = int(ranges[1])
+    return StreamingResponse(chunked(chunks), media_type="audio/mpeg", headers=headers)
 
-        # Get the requested byte range
-        content = audio_bytes[start_byte : end_byte + 1]
-        content_length = len(content)
 
-        headers = {
-            "Content-Disposition": f'attachment; filename="{music_file_name}"',
-            "Content-Length": str(content_length),
-            "Content-Range": f"bytes {start_byte}-{end_byte}/{audio_size}",
-            "Accept-Ranges": "bytes",
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        }
+@app.head(EPISODE_PATH)
+async def pretend_podcast_that_is_actually_music_head(request: Request):
+    """Describe the episode without rendering it.
+
+    Podcast apps and aggregators send HEAD requests to check an enclosure's
+    length. Every render of the episode is exactly the target size, so the
+    headers are answered from the loader without looking at the cache or
+    starting any ffmpeg work.
+
+    Args:
+        request (Request): The incoming HTTP request, which may carry an
+            If-None-Match header
+
+    Returns:
+        Response: Status 200 and no body, with the headers a GET would send:
+            - Content-Length of the episode
+            - Content-Disposition for filename
+            - Accept-Ranges: bytes
+            - ETag of the listener's render
+            - Cache-Control headers requiring revalidation
+            Or status 304 if If-None-Match matches the ETag.
+    """
+    ad = loader.sticky_ad(_listener_key(request), AD_ROTATION_SECONDS)
+    target_size_bytes = loader.target_bytes_size()
+    etag = splicer.etag(loader.music_track, ad, target_size_bytes)
+    if conditional.none_match(request.headers.get("if-none-match"), etag):
+        return _not_modified(etag)
+
+    headers = _episode_headers(etag)
+    headers["Content-Length"] = str(target_size_bytes)
+    return Response(media_type="audio/mpeg", headers=headers)
 
-        return Response(
-            content=content,
-            status_code=206,  # Partial Content
-            media_type="audio/mpeg",
-            headers=headers,
-        )
 
-    # If no range header, return full content as before
-    headers = {
+def _listener_key(request: Request) -> str:
+    """Get the key identifying the listener making a request.
+
+    Args:
+        request (Request): The incoming HTTP request
+
+    Returns:
+        str: The LISTENER_PARAM query parameter if given, otherwise the
+            client's address, from CLIENT_IP_HEADER if set, and user agent
+    """
+    token = request.query_params.get(LISTENER_PARAM)
+    if token:
+        return f"token:{token}"
+    host = request.headers.get(CLIENT_IP_HEADER) if CLIENT_IP_HEADER else None
+    if not host:
+        host = request.client.host if request.client else ""
+    return f"client:{host}:{request.headers.get('user-agent', '')}"
+
+
+def _episode_headers(etag: str) -> dict[str, str]:
+    """Get the headers sent with every response of the episode.
+
+    Args:
+        etag (str): Entity tag of the render being sent
+
+    Returns:
+        dict[str, str]: Content-Disposition, Accept-Ranges, ETag and headers
+            requiring caches to revalidate
+    """
+    music_file_name = os.path.basename(loader.music_track.probe["format"]["filename"])
+    return {
         "Content-Disposition": f'attachment; filename="{music_file_name}"',
-        "Content-Length": str(audio_size),
         "Accept-Ranges": "bytes",
-        "Cache-Control": "no-cache, no-store, must-revalidate",
-        "Pragma": "no-cache",
-        "Expires": "0",
+        "ETag": etag,
+        **_REVALIDATE_HEADERS,
     }
 
-    return Response(content=audio_bytes, media_type="audio/mpeg", headers=headers)
+
+def _not_modified(etag: str) -> Response:
+    """Tell a client its copy of the episode is still the one it would get.
+
+    Args:
+        etag (str): Entity tag of the render the client has
+
+    Returns:
+        Response: Status 304 with the ETag and caching headers
+    """
+    return Response(status_code=304, headers={"ETag": etag, **_REVALIDATE_HEADERS})
+
+
+def _file_response(
+    file: BinaryIO,
+    view: memoryview,
+    ranges: list[byte_ranges.ByteRange] | None,
+    headers: dict[str, str],
+) -> SendfileResponse:
+    """Send a render cached on disk, or ranges of it, from its file.
+
+    Args:
+        file (BinaryIO): The render's open file, which the response closes
+        view (memoryview): View of the file's memory mapping
+        ranges (list[byte_ranges.ByteRange] | None): Ranges to send, or None
+            for the whole file
+        headers (dict[str, str]): Headers to send, which Content-Length and
+            Content-Range are added to
+
+    Returns:
+        SendfileResponse: The whole file, or the partial content
+    """
+    body: Sequence[bytes | byte_ranges.ByteRange]
+    status_code = 206  # Partial Content
+    media_type = "audio/mpeg"
+    if ranges is None:
+        body = [byte_ranges.ByteRange(0, len(view))]
+        status_code = 200
+    elif len(ranges) == 1:
+        body = ranges
+        headers["Content-Range"] = ranges[0].content_range(len(view))
+    else:
+        boundary = byte_ranges.make_boundary()
+        body = byte_ranges.multipart_byteranges(
+            [(r, [r]) for r in ranges], len(view), "audio/mpeg", boundary
+        )
+        media_type = f"multipart/byteranges; boundary={boundary}"
+    headers["Content-Length"] = str(sum(len(part) for part in body))
+
+    return SendfileResponse(
+        file,
+        view,
+        body,
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+def _ranges_response(
+    parts: list[tuple[byte_ranges.ByteRange, list[memoryview]]],
+    audio_size: int,
+    headers: dict[str, str],
+) -> StreamingResponse:
+    """Stream a 206 response of one or more ranges of an episode.
+
+    A single range is sent as is, and several as a multipart/byteranges body.
+    Either way the ranges are streamed as views, so they're never copied.
+
+    Args:
+        parts (list[tuple[byte_ranges.ByteRange, list[memoryview]]]): Each
+            range with views that together hold its bytes
+        audio_size (int): Size in bytes of the whole episode
+        headers (dict[str, str]): Headers to send, which Content-Length and
+            Content-Range are added to
+
+    Returns:
+        StreamingResponse: The partial content
+    """
+    body: Sequence[bytes | memoryview]
+    if len(parts) == 1:
+        ((byte_range, body),) = parts
+        media_type = "audio/mpeg"
+        headers["Content-Range"] = byte_range.content_range(audio_size)
+    else:
+        boundary = byte_ranges.make_boundary()
+        body = byte_ranges.multipart_byteranges(
+            parts, audio_size, "audio/mpeg", boundary
+        )
+        media_type = f"multipart/byteranges; boundary={boundary}"
+    headers["Content-Length"] = str(sum(len(view) for view in body))
+
+    return StreamingResponse(
+        chunked(body),
+        status_code=206,  # Partial Content
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,149 @@
+"""
+HTTP responses for serving rendered episodes.
+
+Rendered episodes are large and served often, so these responses avoid
+copying their bytes into Python objects wherever the server allows it.
+
+Key Components:
+    SendfileResponse: Sends byte ranges of a file, letting the server copy
+        them straight from the file to the socket where it can
+    chunked: Splits buffers into chunks for a StreamingResponse
+
+Technical Details:
+    - Servers offering the ASGI zero copy send extension are handed the open
+      file with the offset and length of each range, and send it with
+      os.sendfile so the bytes stay in the kernel. Multipart bodies send
+      their part headers as ordinary body messages between the ranges
+    - Other servers, such as uvicorn, are sent the ranges in chunks of a
+      memoryview of the file's memory mapping. Nothing is read into Python
+      bytes first, but the server still copies each chunk to the socket
+    - The file is opened before the response is built and closed once it's
+      sent, so a render evicted from the disk cache meanwhile is still sent
+      whole
+    - Everything else is streamed as memoryview chunks of the buffers that
+      already hold it, so no response copies its payload, and the server's
+      flow control keeps each download's memory to about one chunk
+"""
+
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Mapping, Sequence
+from typing import BinaryIO
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.byte_ranges import ByteRange
+
+# Bytes of a file sent in each message when the server can't send files.
+CHUNK_SIZE = 256 * 1024
+
+_ZERO_COPY_SEND = "http.response.zerocopysend"
+
+
+def _split(part: bytes | memoryview, chunk_size: int) -> Iterable[memoryview]:
+    view = memoryview(part)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset : offset + chunk_size]
+
+
+async def chunked(
+    parts: Iterable[bytes | memoryview] | AsyncIterable[bytes | memoryview],
+    chunk_size: int = CHUNK_SIZE,
+) -> AsyncIterator[memoryview]:
+    """Split buffers into chunks to stream, without copying them.
+
+    Args:
+        parts (Iterable[bytes | memoryview] | AsyncIterable[bytes | memoryview]):
+            Buffers holding the body, in order
+        chunk_size (int, optional): Most bytes in a chunk. Defaults to
+            CHUNK_SIZE.
+
+    Yields:
+        memoryview: Views of the buffers, each at most chunk_size bytes
+    """
+    if isinstance(parts, AsyncIterable):
+        async for part in parts:
+            for chunk in _split(part, chunk_size):
+                yield chunk
+    else:
+        for part in parts:
+            for chunk in _split(part, chunk_size):
+                yield chunk
+
+
+class SendfileResponse(Response):
+    """Response that sends byte ranges of a cached file.
+
+    Args:
+        file (BinaryIO): The open file, which mustn't change while it's being
+            sent and is closed once it has been
+        view (memoryview): View of the file's memory mapping, sent from when
+            the server can't send the file itself
+        body (Sequence[bytes | ByteRange]): The body in order, as bytes to
+            send as they are, such as multipart headers, and ranges of the
+            file
+        status_code (int, optional): HTTP status. Defaults to 200.
+        headers (Mapping[str, str] | None, optional): Headers to send, which
+            should include Content-Length. Defaults to None.
+        media_type (str | None, optional): Content type. Defaults to None.
+
+    Example:
+        ```python
+        file, view = splicer.cached_file(music, ad, target_size)
+        return SendfileResponse(
+            file, view, [ByteRange(0, len(view))], media_type="audio/mpeg"
+        )
+        ```
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        view: memoryview,
+        body: Sequence[bytes | ByteRange],
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+        media_type: str | None = None,
+    ) -> None:
+        self.file = file
+        self.view = view
+        self.parts = body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        with self.file:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if scope["method"].upper() != "HEAD":
+                extensions = scope.get("extensions") or {}
+                await self._send_body(send, _ZERO_COPY_SEND in extensions)
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _send_body(self, send: Send, zero_copy: bool) -> None:
+        for part in self.parts:
+            if isinstance(part, ByteRange) and zero_copy:
+                await send(
+                    {
+                        "type": _ZERO_COPY_SEND,
+                        "file": self.file,
+                        "offset": part.start,
+                        "count": len(part),
+                        "more_body": True,
+                    }
+                )
+            elif isinstance(part, ByteRange):
+                for chunk in _split(self.view[part.start : part.end], CHUNK_SIZE):
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            elif part:
+                await send(
+                    {"type": "http.response.body", "body": part, "more_body": True}
+                )
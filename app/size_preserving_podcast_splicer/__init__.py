@@ -7,4 +7,12 @@ crossfades, and ensures consistent file sizes.
 Modules:
     media_loader: Handles loading and managing audio files
     audio_splicer: Performs ad insertion and audio processing
+    byte_cache: Byte budgeted LRU cache for processed audio
+    mp3_frames: Parses and rewrites MP3 data at the frame level
+    id3_padding: Pads MP3 tags so files hit an exact size
+    pcm_cache: Decodes audio once into memory mapped raw PCM files
+    crossfade: Mixes decoded music and ads with cross-fades in NumPy
+    composed_audio: Files composed from segments of shared buffers
+    disk_cache: Content-addressed cache of renders stored as files
+    render_engine: Bounded process pool that renders run in
 """
\ No newline at end of file
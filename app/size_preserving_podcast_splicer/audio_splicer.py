@@ -4,66 +4,190 @@ This module provides functionality for inserting advertisements into audio strea
 while maintaining exact file sizes. It handles audio format conversion, crossfading,
 and precise MP3 padding to ensure consistent file sizes across different ad insertions.
 
-The module uses ffmpeg for audio processing and mutagen for MP3 metadata manipulation.
+The module uses ffmpeg for audio processing and writes the ID3 metadata itself.
 It supports caching of processed audio to improve performance for repeated insertions.
 
 Key Components:
     AudioSplicer: Main class that handles ad insertion and caching
+    _splice_frames: Frame-level splicing that only re-encodes around the ad
+    _encode_crossfade_regions: Encodes the regions around many ads in one run
+    _choose_sources: Exact size solver picking the encodings spliced around the ad
+    _ByteLayout: Byte layout of a splice, known before it's encoded
     _insert_ad: Core function for audio splicing with cross-fades
     _pad_mp3_to_size: Utility for exact MP3 file size control
     _calculate_target_bitrate: Bitrate calculator for size constraints
 
 Technical Details:
-    - Supports automatic audio format conversion (sample rate, channels, format)
-    - Implements smooth cross-fading at ad insertion points
-    - Uses ID3 tag padding for precise file size control
-    - Maintains an in-memory cache of processed audio
+    - Supports automatic audio format conversion (sample rate, channels, format),
+      skipped for ads the loader has already converted to the music's format
+    - Implements smooth cross-fading at ad insertion points, mixing decoded
+      samples in NumPy and piping them to the encoder when it can, rather
+      than building an ffmpeg filter graph
+    - Copies untouched music frames verbatim where the source MP3 allows it,
+      falling back to re-encoding the whole track otherwise
+    - Keeps re-encoded copies of the music per bitrate, so each new ad only
+      costs encoding the ad and its cross-fades. Each copy is encoded once,
+      as an engine job, and sent to the workers with the jobs that need it
+    - Works out exact output sizes from MP3 frame sizes before encoding, and
+      mixes bitrates either side of the ad to land as close to the target as
+      possible
+    - Pads to the exact size at the end of the file, in an APEv2 tag, so
+      everything up to the re-encoded frames is known before encoding and
+      can be streamed while the encoder runs
+    - Renders entirely in memory, reading ffmpeg's output from a pipe, or
+      a pipe per ad when a batch is encoded in one run
+    - Reads decoded samples of the music and ads when the loader has decoded
+      them, rather than decoding the MP3s for every render
+    - Maintains a byte budgeted, least recently used in-memory cache of
+      processed audio, optionally backed by a persistent disk cache keyed by
+      the content of the inputs and the render parameters. Splices cached in
+      memory share the music frames, so each costs only its re-encoded frames
+    - Coalesces concurrent requests for the same render into one render
+    - Offers an async API that renders on worker threads, keeping the event
+      loop free while ffmpeg runs
+    - Knows the byte layout of a splice before encoding it, so byte ranges
+      away from the ad are served without rendering
+    - Tags each render with its cache key, so HTTP validators can be
+      checked without rendering or reading the cache
+    - Can render in a bounded process pool, which rejects work once its
+      queue is full rather than overloading the machine
+    - Can warm the cache with every ad up front, so listeners only ever hit
+      the cache, rendering the ads in batches that encode the regions around
+      many ads in a single ffmpeg run
 """
 
-import os
-import tempfile
+import asyncio
+import concurrent.futures
 import logging
+import os
+import subprocess
+import threading
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
 
 
 import ffmpeg  # type: ignore
-import mutagen.mp3
-import mutagen.id3
-
+import numpy as np
+from app.size_preserving_podcast_splicer import (
+    byte_cache,
+    crossfade,
+    disk_cache,
+    id3_padding,
+    mp3_frames,
+    pcm_cache,
+    render_engine,
+)
+from app.size_preserving_podcast_splicer.composed_audio import ComposedAudio
 from app.size_preserving_podcast_splicer.media_loader import StreamAndProbe
 
 logger = logging.getLogger(__name__)
 
+FADE_DURATION_SECONDS = 2
+
+# Default most bytes of processed audio to keep cached in memory.
+DEFAULT_CACHE_BUDGET_BYTES = 64 * 1024 * 1024
+
+# Bitrate in kbps that the frames re-encoded around an ad may drop to, when
+# encoding the whole episode would manage it, before the music around them is
+# re-encoded to make room. Target sizes are predicted for this bitrate too.
+MIN_BITRATE = 128
+
+# Part of every cache key. Bump it when changes to rendering mean that renders
+# cached on disk should no longer be used, such as changes to how samples are
+# mixed (mixing cross-fades in NumPy rather than a filter graph changes the
+# output bytes), to the encoder settings or to which music is copied.
+_RENDER_VERSION = 5
+
+# Seconds to wait before retrying a warm-up render when the engine is busy.
+_WARM_UP_RETRY_SECONDS = 1
+
+# Most bytes of mixed samples to pipe to one ffmpeg run when rendering ads in
+# a batch. Bigger batches need fewer runs but more memory.
+_BATCH_BUDGET_BYTES = 256 * 1024 * 1024
 
-def _calculate_target_bitrate(duration_seconds: float, target_size_bytes: int) -> int:
+# Extra frames either side of the cross-fades that get re-encoded, so that the
+# splice points always fall in plain music.
+_GUARD_FRAMES = 2
+
+
+def _calculate_target_bitrate(
+    sample_count: int, sample_rate: int, target_size_bytes: int, overhead_bytes: int
+) -> int:
     """Calculate the optimal MP3 bitrate to achieve a target file size.
 
-    Determines the highest standard MP3 bitrate that will result in a file size
-    at or below the target size, accounting for MP3 metadata overhead. Note,
-    this overshoots, but is sufficient for this toy project.
+    Determines the highest MP3 bitrate that will result in a file size at or
+    below the target size. The size of each candidate is worked out exactly
+    from the number and size of the frames libmp3lame will write.
 
     Args:
-        duration_seconds (float): Total duration of the audio in seconds
+        sample_count (int): Samples per channel of audio to encode
+        sample_rate (int): Sample rate in Hz
         target_size_bytes (int): Desired final file size in bytes
+        overhead_bytes (int): Bytes of tags and other data besides the frames
 
     Returns:
-        int: Selected MP3 bitrate in kbps (32, 40, 48, ..., 320)
+        int: Selected MP3 bitrate in kbps
 
     Raises:
         AssertionError: If target size is too small for the duration
     """
-    # Give ourselves ~5% overhead for MP3 headers/metadata.
-    available_bytes = target_size_bytes * 0.95
-    # Convert to bits per second (bytes * 8 bits/byte / seconds).
-    target_bitrate = int((available_bytes * 8) / duration_seconds)
-    # Return the first rate that's under our target.
-    common_bitrates = [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
-    for rate in reversed(common_bitrates):
-        if rate * 1000 <= target_bitrate:
+    is_mpeg1 = sample_rate >= 32000
+    frame_count = mp3_frames.lame_frame_count(sample_count, 1152 if is_mpeg1 else 576)
+    for rate in reversed(mp3_frames.bitrates(is_mpeg1)):
+        size = overhead_bytes + mp3_frames.lame_cbr_size(
+            is_mpeg1, rate, sample_rate, 0, frame_count
+        )
+        if size <= target_size_bytes:
+            logger.debug(f"Encoding at {rate}k gives {size} bytes")
             return rate
     assert False, "Bad args, target size is too small, fix callers"
     return 0
 
 
+def _full_encode_bitrate(
+    original_audio: StreamAndProbe,
+    ad: StreamAndProbe,
+    target_size_bytes: int,
+    overhead_bytes: int,
+) -> int:
+    """Calculate the bitrate for encoding the music and ad in one go.
+
+    Args:
+        original_audio (StreamAndProbe): Original audio content
+        ad (StreamAndProbe): Advertisement to insert
+        target_size_bytes (int): Desired final file size in bytes
+        overhead_bytes (int): Bytes of tags and other data besides the frames
+
+    Returns:
+        int: Selected MP3 bitrate in kbps
+    """
+    sample_rate = int(original_audio.probe["streams"][0]["sample_rate"])
+    # The ad overlaps the music by a fade at either end. ffmpeg trims by time,
+    # so allow a frame in case that rounds the total up.
+    duration = original_audio.duration() + ad.duration() - 2 * FADE_DURATION_SECONDS
+    sample_count = round(duration * sample_rate) + 1152
+    return _calculate_target_bitrate(
+        sample_count, sample_rate, target_size_bytes, overhead_bytes
+    )
+
+
+def _audio_input(audio: StreamAndProbe):
+    """Get the audio stream of a file, from its decoded samples if it has them.
+
+    Args:
+        audio (StreamAndProbe): Audio to read
+
+    Returns:
+        ffmpeg audio stream -- this is an ffmpeg.FilterableStream but ffmpeg
+            doesn't expose that type
+    """
+    if audio.pcm is not None:
+        return audio.pcm.stream().audio
+    return audio.stream.audio
+
+
 def _match_audio_params(
     stream,  # This is an ffmpeg.FilterableStream, but that type is not exposed.
     original_rate: int,
@@ -97,34 +221,19 @@ def _match_audio_params(
     return converted_stream.filter_multi_output("asplit", splits)
 
 
-def _insert_ad(
-    output_file_name: str,
-    original_audio: StreamAndProbe,
-    ad: StreamAndProbe,
-    target_size_bytes: int,
-) -> bool:
-    """Insert an advertisement into the middle of an audio file with cross-fading.
-
-    Performs the following steps:
-    1. Splits original audio at midpoint
-    2. Converts ad audio to match original format if needed
-    3. Creates cross-fades between original audio and ad
-    4. Concatenates all segments with proper timing
-    5. Encodes to MP3 with calculated bitrate for size control
+def _matched_ad_streams(
+    original_audio: StreamAndProbe, ad: StreamAndProbe, splits: int
+) -> list:
+    """Get copies of an ad's audio stream in the original audio's format.
 
     Args:
-        output_file_name (str): Path to write the output MP3
-        original_audio (StreamAndProbe): Original audio content
-        ad (StreamAndProbe): Advertisement to insert
-        target_size_bytes (int): Desired output file size
+        original_audio (StreamAndProbe): Audio whose parameters should be matched
+        ad (StreamAndProbe): Advertisement to convert if needed
+        splits (int): Number of copies of the stream to return
 
     Returns:
-        bool: True if insertion succeeded, False otherwise
+        list: ffmpeg streams for the ad, converted if its parameters differ
     """
-    mid_point = original_audio.duration() / 2
-    ad_duration = ad.duration()
-    fade_duration = 2
-
     # Get original audio parameters
     original_stream = original_audio.probe["streams"][0]
     original_rate = int(original_stream["sample_rate"])
@@ -140,98 +249,212 @@ def _insert_ad(
         or int(ad_stream["channels"]) != original_channels
         or ad_stream.get("sample_fmt", "s16") != original_format
     )
-    # needs_conversion = False
+    if ad.pcm is not None:
+        # Decoded ads are usually converted to the music's parameters already.
+        needs_conversion = (
+            ad.pcm.sample_rate != original_rate
+            or ad.pcm.channels != original_channels
+            or ad.pcm.sample_fmt != pcm_cache.packed_format(original_format)
+        )
     if needs_conversion:
-        ads = _match_audio_params(
-            ad.stream.audio,
+        converted = _match_audio_params(
+            _audio_input(ad),
             original_rate,
             original_channels,
             original_format,
-            3,
+            splits,
         )
-    else:
-        ads = [ad.stream.audio] * 3  # Expose original stream 3 times.
+        if splits <= 1:
+            return [converted]
+        return [converted[i] for i in range(splits)]
+    return [_audio_input(ad)] * splits  # Expose original stream repeatedly.
 
-    # Calculate total duration and target bitrate
-    total_duration = original_audio.duration() + ad_duration
-    target_bitrate = _calculate_target_bitrate(total_duration, target_size_bytes)
 
-    try:
-        # Create first half (end slightly early for crossfade)
-        first_half = original_audio.stream.audio.filter(
-            "atrim", start=0, end=mid_point - fade_duration
-        ).filter("asetpts", "PTS-STARTPTS")
-
-        # Create fade-out portion of first half
-        first_fade = original_audio.stream.audio.filter(
-            "atrim", start=mid_point - fade_duration, end=mid_point
-        ).filter("apad", whole_dur=fade_duration)
-
-        # Prepare insert audio's fade in
-        insert_fade_in = (
-            ads[0]
-            .filter("atrim", start=0, end=fade_duration)
-            .filter("asetpts", "PTS-STARTPTS")
-            .filter("apad", whole_dur=fade_duration)
-        )
+def _matching_pcm(
+    original_audio: StreamAndProbe, ad: StreamAndProbe
+) -> tuple[pcm_cache.DecodedAudio, pcm_cache.DecodedAudio] | None:
+    """Get the decoded samples of the music and ad, if they can be mixed.
 
-        # Create first crossfade
-        first_crossfade = ffmpeg.filter(
-            [first_fade, insert_fade_in], "acrossfade", d=fade_duration
-        )
+    Args:
+        original_audio (StreamAndProbe): Music the ad is inserted into
+        ad (StreamAndProbe): Advertisement to insert
 
-        # Get the main portion of insert audio (excluding fade regions)
-        insert_main = (
-            ads[1]
-            .filter("atrim", start=fade_duration, end=ad_duration - fade_duration)
-            .filter("asetpts", "PTS-STARTPTS")
-        )
+    Returns:
+        tuple[DecodedAudio, DecodedAudio] | None: Decoded samples of the
+            music and the ad, or None unless both are decoded with the same
+            sample rate and channels
+    """
+    music, ad_pcm = original_audio.pcm, ad.pcm
+    if music is None or ad_pcm is None:
+        return None
+    if (ad_pcm.sample_rate, ad_pcm.channels) != (music.sample_rate, music.channels):
+        return None
+    return music, ad_pcm
 
-        # Prepare insert audio's fade out
-        insert_fade_out = (
-            ads[2]
-            .filter("atrim", start=ad_duration - fade_duration, end=ad_duration)
-            .filter("asetpts", "PTS-STARTPTS")
-            .filter("apad", whole_dur=fade_duration)
-        )
 
-        # Create second half start (for fade in)
-        second_fade = (
-            original_audio.stream.audio.filter(
-                "atrim", start=mid_point, end=mid_point + fade_duration
-            )
-            .filter("asetpts", "PTS-STARTPTS")
-            .filter("apad", whole_dur=fade_duration)
-        )
+def _pcm_pipe(like: pcm_cache.DecodedAudio):
+    """Get an ffmpeg input that reads samples mixed by crossfade from stdin.
 
-        # Create second crossfade
-        second_crossfade = ffmpeg.filter(
-            [insert_fade_out, second_fade], "acrossfade", d=fade_duration
-        )
+    Args:
+        like (DecodedAudio): Decoded audio with the samples' rate and channels
 
-        # Get remainder of second half
-        second_half = original_audio.stream.audio.filter(
-            "atrim", start=mid_point + fade_duration, end=original_audio.duration()
-        ).filter("asetpts", "PTS-STARTPTS")
-
-        # Concatenate all pieces
-        streams = [
-            first_half,
-            first_crossfade,
-            insert_main,
-            second_crossfade,
-            second_half,
-        ]
-        concat = ffmpeg.filter(streams, "concat", n=len(streams), v=0, a=1)
+    Returns:
+        ffmpeg audio stream -- this is an ffmpeg.FilterableStream but ffmpeg
+            doesn't expose that type
+    """
+    return ffmpeg.input(
+        "pipe:", f=crossfade.RAW_FORMAT, ar=like.sample_rate, ac=like.channels
+    ).audio
+
+
+def _insert_ad_graph(original_audio: StreamAndProbe, ad: StreamAndProbe):
+    """Build an ffmpeg filter graph that inserts an ad with cross-fades.
+
+    Args:
+        original_audio (StreamAndProbe): Original audio content
+        ad (StreamAndProbe): Advertisement to insert
+
+    Returns:
+        The concatenated audio -- this is an ffmpeg.FilterableStream but
+            ffmpeg doesn't expose that type
+    """
+    mid_point = original_audio.duration() / 2
+    ad_duration = ad.duration()
+    fade_duration = FADE_DURATION_SECONDS
+
+    ads = _matched_ad_streams(original_audio, ad, 3)
+    music = _audio_input(original_audio)
+
+    # Create first half (end slightly early for crossfade)
+    first_half = music.filter("atrim", start=0, end=mid_point - fade_duration).filter(
+        "asetpts", "PTS-STARTPTS"
+    )
+
+    # Create fade-out portion of first half
+    first_fade = music.filter(
+        "atrim", start=mid_point - fade_duration, end=mid_point
+    ).filter("apad", whole_dur=fade_duration)
+
+    # Prepare insert audio's fade in
+    insert_fade_in = (
+        ads[0]
+        .filter("atrim", start=0, end=fade_duration)
+        .filter("asetpts", "PTS-STARTPTS")
+        .filter("apad", whole_dur=fade_duration)
+    )
+
+    # Create first crossfade
+    first_crossfade = ffmpeg.filter(
+        [first_fade, insert_fade_in], "acrossfade", d=fade_duration
+    )
+
+    # Get the main portion of insert audio (excluding fade regions)
+    insert_main = (
+        ads[1]
+        .filter("atrim", start=fade_duration, end=ad_duration - fade_duration)
+        .filter("asetpts", "PTS-STARTPTS")
+    )
+
+    # Prepare insert audio's fade out
+    insert_fade_out = (
+        ads[2]
+        .filter("atrim", start=ad_duration - fade_duration, end=ad_duration)
+        .filter("asetpts", "PTS-STARTPTS")
+        .filter("apad", whole_dur=fade_duration)
+    )
+
+    # Create second half start (for fade in)
+    second_fade = (
+        music.filter("atrim", start=mid_point, end=mid_point + fade_duration)
+        .filter("asetpts", "PTS-STARTPTS")
+        .filter("apad", whole_dur=fade_duration)
+    )
+
+    # Create second crossfade
+    second_crossfade = ffmpeg.filter(
+        [insert_fade_out, second_fade], "acrossfade", d=fade_duration
+    )
+
+    # Get remainder of second half
+    second_half = music.filter(
+        "atrim", start=mid_point + fade_duration, end=original_audio.duration()
+    ).filter("asetpts", "PTS-STARTPTS")
+
+    # Concatenate all pieces
+    streams = [
+        first_half,
+        first_crossfade,
+        insert_main,
+        second_crossfade,
+        second_half,
+    ]
+    return ffmpeg.filter(streams, "concat", n=len(streams), v=0, a=1)
+
+
+def _insert_ad(
+    original_audio: StreamAndProbe,
+    ad: StreamAndProbe,
+    target_size_bytes: int,
+    overhead_bytes: int,
+) -> bytes | None:
+    """Insert an advertisement into the middle of an audio file with cross-fading.
+
+    Performs the following steps:
+    1. Splits original audio at midpoint
+    2. Converts ad audio to match original format if needed
+    3. Creates cross-fades between original audio and ad
+    4. Concatenates all segments with proper timing
+    5. Encodes to MP3 with calculated bitrate for size control
+
+    When both have decoded samples at the same rate and channels, steps 1-4
+    are done in NumPy and the mixed samples piped to the encoder. Otherwise
+    they're done by an ffmpeg filter graph.
+
+    Args:
+        original_audio (StreamAndProbe): Original audio content
+        ad (StreamAndProbe): Advertisement to insert
+        target_size_bytes (int): Desired output file size
+        overhead_bytes (int): Bytes of tags that will be added to the frames
+
+    Returns:
+        bytes | None: The encoded MP3 frames, without any tags, if insertion
+            succeeded, None otherwise
+    """
+    target_bitrate = _full_encode_bitrate(
+        original_audio, ad, target_size_bytes, overhead_bytes
+    )
+
+    try:
+        pcm = _matching_pcm(original_audio, ad)
+        if pcm is not None:
+            music, ad_samples = pcm[0].samples, pcm[1].samples
+            fade = FADE_DURATION_SECONDS * pcm[0].sample_rate
+            ad_body = max(len(ad_samples) - 2 * fade, 0)
+            mixed = crossfade.splice(
+                music,
+                ad_samples,
+                0,
+                len(music) + ad_body,
+                len(music) // 2,
+                fade,
+                ad_body,
+            )
+            source = _pcm_pipe(pcm[0])
+            pcm_input = mixed.data.cast("B")
+        else:
+            source = _insert_ad_graph(original_audio, ad)
+            pcm_input = None
 
-        # Run the ffmpeg command
+        # Run the ffmpeg command, writing to stdout so nothing touches disk
         out = ffmpeg.output(
-            concat,
-            output_file_name,
+            source,
+            "pipe:",
+            format="mp3",
             acodec="libmp3lame",
             write_xing="1",
-            id3v2_version="3",
-            write_id3v1="1",
+            # Tags are added afterwards, from the original audio.
+            id3v2_version="0",
+            write_id3v1="0",
             movflags="+faststart",
             audio_bitrate=f"{target_bitrate}k",
             # Ensure we don't exceed target bitrate
@@ -239,151 +462,2582 @@ def _insert_ad(
             bufsize=f"{target_bitrate * 2}k",
         )
 
-        # Run the compilation with overwrites enabled
-        out.overwrite_output().run()
+        # Run the compilation, collecting the output
+        encoded, _ = out.run(input=pcm_input, capture_stdout=True, capture_stderr=True)
 
-        return True
+        return encoded
 
     except ffmpeg.Error as e:
         logger.error(f"FFmpeg error occurred: {e}")
-        return False
+        return None
 
 
-def _pad_mp3_to_size(filename: str, target_size: int) -> bool:
-    """Pad an MP3 file to an exact size using ID3 metadata.
-
-    Uses custom ID3 TXXX frames with precise overhead calculation to
-    achieve exact file sizes without relying on automatic padding.
+def _crossfade_region_graph(
+    original_audio: StreamAndProbe,
+    ad: StreamAndProbe,
+    start: int,
+    end: int,
+    mid_point: int,
+    fade: int,
+    ad_body: int,
+):
+    """Build an ffmpeg filter graph for part of the spliced timeline.
 
     Args:
-        filename (str): Path to the MP3 file to pad
-        target_size (int): Desired final size in bytes
+        original_audio (StreamAndProbe): Music the ad is inserted into
+        ad (StreamAndProbe): Advertisement to insert
+        start (int): First sample of the spliced timeline to produce
+        end (int): Sample of the spliced timeline to stop at
+        mid_point (int): Sample the ad is inserted at in the music
+        fade (int): Length of each cross-fade in samples
+        ad_body (int): Samples of the ad played between the cross-fades
 
     Returns:
-        bool: True if padding succeeded, False if target size cannot be achieved
+        The concatenated audio -- this is an ffmpeg.FilterableStream but
+            ffmpeg doesn't expose that type
     """
-    TXXX_FRAME_OVERHEAD = 10  # Bytes of overhead per TXXX frame
-
-    try:
-        initial_size = os.path.getsize(filename)
-        logger.debug(f"Initial size: {initial_size}")
+    # Number samples from the start of each input so they can be cut exactly.
+    musics = (
+        _audio_input(original_audio)
+        .filter("asetpts", "N/SR/TB")
+        .filter_multi_output("asplit", 4)
+    )
+    ad_splits = 3 if ad_body > 0 else 2
+    ads = (
+        _matched_ad_streams(original_audio, ad, 1)[0]
+        .filter("asetpts", "N/SR/TB")
+        .filter_multi_output("asplit", ad_splits)
+    )
 
-        if initial_size > target_size:
-            logger.error(
-                f"File already larger than target: {initial_size} > {target_size}"
-            )
-            return False
+    def music(index: int, first: int, last: int):
+        return (
+            musics[index]
+            .filter("atrim", start_sample=first, end_sample=last)
+            .filter("asetpts", "PTS-STARTPTS")
+        )
 
-        # Calculate exact padding needed accounting for known overhead
-        total_growth_needed = target_size - initial_size
-        padding_size = total_growth_needed - TXXX_FRAME_OVERHEAD
-        logger.debug(
-            f"Adding padding of {padding_size} bytes (with {TXXX_FRAME_OVERHEAD} bytes overhead)"
+    def ad_part(index: int, first: int, length: int):
+        return (
+            ads[index]
+            .filter("atrim", start_sample=first, end_sample=first + length)
+            .filter("asetpts", "PTS-STARTPTS")
+            .filter("apad", whole_len=length)
         )
 
-        # Apply padding
-        tags = mutagen.id3.ID3(filename)
-        if "TXXX:padding" in tags:
-            tags.pop("TXXX:padding")
+    streams = [
+        music(0, start, mid_point - fade),
+        ffmpeg.filter(
+            [music(1, mid_point - fade, mid_point), ad_part(0, 0, fade)],
+            "acrossfade",
+            ns=fade,
+        ),
+    ]
+    if ad_body > 0:
+        streams.append(ad_part(1, fade, ad_body))
+    streams += [
+        ffmpeg.filter(
+            [
+                ad_part(ad_splits - 1, fade + ad_body, fade),
+                music(2, mid_point, mid_point + fade),
+            ],
+            "acrossfade",
+            ns=fade,
+        ),
+        music(3, mid_point + fade, end - ad_body),
+    ]
+    return ffmpeg.filter(streams, "concat", n=len(streams), v=0, a=1)
+
+
+def _region_output_args(bitrate: int, sample_rate: int, channels: int) -> dict:
+    """Get the ffmpeg output options for encoding the region around an ad.
 
-        padding = b"\x00" * padding_size
-        tags.add(
-            mutagen.id3.TXXX(encoding=0, desc="padding", text=padding.decode("latin1"))
-        )
-        # Explicitly set padding to 0 to avoid mutagen doing any padding and messing with the size.
-        tags.save(filename, padding=lambda x: 0)
+    Args:
+        bitrate (int): CBR bitrate in kbps
+        sample_rate (int): Sample rate of the music
+        channels (int): Number of channels in the music
 
-        final_size = os.path.getsize(filename)
-        logger.debug(f"Final size: {final_size}")
+    Returns:
+        dict: Keyword arguments for ffmpeg.output
+    """
+    return {
+        "format": "mp3",
+        "acodec": "libmp3lame",
+        "audio_bitrate": f"{bitrate}k",
+        "ar": sample_rate,
+        "ac": channels,
+        "reservoir": 0,
+        "write_xing": 0,
+        "id3v2_version": 0,
+    }
+
+
+def _encode_crossfade_region(
+    original_audio: StreamAndProbe,
+    ad: StreamAndProbe,
+    start: int,
+    sample_count: int,
+    mid_point: int,
+    ad_body: int,
+    bitrate: int,
+    sample_rate: int,
+    channels: int,
+) -> bytes | None:
+    """Encode the part of the spliced audio that differs from the music.
+
+    Positions are in samples of the spliced timeline: music up to
+    `mid_point - fade`, a cross-fade into the ad, `ad_body` samples of the ad,
+    a cross-fade back and then the rest of the music from `mid_point + fade`.
+    The encoder's bit reservoir is disabled so every frame decodes on its own.
+    The audio is mixed in NumPy when decoded samples allow it, as in
+    _insert_ad, or by an ffmpeg filter graph otherwise.
 
-        if final_size == target_size:
-            logger.info(f"Hit target: {final_size} == {target_size}")
-            return True
+    Args:
+        original_audio (StreamAndProbe): Music the ad is inserted into
+        ad (StreamAndProbe): Advertisement to insert
+        start (int): First sample of the spliced timeline to encode
+        sample_count (int): Number of samples to encode
+        mid_point (int): Sample the ad is inserted at in the music
+        ad_body (int): Samples of the ad played between the cross-fades
+        bitrate (int): CBR bitrate in kbps
+        sample_rate (int): Sample rate of the music
+        channels (int): Number of channels in the music
+
+    Returns:
+        bytes | None: Raw MP3 frames, or None if ffmpeg failed
+    """
+    fade = FADE_DURATION_SECONDS * sample_rate
+    end = start + sample_count
+
+    try:
+        pcm = _matching_pcm(original_audio, ad)
+        if pcm is not None:
+            mixed = crossfade.splice(
+                pcm[0].samples, pcm[1].samples, start, end, mid_point, fade, ad_body
+            )
+            source = _pcm_pipe(pcm[0])
+            pcm_input = mixed.data.cast("B")
         else:
-            logger.error(
-                f"Failed to hit target: got {final_size}, wanted {target_size}"
+            source = _crossfade_region_graph(
+                original_audio, ad, start, end, mid_point, fade, ad_body
             )
-            return False
+            pcm_input = None
+        out = ffmpeg.output(
+            source, "pipe:", **_region_output_args(bitrate, sample_rate, channels)
+        )
+        encoded, _ = out.run(input=pcm_input, capture_stdout=True, capture_stderr=True)
+        return encoded
+
+    except ffmpeg.Error as e:
+        logger.error(f"FFmpeg error occurred: {e}")
+        return None
 
-    except Exception as e:
-        logger.error(f"Error padding file: {e}")
-        return False
 
+def _encode_crossfade_regions(
+    original_audio: StreamAndProbe,
+    jobs: list[tuple[StreamAndProbe, "_SplicePlan"]],
+) -> list[bytes] | None:
+    """Encode the regions around several ads in a single ffmpeg run.
 
-class AudioSplicer:
-    """Handles audio processing and caching for ad insertion.
+    Each region is mixed in NumPy into one buffer, which is piped to ffmpeg
+    once and split into an encoder per ad, so a batch costs one process and
+    one pass over its input rather than one of each per ad. Every ad must
+    have decoded samples matching the music's.
 
-    This class manages the process of inserting advertisements into audio streams
-    while maintaining exact file sizes. It caches processed audio to avoid
-    redundant processing of identical combinations.
+    Args:
+        original_audio (StreamAndProbe): Music the ads are inserted into
+        jobs (list[tuple[StreamAndProbe, _SplicePlan]]): Each ad and the plan
+            for splicing it
 
-    Example:
-        ```python
-        splicer = AudioSplicer()
-        result = splicer.insert_ad_and_pad(original, ad, target_size)
-        ```
+    Returns:
+        list[bytes] | None: Raw MP3 frames of each region, in order, or None
+            if ffmpeg failed
     """
+    music = original_audio.pcm
+    assert music is not None, "Batches need decoded music, fix callers"
+    fade = FADE_DURATION_SECONDS * music.sample_rate
 
-    def __init__(self):
-        """Initialize the AudioSplicer with an empty cache.
-        
-        The cache stores processed audio to avoid redundant processing of 
-        identical audio and ad combinations.
-        """
-        # Cache maps from (original_file_name, ad_file_name) -> bytes_for_ad_inserted_mp3
-        self.cache: dict[tuple[str, str], bytes] = {}
+    mixed = np.empty(
+        (sum(plan.sample_count for _, plan in jobs), music.channels), np.float32
+    )
+    bounds = []
+    position = 0
+    for ad, plan in jobs:
+        pcm = _matching_pcm(original_audio, ad)
+        assert pcm is not None, "Batched ads need matching decoded samples"
+        end = position + plan.sample_count
+        crossfade.splice(
+            music.samples,
+            pcm[1].samples,
+            plan.start,
+            plan.start + plan.sample_count,
+            plan.mid_point,
+            fade,
+            plan.ad_body,
+            out=mixed[position:end],
+        )
+        bounds.append((position, end))
+        position = end
+
+    # Each encoder writes to its own pipe, read back in memory as it runs.
+    pipes = [os.pipe() for _ in jobs]
+    # Number samples from the start of the input so they can be cut exactly.
+    splits = (
+        _pcm_pipe(music)
+        .filter("asetpts", "N/SR/TB")
+        .filter_multi_output("asplit", len(jobs))
+    )
+    outputs = [
+        ffmpeg.output(
+            splits[i]
+            .filter("atrim", start_sample=first, end_sample=last)
+            .filter("asetpts", "PTS-STARTPTS"),
+            f"pipe:{write_fd}",
+            **_region_output_args(plan.bitrate, music.sample_rate, music.channels),
+        )
+        for i, ((_, plan), (first, last), (_, write_fd)) in enumerate(
+            zip(jobs, bounds, pipes)
+        )
+    ]
+    try:
+        return _run_to_pipes(
+            ffmpeg.merge_outputs(*outputs).compile(), mixed.data.cast("B"), pipes
+        )
+    except OSError as e:
+        logger.error(f"Failed to batch encode regions: {e}")
+        return None
 
-    def insert_ad_and_pad(
-        self,
-        original_audio: StreamAndProbe,
-        ad: StreamAndProbe,
-        target_size_bytes: int,
-    ) -> bytes:
-        """Process audio with ad insertion and exact size control.
 
-        Inserts an advertisement into the original audio, applying cross-fades
-        and ensuring the output matches the target size exactly. Uses caching
-        to improve performance for repeated combinations.
+def _read_pipe(fd: int) -> bytes:
+    """Read a pipe until it's closed, then close it.
 
-        Args:
-            original_audio (StreamAndProbe): Original audio content
-            ad (StreamAndProbe): Advertisement to insert
-            target_size_bytes (int): Required output file size
+    Args:
+        fd (int): Read end of the pipe
 
-        Returns:
-            bytes: Processed audio data matching target size
+    Returns:
+        bytes: Everything written to the pipe
+    """
+    with open(fd, "rb") as f:
+        return f.read()
 
-        Note:
-            Results are cached using original and ad filenames as keys
-        """
-        # Check if we already have the cached media.
-        original_audio_file_name = original_audio.probe["format"]["filename"]
-        ad_file_name = ad.probe["format"]["filename"]
-        if (original_audio_file_name, ad_file_name) in self.cache:
-            logger.debug(
-                f"Using cached media for {original_audio_file_name} and {ad_file_name}"
-            )
-            return self.cache[(original_audio_file_name, ad_file_name)]
 
-        # Use a tempfile to ensure we get a unique name. We'll clean it up
-        # manually, as otherwise we run into locking issues.
-        tmp = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
+def _run_to_pipes(
+    args: list[str], input_data: memoryview, pipes: list[tuple[int, int]]
+) -> list[bytes] | None:
+    """Run ffmpeg with each of its outputs written to a pipe of its own.
+
+    The pipes are read concurrently while the input is written, so no output
+    can fill its pipe and stall the others. Both ends of every pipe are
+    closed by the time this returns.
+
+    Args:
+        args (list[str]): ffmpeg command line, writing to "pipe:<fd>" for the
+            write end of each pipe
+        input_data (memoryview): Bytes to write to ffmpeg's stdin
+        pipes (list[tuple[int, int]]): Read and write ends of each pipe
+
+    Returns:
+        list[bytes] | None: What was written to each pipe, in order, or None
+            if ffmpeg failed
+
+    Raises:
+        OSError: If ffmpeg can't be started
+    """
+    write_fds = [write_fd for _, write_fd in pipes]
+    try:
         try:
-            tmp.close()  # Close the file immediately, we only care it's created.
-            logger.debug(f"Audio file name: {tmp.name}")
-            _insert_ad(tmp.name, original_audio, ad, target_size_bytes)
-            _pad_mp3_to_size(tmp.name, target_size_bytes)
-            # We need to open the file since our overwrites won't be reflected if we read from tmp.
-            with open(tmp.name, "rb") as f:
-                data = f.read()
-                self.cache[(original_audio_file_name, ad_file_name)] = data
-                logger.debug(
-                    f"Cached media for {original_audio_file_name} and {ad_file_name}"
-                )
-                return data
+            process = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                pass_fds=write_fds,
+            )
         finally:
-            # Ensure the file is removed.
-            try:
-                os.unlink(tmp.name)
-            except FileNotFoundError:
-                pass
+            # ffmpeg holds the only write ends now, so reads end when it exits.
+            for write_fd in write_fds:
+                os.close(write_fd)
+    except BaseException:
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+        raise
+
+    with concurrent.futures.ThreadPoolExecutor(len(pipes)) as readers:
+        reads = [readers.submit(_read_pipe, read_fd) for read_fd, _ in pipes]
+        # Any bytes-like input works, so the samples aren't copied to bytes.
+        _, stderr = process.communicate(input=input_data)  # type: ignore[arg-type]
+        encoded = [read.result() for read in reads]
+    if process.returncode != 0:
+        logger.error(f"FFmpeg error occurred: {stderr.decode(errors='replace')}")
+        return None
+    return encoded
+
+
+def _repack_region(
+    encoded: mp3_frames.Mp3Frames,
+    first: int,
+    headers: list[mp3_frames.FrameHeader],
+    reservoir: bytes,
+) -> bytes:
+    """Rebuild encoded frames so they end with another stream's reservoir.
+
+    The music frames that follow a splice may start their main data in the
+    frames before them. Those bytes are placed at the very end of the
+    rebuilt frames, and each frame's main data is moved earlier (by
+    adjusting main_data_begin) to make room for them.
+
+    Args:
+        encoded (Mp3Frames): Frames encoded without the bit reservoir
+        first (int): Index of the first encoded frame to use
+        headers (list[FrameHeader]): Headers to rebuild the frames with, these
+            set the size of each frame
+        reservoir (bytes): Bytes the following frames expect before them
+
+    Returns:
+        bytes: The rebuilt frames
+
+    Raises:
+        ValueError: If the frames can't fit both their data and the reservoir
+    """
+    main_data = [encoded.main_data(first + i) for i in range(len(headers))]
+    payload_starts = []
+    position = 0
+    for header in headers:
+        payload_starts.append(position)
+        position += header.length - header.payload_offset
+    stream = bytearray(position)
+
+    # Work backwards, moving each frame's data before what follows it.
+    boundary = position - len(reservoir)
+    stream[boundary:] = reservoir
+    begins = [0] * len(headers)
+    for i in reversed(range(len(headers))):
+        start = min(payload_starts[i], boundary - len(main_data[i]))
+        begins[i] = payload_starts[i] - start
+        if start < 0 or begins[i] > mp3_frames.max_main_data_begin(headers[i]):
+            raise ValueError("Not enough room in the frames for the reservoir")
+        stream[start : start + len(main_data[i])] = main_data[i]
+        boundary = start
+
+    frames = []
+    for i, header in enumerate(headers):
+        side_info = mp3_frames.with_main_data_begin(
+            header, encoded.side_info(first + i), begins[i]
+        )
+        payload_end = payload_starts[i] + header.length - header.payload_offset
+        frames.append(
+            mp3_frames.build_frame(
+                header, side_info, bytes(stream[payload_starts[i] : payload_end])
+            )
+        )
+    return b"".join(frames)
+
+
+def _region_bitrate(
+    is_mpeg1: bool,
+    sample_rate: int,
+    frame_count: int,
+    reservoir_size: int,
+    budget: int,
+    min_bitrate: int,
+) -> tuple[int, int, int] | None:
+    """Pick the bitrate for re-encoded frames so they fit in a byte budget.
+
+    All re-encoded frames are padded so their size is known before encoding.
+    The last few are widened to the largest frame size to make room for the
+    bit reservoir of the frames after them.
+
+    Args:
+        is_mpeg1 (bool): True for MPEG-1, False for MPEG-2/2.5
+        sample_rate (int): Sample rate of the music in Hz
+        frame_count (int): Number of frames to re-encode
+        reservoir_size (int): Reservoir bytes needed by the following frames
+        budget (int): Maximum size of the re-encoded frames in bytes
+        min_bitrate (int): Lowest acceptable bitrate in kbps
+
+    Returns:
+        tuple[int, int, int] | None: Bitrate in kbps, the number of widened
+            frames and the total size of the frames, or None if nothing fits
+    """
+    for rate in reversed(mp3_frames.bitrates(is_mpeg1)):
+        if rate < min_bitrate:
+            break
+        sized = _region_size(is_mpeg1, sample_rate, frame_count, reservoir_size, rate)
+        if sized is not None and sized[1] <= budget:
+            return rate, *sized
+    return None
+
+
+def _region_size(
+    is_mpeg1: bool,
+    sample_rate: int,
+    frame_count: int,
+    reservoir_size: int,
+    bitrate: int,
+) -> tuple[int, int] | None:
+    """Calculate the size of re-encoded frames at a bitrate.
+
+    Args:
+        is_mpeg1 (bool): True for MPEG-1, False for MPEG-2/2.5
+        sample_rate (int): Sample rate of the music in Hz
+        frame_count (int): Number of frames to re-encode
+        reservoir_size (int): Reservoir bytes needed by the following frames
+        bitrate (int): Bitrate of the frames in kbps
+
+    Returns:
+        tuple[int, int] | None: The number of widened frames and the total
+            size of the frames, or None if they can't hold the reservoir
+    """
+    widest = mp3_frames.frame_length(
+        is_mpeg1, mp3_frames.bitrates(is_mpeg1)[-1], sample_rate, 1
+    )
+    length = mp3_frames.frame_length(is_mpeg1, bitrate, sample_rate, 1)
+    if reservoir_size == 0:
+        widened = 0
+    elif widest == length:
+        return None
+    else:
+        widened = -(-reservoir_size // (widest - length))
+    if widened > frame_count:
+        return None
+    return widened, (frame_count - widened) * length + widened * widest
+
+
+def _splice_overhead(music: mp3_frames.Mp3Frames) -> int:
+    """Calculate the bytes a splice of some music needs besides audio frames.
+
+    Args:
+        music (Mp3Frames): Music the ad is spliced into
+
+    Returns:
+        int: Size of the smallest tag, Xing/LAME frame and trailing tags
+    """
+    return (
+        id3_padding.minimum_size(music.tag_bytes())
+        + (len(music.xing.frame) if music.xing else 0)
+        + len(music.trailer_bytes())
+    )
+
+
+def _splice_layout(
+    sample_count: int,
+    decoder_skip: int,
+    samples_per_frame: int,
+    sample_rate: int,
+    ad_duration: float,
+) -> tuple[int, int, int, int] | None:
+    """Work out which music frames a splice copies and which it re-encodes.
+
+    Args:
+        sample_count (int): Samples per channel of music
+        decoder_skip (int): Samples decoders skip at the start of the music
+        samples_per_frame (int): Samples per frame of the music
+        sample_rate (int): Sample rate of the music in Hz
+        ad_duration (float): Duration of the ad in seconds
+
+    Returns:
+        tuple[int, int, int, int] | None: The end of the frames copied before
+            the ad, the start of those copied after it, the number of frames
+            re-encoded in between and the samples of ad between the fades.
+            None if the music is too short to splice.
+    """
+    fade = FADE_DURATION_SECONDS * sample_rate
+    mid_point = sample_count // 2
+    # The ad body is rounded to whole frames so the music after it stays
+    # frame aligned.
+    ad_samples = round(ad_duration * sample_rate)
+    ad_body = (
+        max(0, round((ad_samples - 2 * fade) / samples_per_frame)) * samples_per_frame
+    )
+
+    # Frames [0, head_end) and [tail_start, ...) of the music are copied.
+    head_end = (mid_point - fade + decoder_skip) // samples_per_frame - _GUARD_FRAMES
+    tail_start = (
+        -(-(mid_point + fade + decoder_skip) // samples_per_frame) + _GUARD_FRAMES
+    )
+    frame_count = mp3_frames.lame_frame_count(sample_count, samples_per_frame)
+    if head_end < 1 or tail_start >= frame_count:
+        return None
+    region_frames = tail_start - head_end + ad_body // samples_per_frame
+    return head_end, tail_start, region_frames, ad_body
+
+
+def _source_sizes(
+    source: mp3_frames.Mp3Frames, ad: StreamAndProbe
+) -> tuple[int, dict[int | None, tuple[int, int, int]]] | None:
+    """Measure the frames a splice would copy from each encoding of the music.
+
+    Sizes of re-encodes are worked out exactly, from the frames libmp3lame
+    will write, without encoding anything.
+
+    Args:
+        source (Mp3Frames): Frames of the original music file
+        ad (StreamAndProbe): Advertisement to insert
+
+    Returns:
+        tuple[int, dict[int | None, tuple[int, int, int]]] | None: The number
+            of frames re-encoded around the ad, and for each encoding's
+            bitrate in kbps (None for the original frames) the bytes of frames
+            before and after the ad and of reservoir the frames after the ad
+            need. None if the music is too short to splice.
+    """
+    is_mpeg1 = source.is_mpeg1
+    sample_rate = source.sample_rate
+    frame_samples = source.samples_per_frame
+    layout = _splice_layout(
+        source.sample_count(),
+        source.decoder_skip(),
+        frame_samples,
+        sample_rate,
+        ad.duration(),
+    )
+    if layout is None or layout[1] >= len(source.offsets):
+        return None
+    head_end, tail_start, region_frames, _ = layout
+    frame_count = len(source.offsets)
+
+    sizes: dict[int | None, tuple[int, int, int]] = {
+        None: (
+            source.offsets[head_end] - source.offsets[0],
+            source.audio_end - source.offsets[tail_start],
+            len(
+                source.reservoir_bytes(tail_start, source.reservoir_needed(tail_start))
+            ),
+        )
+    }
+    # Re-encodes only line up with the original if it has the same timing.
+    if (
+        source.xing is not None
+        and source.xing.lame_offset is not None
+        and source.decoder_skip()
+        == mp3_frames.LAME_ENCODER_DELAY + mp3_frames.DECODER_DELAY
+        and frame_count
+        == mp3_frames.lame_frame_count(source.sample_count(), frame_samples)
+    ):
+        # The reservoir isn't known until the music is encoded, so allow for
+        # the most there could be.
+        reservoir_size = mp3_frames.max_main_data_begin(source.headers[0])
+        for rate in mp3_frames.bitrates(is_mpeg1):
+            sizes[rate] = (
+                mp3_frames.lame_cbr_size(is_mpeg1, rate, sample_rate, 0, head_end),
+                mp3_frames.lame_cbr_size(
+                    is_mpeg1, rate, sample_rate, tail_start, frame_count
+                ),
+                reservoir_size,
+            )
+    return region_frames, sizes
+
+
+def _music_rates(
+    sizes: dict[int | None, tuple[int, int, int]], min_bitrate: int
+) -> list[int | None]:
+    """Get the encodings of the music that frames may be copied from.
+
+    Both sizing and choosing sources go through this, so episodes are only
+    ever sized for music that will actually be used.
+
+    Args:
+        sizes (dict[int | None, tuple[int, int, int]]): Sizes from
+            _source_sizes, keyed by bitrate in kbps (None for the original)
+        min_bitrate (int): Lowest acceptable bitrate in kbps
+
+    Returns:
+        list[int | None]: The original and the re-encodes of at least
+            min_bitrate
+    """
+    return [rate for rate in sizes if rate is None or rate >= min_bitrate]
+
+
+def _choose_sources(
+    source: mp3_frames.Mp3Frames,
+    ad: StreamAndProbe,
+    target_size_bytes: int,
+    min_bitrate: int,
+) -> tuple[int | None, int | None] | None:
+    """Pick which encodings of the music to copy frames from around the ad.
+
+    The frames before and after the ad can each come from the original file
+    or from a CBR re-encode of it, so mixing two bitrates can land much closer
+    to the target than any one bitrate. Re-encodes below min_bitrate aren't
+    considered, so the music never drops below the quality asked of the ad.
+    Original frames are preferred as they avoid a generation of loss, then
+    whichever choice leaves the least padding.
+
+    Args:
+        source (Mp3Frames): Frames of the original music file
+        ad (StreamAndProbe): Advertisement to insert
+        target_size_bytes (int): Desired output file size
+        min_bitrate (int): Lowest acceptable bitrate for the re-encoded
+            frames and music in kbps
+
+    Returns:
+        tuple[int | None, int | None] | None: Bitrates in kbps of the music
+            before and after the ad, None meaning the original frames, or None
+            if nothing fits
+    """
+    sources = _source_sizes(source, ad)
+    if sources is None:
+        return None
+    region_frames, sizes = sources
+    is_mpeg1 = source.is_mpeg1
+    sample_rate = source.sample_rate
+
+    overhead = _splice_overhead(source)
+    best: tuple[int | None, int | None] | None = None
+    best_score = (-1, 0)
+    rates = _music_rates(sizes, min_bitrate)
+    for head_rate in rates:
+        for tail_rate in rates:
+            head_size = sizes[head_rate][0]
+            _, tail_size, reservoir = sizes[tail_rate]
+            budget = target_size_bytes - overhead - head_size - tail_size
+            choice = _region_bitrate(
+                is_mpeg1, sample_rate, region_frames, reservoir, budget, min_bitrate
+            )
+            if choice is None:
+                continue
+            originals = (head_rate is None) + (tail_rate is None)
+            score = (originals, choice[2] - budget)
+            if score > best_score:
+                best, best_score = (head_rate, tail_rate), score
+    if best is not None:
+        logger.debug(
+            f"Copying music at {best}, expected padding: {-best_score[1]} bytes"
+        )
+    return best
+
+
+def _encode_music(
+    original_audio: StreamAndProbe, source: mp3_frames.Mp3Frames, bitrate: int
+) -> mp3_frames.Mp3Frames | None:
+    """Re-encode the music at a constant bitrate, ready for splicing.
+
+    The result keeps the original's tags and Xing/LAME header (updated for
+    the new frames), so it can be spliced exactly like the original file.
+
+    Args:
+        original_audio (StreamAndProbe): Music to encode
+        source (Mp3Frames): Frames of the original music file
+        bitrate (int): Bitrate in kbps
+
+    Returns:
+        Mp3Frames | None: The encoded music, or None if it can't be made
+    """
+    if source.xing is None or source.xing.lame_offset is None:
+        # Without a LAME tag there's nowhere to record the new encoder delay.
+        return None
+    try:
+        encoded, _ = ffmpeg.output(
+            _audio_input(original_audio),
+            "pipe:",
+            format="mp3",
+            acodec="libmp3lame",
+            audio_bitrate=f"{bitrate}k",
+            write_xing=0,
+            id3v2_version=0,
+        ).run(capture_stdout=True, capture_stderr=True)
+        frames = mp3_frames.Mp3Frames(encoded)
+    except ffmpeg.Error as e:
+        logger.error(f"FFmpeg error occurred: {e}")
+        return None
+    except ValueError as e:
+        logger.error(f"Failed to parse encoded music: {e}")
+        return None
+
+    end_padding = (
+        len(frames.offsets) * frames.samples_per_frame
+        - mp3_frames.LAME_ENCODER_DELAY
+        - source.sample_count()
+    )
+    header_frame = source.xing.rebuild(
+        frames.headers, gapless=(mp3_frames.LAME_ENCODER_DELAY, end_padding)
+    )
+    return mp3_frames.Mp3Frames(
+        source.tag_bytes()
+        + header_frame
+        + frames.frame_bytes(0, len(frames.offsets))
+        + source.trailer_bytes()
+    )
+
+
+@dataclass(frozen=True)
+class _SplicePlan:
+    """How an ad is spliced into encoded music, worked out before encoding.
+
+    Attributes:
+        music (Mp3Frames): Encoded music to copy the frames before the ad from
+        tail_music (Mp3Frames): Encoded music to copy the frames after the ad
+            from
+        head_end (int): End of the frames copied before the ad
+        tail_start (int): Start of the frames copied after the ad
+        region_frames (int): Number of frames re-encoded in between
+        widened (int): Number of re-encoded frames widened to the largest
+            frame size
+        bitrate (int): Bitrate of the re-encoded frames in kbps
+        reservoir (bytes): Reservoir bytes the frames after the ad need
+        priming_frames (int): Frames encoded before the region and dropped
+        start (int): First sample of the spliced timeline to encode
+        sample_count (int): Number of samples to encode
+        mid_point (int): Sample the ad is inserted at in the music
+        ad_body (int): Samples of the ad played between the cross-fades
+        region_size (int): Bytes of the re-encoded frames
+        padding (int): Bytes of padding needed to reach the target size
+    """
+
+    music: mp3_frames.Mp3Frames
+    tail_music: mp3_frames.Mp3Frames
+    head_end: int
+    tail_start: int
+    region_frames: int
+    widened: int
+    bitrate: int
+    reservoir: bytes
+    priming_frames: int
+    start: int
+    sample_count: int
+    mid_point: int
+    ad_body: int
+    region_size: int
+    padding: int
+
+
+def _plan_splice(
+    music: mp3_frames.Mp3Frames,
+    ad: StreamAndProbe,
+    target_size_bytes: int,
+    min_bitrate: int,
+    tail_music: mp3_frames.Mp3Frames | None = None,
+) -> _SplicePlan | None:
+    """Work out how to splice an ad into encoded music within a target size.
+
+    Args:
+        music (Mp3Frames): Encoded music to copy frames from
+        ad (StreamAndProbe): Advertisement to insert
+        target_size_bytes (int): Desired output file size
+        min_bitrate (int): Lowest acceptable bitrate for the re-encoded
+            frames in kbps
+        tail_music (Mp3Frames | None, optional): Encoding of the music to
+            copy the frames after the ad from, which must have the same
+            frame timing as `music`. Defaults to None, which uses `music`.
+
+    Returns:
+        _SplicePlan | None: The plan, or None if the splice won't fit in the
+            target size
+    """
+    sample_rate = music.sample_rate
+    frame_samples = music.samples_per_frame
+    skip = music.decoder_skip()
+    layout = _splice_layout(
+        music.sample_count(), skip, frame_samples, sample_rate, ad.duration()
+    )
+    if tail_music is None:
+        tail_music = music
+    if layout is None or layout[1] >= len(tail_music.offsets):
+        return None
+    head_end, tail_start, region_frames, ad_body = layout
+
+    reservoir = tail_music.reservoir_bytes(
+        tail_start, tail_music.reservoir_needed(tail_start)
+    )
+    header_frame_size = len(music.xing.frame) if music.xing else 0
+    fixed_size = (
+        id3_padding.minimum_size(music.tag_bytes())
+        + header_frame_size
+        + music.offsets[head_end]
+        - music.offsets[0]
+        + tail_music.audio_end
+        - tail_music.offsets[tail_start]
+        + len(music.trailer_bytes())
+    )
+    budget = target_size_bytes - fixed_size
+    choice = _region_bitrate(
+        music.is_mpeg1,
+        sample_rate,
+        region_frames,
+        len(reservoir),
+        budget,
+        min_bitrate,
+    )
+    if choice is None:
+        logger.info("Spliced frames won't fit in the target size")
+        return None
+    bitrate, widened, region_size = choice
+    logger.info(
+        f"Splicing at {bitrate}k, expected padding: {budget - region_size} bytes"
+    )
+
+    # The encoder starts with its own delay, so encode a few frames early and
+    # drop them. Encoder input sample j lands on output sample j + encoder_delay.
+    encoder_delay = mp3_frames.LAME_ENCODER_DELAY + mp3_frames.DECODER_DELAY
+    priming_frames = -(-encoder_delay // frame_samples) + 1
+    return _SplicePlan(
+        music=music,
+        tail_music=tail_music,
+        head_end=head_end,
+        tail_start=tail_start,
+        region_frames=region_frames,
+        widened=widened,
+        bitrate=bitrate,
+        reservoir=reservoir,
+        priming_frames=priming_frames,
+        start=(head_end - priming_frames) * frame_samples + encoder_delay - skip,
+        sample_count=(region_frames + 2 * priming_frames) * frame_samples,
+        mid_point=music.sample_count() // 2,
+        ad_body=ad_body,
+        region_size=region_size,
+        padding=budget - region_size,
+    )
+
+
+def _region_bitrate_index(plan: _SplicePlan, frame: int) -> int:
+    """Get the bitrate index of one of the re-encoded frames of a splice.
+
+    Args:
+        plan (_SplicePlan): Plan for the splice
+        frame (int): Index of the frame within the re-encoded region
+
+    Returns:
+        int: The frame's bitrate index, the largest for widened frames
+    """
+    if frame >= plan.region_frames - plan.widened:
+        return mp3_frames.MAX_BITRATE_INDEX
+    return mp3_frames.bitrate_index(plan.music.is_mpeg1, plan.bitrate)
+
+
+def _splice_header_frame(plan: _SplicePlan) -> bytes:
+    """Build the Xing/LAME header frame of a splice from its plan.
+
+    The header frame only records the number, sizes and bitrates of the
+    frames, which the plan fixes, so it's known before anything is encoded.
+
+    Args:
+        plan (_SplicePlan): Plan for the splice
+
+    Returns:
+        bytes: The header frame, or nothing if the music doesn't have one
+    """
+    music, tail_music = plan.music, plan.tail_music
+    if music.xing is None:
+        return b""
+    template = music.headers[plan.head_end]
+    region_headers = [
+        template.with_bitrate(_region_bitrate_index(plan, i), 1)
+        for i in range(plan.region_frames)
+    ]
+    return music.xing.rebuild(
+        music.headers[: plan.head_end]
+        + region_headers
+        + tail_music.headers[plan.tail_start :]
+    )
+
+
+@dataclass(frozen=True)
+class _ByteLayout:
+    """Where each part of a frame-level splice lies in the padded file.
+
+    Everything but the re-encoded frames around the ad is fixed by the plan,
+    so it's known before anything is encoded.
+
+    Attributes:
+        before (ComposedAudio): The leading tag, header frame and music
+            frames copied before the ad
+        region_size (int): Bytes of re-encoded frames around the ad
+        after (ComposedAudio): The music frames copied after the ad, the
+            padding and any trailing tags
+    """
+
+    before: ComposedAudio
+    region_size: int
+    after: ComposedAudio
+
+    @property
+    def region_start(self) -> int:
+        """Offset of the first re-encoded frame."""
+        return len(self.before)
+
+    @property
+    def region_end(self) -> int:
+        """Offset just past the last re-encoded frame."""
+        return len(self.before) + self.region_size
+
+    @property
+    def size(self) -> int:
+        """Size of the padded file."""
+        return self.region_end + len(self.after)
+
+    def read(self, start: int, end: int) -> ComposedAudio | None:
+        """Get bytes [start, end) of the file, if they don't need encoding.
+
+        Args:
+            start (int): Offset of the first byte
+            end (int): Offset just past the last byte, clamped to the size
+
+        Returns:
+            ComposedAudio | None: The bytes, or None if they overlap the
+                re-encoded frames
+        """
+        end = min(end, self.size)
+        if end <= self.region_start:
+            return self.before[start:end]
+        if start >= self.region_end:
+            return self.after[start - self.region_end : end - self.region_end]
+        return None
+
+    def compose(self, data: bytes | memoryview) -> ComposedAudio | None:
+        """Rebuild a render so it shares the music with other renders.
+
+        Only the re-encoded frames are copied out of the render, the rest
+        refers to the layout's buffers.
+
+        Args:
+            data (bytes | memoryview): The render
+
+        Returns:
+            ComposedAudio | None: The render, or None if it doesn't match the
+                layout
+        """
+        view = memoryview(data)
+        if (
+            len(view) != self.size
+            or view[: self.region_start] != self.before.tobytes()
+            or view[self.region_end :] != self.after.tobytes()
+        ):
+            return None
+        region = view[self.region_start : self.region_end].tobytes()
+        return ComposedAudio([*self.before.views(), region, *self.after.views()])
+
+
+def _byte_layout(plan: _SplicePlan) -> _ByteLayout:
+    """Lay out a frame-level splice as it'll be padded, from its plan.
+
+    Args:
+        plan (_SplicePlan): Plan for the splice
+
+    Returns:
+        _ByteLayout: The layout, sharing the music's buffers and the
+            padding's filler rather than copying them
+    """
+    music, tail_music = plan.music, plan.tail_music
+    version, flags, frames, _ = id3_padding.read_tag(music.tag_bytes())
+    padding = (
+        id3_padding.trailing_padding_parts(plan.padding)
+        if plan.padding >= id3_padding.TRAILING_PADDING_MIN_SIZE
+        else []
+    )
+    head = memoryview(music.data)[music.offsets[0] : music.offsets[plan.head_end]]
+    tail = memoryview(tail_music.data)[
+        tail_music.offsets[plan.tail_start] : tail_music.audio_end
+    ]
+    return _ByteLayout(
+        before=ComposedAudio(
+            [
+                id3_padding.leading_tag(frames, plan.padding, version, flags),
+                _splice_header_frame(plan),
+                head,
+            ]
+        ),
+        region_size=plan.region_size,
+        after=ComposedAudio([tail, *padding, music.trailer_bytes()]),
+    )
+
+
+def _finish_splice(plan: _SplicePlan, encoded: bytes) -> bytes | None:
+    """Assemble a splice from the music and the encoded region around the ad.
+
+    Args:
+        plan (_SplicePlan): Plan the region was encoded for
+        encoded (bytes): Raw MP3 frames of the region, priming included
+
+    Returns:
+        bytes | None: The spliced MP3 without its ID3v2 tag or trailing tags,
+            or None if the encoded frames can't be fitted in
+    """
+    music, tail_music = plan.music, plan.tail_music
+    try:
+        region_source = mp3_frames.Mp3Frames(encoded)
+        if len(region_source.offsets) < plan.priming_frames + plan.region_frames:
+            raise ValueError("Encoder produced too few frames")
+        template = music.headers[plan.head_end]
+        headers = [
+            region_source.headers[plan.priming_frames + i].with_bitrate(
+                _region_bitrate_index(plan, i), 1
+            )
+            for i in range(plan.region_frames)
+        ]
+        if any(h.channels != template.channels for h in headers):
+            raise ValueError("Encoder changed the channel count")
+        region = _repack_region(
+            region_source, plan.priming_frames, headers, plan.reservoir
+        )
+    except ValueError as e:
+        logger.error(f"Failed to splice frames: {e}")
+        return None
+
+    return (
+        _splice_header_frame(plan)
+        + music.frame_bytes(0, plan.head_end)
+        + region
+        + tail_music.frame_bytes(plan.tail_start, len(tail_music.offsets))
+    )
+
+
+def _splice_frames(
+    plan: _SplicePlan, original_audio: StreamAndProbe, ad: StreamAndProbe
+) -> bytes | None:
+    """Insert an advertisement by splicing MP3 frames.
+
+    Only a window around the ad is decoded and re-encoded: the cross-fades,
+    the ad itself and a few guard frames either side. The music frames before
+    and after that window are copied verbatim, and the Xing/LAME header is
+    rebuilt to describe the new frames.
+
+    Args:
+        plan (_SplicePlan): Plan for the splice, from _plan_splice
+        original_audio (StreamAndProbe): Original audio content
+        ad (StreamAndProbe): Advertisement to insert
+
+    Returns:
+        bytes | None: The spliced MP3 without its ID3v2 tag or trailing tags,
+            or None if encoding fails
+    """
+    encoded = _encode_crossfade_region(
+        original_audio,
+        ad,
+        plan.start,
+        plan.sample_count,
+        plan.mid_point,
+        plan.ad_body,
+        plan.bitrate,
+        plan.music.sample_rate,
+        plan.music.channels,
+    )
+    if encoded is None:
+        return None
+    return _finish_splice(plan, encoded)
+
+
+def _pad_mp3_to_size(
+    tag_source: bytes, audio: bytes, target_size: int, trailer: bytes = b""
+) -> bytes:
+    """Pad an MP3 to an exact size using ID3 metadata.
+
+    Keeps the frames of an existing ID3v2 tag in an unpadded leading tag, and
+    fills the rest of the target after the audio, before any trailing tags.
+    The leading tag and audio are then the same whatever the padding, so the
+    start of the file can be sent before the rest has been rendered.
+
+    Args:
+        tag_source (bytes): Data starting with the ID3v2 tag to keep, if any
+        audio (bytes): MP3 data to pad, without any tags
+        target_size (int): Desired final size in bytes
+        trailer (bytes, optional): Tags to keep at the end of the file, such
+            as ID3v1. Defaults to b"".
+
+    Returns:
+        bytes: The padded MP3, or the MP3 without padding if it's already
+            larger than the target
+    """
+    version, flags, frames, _ = id3_padding.read_tag(tag_source)
+    logger.debug(f"Initial size: {len(frames) + len(audio) + len(trailer)}")
+    try:
+        padded = id3_padding.pad_at_end(
+            frames, audio, trailer, target_size, version, flags
+        )
+    except ValueError as e:
+        logger.error(f"Failed to hit target {target_size}: {e}")
+        minimum_size = len(frames) + len(audio) + len(trailer) + 10
+        return id3_padding.pad_at_end(
+            frames, audio, trailer, minimum_size, version, flags
+        )
+    logger.info(f"Hit target: {len(padded)} == {target_size}")
+    return padded
+
+
+def _resident_size(data: bytes | ComposedAudio) -> int:
+    """Get the bytes a cached render holds that no other render shares."""
+    if isinstance(data, ComposedAudio):
+        return data.owned_bytes
+    return len(data)
+
+
+def _views(
+    data: bytes | memoryview | ComposedAudio, start: int = 0, end: int | None = None
+) -> list[memoryview]:
+    """Get views of a byte range of a render, without copying.
+
+    Args:
+        data (bytes | memoryview | ComposedAudio): The render
+        start (int, optional): Offset of the first byte. Defaults to 0.
+        end (int | None, optional): Offset just past the last byte. Defaults
+            to None, the end of the render.
+
+    Returns:
+        list[memoryview]: Views that together hold the range, in order
+    """
+    if isinstance(data, ComposedAudio):
+        return data.views(start, end)
+    return [memoryview(data)[start:end]]
+
+
+class AudioSplicer:
+    """Handles audio processing and caching for ad insertion.
+
+    This class manages the process of inserting advertisements into audio streams
+    while maintaining exact file sizes. It caches processed audio to avoid
+    redundant processing of identical combinations, within a byte budget.
+
+    Example:
+        ```python
+        splicer = AudioSplicer()
+        result = splicer.insert_ad_and_pad(original, ad, target_size)
+        # Or from a coroutine:
+        result = await splicer.insert_ad_and_pad_async(original, ad, target_size)
+        ```
+    """
+
+    def __init__(
+        self,
+        cache_budget_bytes: int = DEFAULT_CACHE_BUDGET_BYTES,
+        cache_dir: str | Path | None = None,
+        engine: render_engine.RenderEngine | None = None,
+        disk_budget_bytes: int = disk_cache.DEFAULT_BUDGET_BYTES,
+    ):
+        """Initialize the AudioSplicer with an empty cache.
+
+        The cache stores processed audio to avoid redundant processing of
+        identical audio and ad combinations.
+
+        Args:
+            cache_budget_bytes (int, optional): Most bytes of processed audio
+                to keep cached in memory. Defaults to DEFAULT_CACHE_BUDGET_BYTES.
+            cache_dir (str | Path | None, optional): Directory to persist
+                processed audio in across restarts. Defaults to None, which
+                only caches in memory, as does a directory that can't be
+                created or written, such as on a read-only filesystem.
+            engine (RenderEngine | None, optional): Process pool to render
+                in. Defaults to None, which renders on the calling thread.
+            disk_budget_bytes (int, optional): Most bytes of processed audio
+                to keep in cache_dir. Defaults to DEFAULT_BUDGET_BYTES.
+        """
+        # Cache maps from content key (see _cache_key) -> bytes_for_ad_inserted_mp3,
+        # with frame-level splices sharing the music between them.
+        self.cache: byte_cache.ByteBudgetCache[str, bytes | ComposedAudio] = (
+            byte_cache.ByteBudgetCache(cache_budget_bytes, size_of=_resident_size)
+        )
+        self.disk_cache: disk_cache.DiskCache | None = None
+        if cache_dir is not None:
+            try:
+                self.disk_cache = disk_cache.DiskCache(cache_dir, disk_budget_bytes)
+            except OSError as e:
+                logger.error(f"Caching in memory only, can't use {cache_dir}: {e}")
+        self.engine = engine
+        # Renders in progress, so concurrent requests for the same key share
+        # one render rather than each starting their own.
+        self._in_flight: dict[str, concurrent.futures.Future] = {}
+        self._in_flight_lock = threading.Lock()
+        # Runs renders for insert_ad_and_pad_async off the event loop.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix="audio-splicer"
+        )
+        # Byte layouts of renders, keyed like the caches. None marks renders
+        # that aren't frame-level splices.
+        self._layouts: dict[str, _ByteLayout | None] = {}
+        # Keys whose bytes have been served from their layout, under the same
+        # ETag as the render. Their renders must match the layout exactly.
+        self._served_layouts: set[str] = set()
+        # Music encodings that ads get spliced into. Maps from
+        # (original_file_name, bitrate) -> frames, where a bitrate of None is
+        # the original file. None values mark music that can't be spliced.
+        self.music_cache: dict[tuple[str, int | None], mp3_frames.Mp3Frames | None] = {}
+        # Music being read or encoded, so each encoding is only made once.
+        self._music_in_flight: dict[
+            tuple[str, int | None], concurrent.futures.Future
+        ] = {}
+
+    def _music_frames(
+        self, original_audio: StreamAndProbe, bitrate: int | None
+    ) -> mp3_frames.Mp3Frames | None:
+        """Get the music as MP3 frames, re-encoding it the first time it's used.
+
+        Re-encoding the whole track costs as much as a render, so with an
+        engine it's run as an engine job and counts against its queue.
+        Concurrent calls for the same encoding share one encode.
+
+        Args:
+            original_audio (StreamAndProbe): Music to get the frames of
+            bitrate (int | None): Bitrate in kbps to re-encode at, or None for
+                the original file
+
+        Returns:
+            Mp3Frames | None: The frames, or None if the music can't be spliced
+
+        Raises:
+            RenderQueueFull: If the music needs re-encoding but the engine is
+                busy
+        """
+        original_audio_file_name = original_audio.probe["format"]["filename"]
+        key = (original_audio_file_name, bitrate)
+        with self._in_flight_lock:
+            if key in self.music_cache:
+                return self.music_cache[key]
+            future = self._music_in_flight.get(key)
+            is_leader = future is None
+            if future is None:
+                future = concurrent.futures.Future()
+                self._music_in_flight[key] = future
+        if not is_leader:
+            return future.result()
+
+        try:
+            frames: mp3_frames.Mp3Frames | None = None
+            if bitrate is None:
+                try:
+                    with open(original_audio_file_name, "rb") as f:
+                        frames = mp3_frames.Mp3Frames(f.read())
+                except (OSError, ValueError) as e:
+                    logger.info(
+                        f"Can't splice frames of {original_audio_file_name}: {e}"
+                    )
+            else:
+                source = self._music_frames(original_audio, None)
+                if source is not None:
+                    logger.debug(f"Encoding {original_audio_file_name} at {bitrate}k")
+                    frames = self._encode_music(original_audio, source, bitrate)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.music_cache[key] = frames
+            future.set_result(frames)
+            return frames
+        finally:
+            with self._in_flight_lock:
+                del self._music_in_flight[key]
+
+    def _encode_music(
+        self,
+        original_audio: StreamAndProbe,
+        source: mp3_frames.Mp3Frames,
+        bitrate: int,
+    ) -> mp3_frames.Mp3Frames | None:
+        """Re-encode the music, as an engine job if there's an engine.
+
+        Args:
+            original_audio (StreamAndProbe): Music to encode
+            source (Mp3Frames): Frames of the original music file
+            bitrate (int): Bitrate in kbps
+
+        Returns:
+            Mp3Frames | None: The encoded music, or None if it can't be made
+
+        Raises:
+            RenderQueueFull: If the engine is busy
+        """
+        if self.engine is None:
+            return _encode_music(original_audio, source, bitrate)
+        encoded = self.engine.submit(
+            _encode_music_in_worker,
+            original_audio.probe["format"]["filename"],
+            bitrate,
+            original_audio.pcm,
+        ).result()
+        return None if encoded is None else mp3_frames.Mp3Frames(encoded)
+
+    def _music_tags(self, original_audio: StreamAndProbe) -> tuple[bytes, bytes]:
+        """Get the tags of the music, to carry over to processed audio.
+
+        Args:
+            original_audio (StreamAndProbe): Music to get the tags of
+
+        Returns:
+            tuple[bytes, bytes]: The leading ID3v2 tag and any trailing tags,
+                empty if there aren't any or the music can't be read
+        """
+        source = self._music_frames(original_audio, None)
+        if source is not None:
+            return source.tag_bytes(), source.trailer_bytes()
+        try:
+            with open(original_audio.probe["format"]["filename"], "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logger.error(f"Failed to read tags: {e}")
+            return b"", b""
+        return data[: id3_padding.read_tag(data)[3]], b""
+
+    def _choose_music(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> tuple[tuple[int | None, int | None], int] | None:
+        """Pick the encodings of the music to splice an ad into.
+
+        Prefers copying the original music's frames, which avoids any loss of
+        quality. If they leave too little room for the ad, some or all of the
+        music is copied from re-encodes instead, picking the bitrates that
+        leave the least padding. Nothing is encoded to choose them.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Desired output file size
+
+        Returns:
+            tuple[tuple[int | None, int | None], int] | None: The bitrates in
+                kbps of the music before and after the ad, None meaning the
+                original frames, and the lowest bitrate the frames around the
+                ad may be encoded at. None if frame-level splicing isn't
+                possible.
+        """
+        source = self._music_frames(original_audio, None)
+        if source is None:
+            return None
+        overhead = id3_padding.minimum_size(source.tag_bytes()) + len(
+            source.trailer_bytes()
+        )
+        # The ad should be encoded at least as well as encoding the whole
+        # episode would manage, up to MIN_BITRATE.
+        min_bitrate = min(
+            _full_encode_bitrate(original_audio, ad, target_size_bytes, overhead),
+            MIN_BITRATE,
+        )
+        choice = _choose_sources(source, ad, target_size_bytes, min_bitrate)
+        if choice is None:
+            logger.info("Spliced frames won't fit in the target size")
+            return None
+        return choice, min_bitrate
+
+    def _needed_encodings(
+        self,
+        original_audio: StreamAndProbe,
+        ads: list[StreamAndProbe],
+        target_size_bytes: int,
+    ) -> set[int]:
+        """Get the bitrates of the re-encodes splicing the ads would copy from.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ads (list[StreamAndProbe]): Advertisements to insert
+            target_size_bytes (int): Desired output file size
+
+        Returns:
+            set[int]: Bitrates in kbps
+        """
+        rates: set[int] = set()
+        for ad in ads:
+            chosen = self._choose_music(original_audio, ad, target_size_bytes)
+            if chosen is not None:
+                rates.update(rate for rate in chosen[0] if rate is not None)
+        return rates
+
+    def _encoded_music(
+        self,
+        original_audio: StreamAndProbe,
+        ads: list[StreamAndProbe],
+        target_size_bytes: int,
+    ) -> dict[int, bytes | None]:
+        """Encode the music the ads will be spliced into, to send to workers.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ads (list[StreamAndProbe]): Advertisements to insert
+            target_size_bytes (int): Desired output file size
+
+        Returns:
+            dict[int, bytes | None]: Each encoding's file by bitrate in kbps,
+                or None if it can't be made
+
+        Raises:
+            RenderQueueFull: If music needs encoding but the engine is busy
+        """
+        music: dict[int, bytes | None] = {}
+        for rate in self._needed_encodings(original_audio, ads, target_size_bytes):
+            frames = self._music_frames(original_audio, rate)
+            music[rate] = None if frames is None else frames.data
+        return music
+
+    def _splice_plan(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> _SplicePlan | None:
+        """Plan splicing an ad into the music at the frame level.
+
+        The music is copied from the encodings _choose_music picks, encoding
+        them if they haven't been yet. Each re-encode is made once and shared
+        by every ad that needs it.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Desired output file size
+
+        Returns:
+            _SplicePlan | None: The plan, or None if frame-level splicing
+                isn't possible
+
+        Raises:
+            RenderQueueFull: If music needs encoding but the engine is busy
+        """
+        chosen = self._choose_music(original_audio, ad, target_size_bytes)
+        if chosen is None:
+            return None
+        (head_rate, tail_rate), min_bitrate = chosen
+        head_music = self._music_frames(original_audio, head_rate)
+        tail_music = self._music_frames(original_audio, tail_rate)
+        if head_music is None or tail_music is None:
+            return None
+        return _plan_splice(head_music, ad, target_size_bytes, min_bitrate, tail_music)
+
+    def _splice(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> tuple[bytes, bytes, bytes] | None:
+        """Splice an ad into the music at the frame level.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Desired output file size
+
+        Returns:
+            tuple[bytes, bytes, bytes] | None: The music's ID3v2 tag, the
+                spliced MP3 without any tags and the music's trailing tags, or
+                None if frame-level splicing isn't possible
+        """
+        plan = self._splice_plan(original_audio, ad, target_size_bytes)
+        if plan is None:
+            return None
+        spliced = _splice_frames(plan, original_audio, ad)
+        if spliced is None:
+            return None
+        return plan.music.tag_bytes(), spliced, plan.music.trailer_bytes()
+
+    def required_size(
+        self, original_audio: StreamAndProbe, ad: StreamAndProbe
+    ) -> int | None:
+        """Predict the size of file an ad can be spliced into at good quality.
+
+        That is the smallest size, before any padding, at which the frames
+        around the ad are re-encoded at MIN_BITRATE and the rest of the music
+        is copied the way _choose_sources prefers: from the original file
+        where possible, and only otherwise re-encoded at no less than
+        MIN_BITRATE. So a target of this size keeps the original frames
+        rather than transcoding the music just to save a few bytes.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+
+        Returns:
+            int | None: Size in bytes, or None if the music's frames can't be
+                spliced
+        """
+        source = self._music_frames(original_audio, None)
+        if source is None:
+            return None
+        sources = _source_sizes(source, ad)
+        if sources is None:
+            return None
+        region_frames, sizes = sources
+        rates = _music_rates(sizes, MIN_BITRATE)
+        # Ranked like _choose_sources: most original frames, then smallest.
+        required: tuple[int, int] | None = None
+        for head_rate in rates:
+            for tail_rate in rates:
+                head_size = sizes[head_rate][0]
+                _, tail_size, reservoir_size = sizes[tail_rate]
+                sized = _region_size(
+                    source.is_mpeg1,
+                    source.sample_rate,
+                    region_frames,
+                    reservoir_size,
+                    MIN_BITRATE,
+                )
+                if sized is None:
+                    continue
+                originals = (head_rate is None) + (tail_rate is None)
+                size = _splice_overhead(source) + head_size + tail_size + sized[1]
+                if required is None or (-originals, size) < required:
+                    required = (-originals, size)
+        return None if required is None else required[1]
+
+    def _cache_key(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> str:
+        """Get the key that identifies a render in the caches.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            str: Hash of the inputs' contents, the render parameters and
+                whether the render mixes decoded samples
+        """
+        return disk_cache.content_key(
+            _RENDER_VERSION,
+            original_audio.content_hash(),
+            ad.content_hash(),
+            target_size_bytes,
+            FADE_DURATION_SECONDS,
+            # Mixing decoded samples gives different bytes to the filter graph.
+            "pcm" if _matching_pcm(original_audio, ad) is not None else "graph",
+        )
+
+    def _cached(
+        self, key: str, original_audio: StreamAndProbe, ad: StreamAndProbe
+    ) -> bytes | memoryview | ComposedAudio | None:
+        """Look up a render in memory, then on disk.
+
+        Renders found on disk are brought into memory if their layout is
+        already known, so they share the music like any other render there.
+
+        Args:
+            key (str): Cache key of the render
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+
+        Returns:
+            bytes | memoryview | ComposedAudio | None: The cached render, or
+                None if it isn't cached
+        """
+        original_audio_file_name = original_audio.probe["format"]["filename"]
+        ad_file_name = ad.probe["format"]["filename"]
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug(
+                f"Using cached media for {original_audio_file_name} and {ad_file_name}"
+            )
+            return cached
+        if self.disk_cache is not None:
+            on_disk = self.disk_cache.get(key)
+            if on_disk is not None:
+                logger.debug(
+                    f"Using media cached on disk for {original_audio_file_name} "
+                    f"and {ad_file_name}"
+                )
+                # Only layouts planned already, so lookups never plan one.
+                layout = self._layouts.get(key)
+                composed = None if layout is None else layout.compose(on_disk)
+                if composed is None:
+                    return on_disk
+                self.cache.put(key, composed)
+                return composed
+        return None
+
+    def _render_uncached(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+        exact: bool = False,
+    ) -> bytes:
+        """Render the music with an ad inserted, without caching the result.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+            exact (bool, optional): Whether the render must be the planned
+                frame-level splice, see _pad_spliced. Defaults to False.
+
+        Returns:
+            bytes: Processed audio data matching target size
+        """
+        spliced = self._splice(original_audio, ad, target_size_bytes)
+        return self._pad_spliced(original_audio, ad, target_size_bytes, spliced, exact)
+
+    def _pad_spliced(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+        spliced: tuple[bytes, bytes, bytes] | None,
+        exact: bool = False,
+    ) -> bytes:
+        """Pad a frame-level splice, or re-encode the whole episode without one.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+            spliced (tuple[bytes, bytes, bytes] | None): The music's ID3v2
+                tag, the spliced MP3 without any tags and the music's trailing
+                tags, or None if splicing failed
+            exact (bool, optional): Whether bytes of the planned splice have
+                already been served, so a whole episode re-encode would
+                contradict them. Defaults to False.
+
+        Returns:
+            bytes: Processed audio data matching target size
+
+        Raises:
+            RuntimeError: If re-encoding the episode failed, so there's no
+                audio to pad or cache, or if splicing failed for an exact
+                render
+        """
+        if spliced is None and exact:
+            raise RuntimeError(
+                f"Failed to splice {ad.probe['format']['filename']} into "
+                f"{original_audio.probe['format']['filename']} as planned"
+            )
+        if spliced is None:
+            tag, trailer = self._music_tags(original_audio)
+            overhead = id3_padding.minimum_size(tag) + len(trailer)
+            encoded = _insert_ad(original_audio, ad, target_size_bytes, overhead)
+            if not encoded:
+                raise RuntimeError(
+                    f"Failed to insert {ad.probe['format']['filename']} into "
+                    f"{original_audio.probe['format']['filename']}"
+                )
+            spliced = tag, encoded, trailer
+        tag, audio, trailer = spliced
+        return _pad_mp3_to_size(tag, audio, target_size_bytes, trailer)
+
+    def _render_batch_uncached(
+        self,
+        original_audio: StreamAndProbe,
+        ads: list[StreamAndProbe],
+        target_size_bytes: int,
+    ) -> list[bytes]:
+        """Render the music with each of several ads, without caching.
+
+        The regions around every ad that can be mixed from decoded samples
+        are encoded by one ffmpeg run per _BATCH_BUDGET_BYTES of samples.
+        Other ads are rendered one at a time.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ads (list[StreamAndProbe]): Advertisements to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            list[bytes]: Processed audio data for each ad, in order
+        """
+        # Group the ads that can be batched, keeping each group's samples
+        # within budget.
+        batches: list[list[tuple[int, _SplicePlan]]] = []
+        batch_bytes = 0
+        for i, ad in enumerate(ads):
+            if _matching_pcm(original_audio, ad) is None:
+                continue
+            plan = self._splice_plan(original_audio, ad, target_size_bytes)
+            if plan is None:
+                continue
+            size = plan.sample_count * plan.music.channels * 4
+            if not batches or batch_bytes + size > _BATCH_BUDGET_BYTES:
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append((i, plan))
+            batch_bytes += size
+
+        spliced: dict[int, tuple[bytes, bytes, bytes]] = {}
+        for batch in batches:
+            logger.info(f"Encoding {len(batch)} ads in one batch")
+            encoded = _encode_crossfade_regions(
+                original_audio, [(ads[i], plan) for i, plan in batch]
+            )
+            for (i, plan), region in zip(batch, encoded or []):
+                finished = _finish_splice(plan, region)
+                if finished is not None:
+                    spliced[i] = (
+                        plan.music.tag_bytes(),
+                        finished,
+                        plan.music.trailer_bytes(),
+                    )
+
+        return [
+            (
+                self._pad_spliced(original_audio, ad, target_size_bytes, spliced[i])
+                if i in spliced
+                else self._render_uncached(original_audio, ad, target_size_bytes)
+            )
+            for i, ad in enumerate(ads)
+        ]
+
+    def _render(
+        self,
+        key: str,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> bytes | memoryview | ComposedAudio:
+        """Render the music with an ad inserted and cache the result.
+
+        Args:
+            key (str): Cache key of the render
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            bytes | memoryview | ComposedAudio: Processed audio data matching
+                target size
+        """
+        exact = key in self._served_layouts
+        if self.engine is None:
+            data = self._render_uncached(original_audio, ad, target_size_bytes, exact)
+        else:
+            data = self._submit_render(
+                original_audio, ad, target_size_bytes, exact
+            ).result()
+        return self._store(key, original_audio, ad, target_size_bytes, data)
+
+    def _submit_render(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+        exact: bool = False,
+    ) -> concurrent.futures.Future:
+        """Submit a render to the engine as a job.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+            exact (bool, optional): Whether the render must be the planned
+                frame-level splice, see _pad_spliced. Defaults to False.
+
+        Returns:
+            Future: Resolves to the render, before it's cached
+
+        Raises:
+            RenderQueueFull: If the engine is busy
+        """
+        assert self.engine is not None, "Renders are only submitted to an engine"
+        music = self._encoded_music(original_audio, [ad], target_size_bytes)
+        return self.engine.submit(
+            _render_in_worker,
+            original_audio.probe["format"]["filename"],
+            ad.probe["format"]["filename"],
+            target_size_bytes,
+            original_audio.pcm,
+            ad.pcm,
+            music,
+            exact,
+        )
+
+    def _start_render(
+        self,
+        key: str,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> concurrent.futures.Future | None:
+        """Start a render and return once it's been admitted, not finished.
+
+        Unlike insert_ad_and_pad, a busy engine is reported before anything
+        has been sent, so callers streaming a render can still refuse the
+        request rather than cut the response short.
+
+        Args:
+            key (str): Cache key of the render
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            Future | None: Resolves to the render as it's cached, or None if
+                another caller is already rendering it
+
+        Raises:
+            RenderQueueFull: If the engine is busy
+        """
+        with self._in_flight_lock:
+            if key in self._in_flight:
+                return None
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            self._in_flight[key] = future
+
+        def finish(job: concurrent.futures.Future | None) -> None:
+            try:
+                if job is None:
+                    data = self._cached(key, original_audio, ad)
+                else:
+                    data = self._store(
+                        key, original_audio, ad, target_size_bytes, job.result()
+                    )
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(data)
+            finally:
+                with self._in_flight_lock:
+                    del self._in_flight[key]
+
+        try:
+            # The previous leader may have finished since the cache was checked.
+            if self._cached(key, original_audio, ad) is not None:
+                job = None
+            elif self.engine is None:
+                job = self._executor.submit(
+                    self._render_uncached,
+                    original_audio,
+                    ad,
+                    target_size_bytes,
+                    key in self._served_layouts,
+                )
+            else:
+                job = self._submit_render(
+                    original_audio, ad, target_size_bytes, key in self._served_layouts
+                )
+        except BaseException as e:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        if job is None:
+            finish(None)
+        else:
+            job.add_done_callback(finish)
+        return future
+
+    def _render_batch(
+        self,
+        original_audio: StreamAndProbe,
+        ads: list[StreamAndProbe],
+        target_size_bytes: int,
+    ) -> list[bytes]:
+        """Render the music with each of several ads, as one engine job if any.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ads (list[StreamAndProbe]): Advertisements to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            list[bytes]: Processed audio data for each ad, in order
+
+        Raises:
+            RenderQueueFull: If the engine is busy
+        """
+        if self.engine is None:
+            return self._render_batch_uncached(original_audio, ads, target_size_bytes)
+        music = self._encoded_music(original_audio, ads, target_size_bytes)
+        return self.engine.submit(
+            _render_batch_in_worker,
+            original_audio.probe["format"]["filename"],
+            [ad.probe["format"]["filename"] for ad in ads],
+            target_size_bytes,
+            original_audio.pcm,
+            [ad.pcm for ad in ads],
+            music,
+        ).result()
+
+    def _store(
+        self,
+        key: str,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+        data: bytes,
+    ) -> bytes | ComposedAudio:
+        """Cache a render in memory, and on disk if there's a disk cache.
+
+        Frame-level splices are kept in memory as ComposedAudio, which shares
+        the music with every other ad's render, so each one only costs the
+        bytes of its re-encoded frames. A render that doesn't match its
+        planned layout replaces the layout, unless bytes have already been
+        served from it, in which case it's rejected rather than mixed with
+        them under the same ETag.
+
+        Args:
+            key (str): Cache key of the render
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement that was inserted
+            target_size_bytes (int): Required output file size
+            data (bytes): The render
+
+        Returns:
+            bytes | ComposedAudio: The render, as it's cached in memory
+
+        Raises:
+            RuntimeError: If the render doesn't match a layout that bytes
+                have already been served from
+        """
+        original_audio_file_name = original_audio.probe["format"]["filename"]
+        ad_file_name = ad.probe["format"]["filename"]
+        layout = self._layout(original_audio, ad, target_size_bytes)
+        composed = None if layout is None else layout.compose(data)
+        if layout is not None and composed is None:
+            with self._in_flight_lock:
+                served = key in self._served_layouts
+                if not served:
+                    self._layouts[key] = None
+            if served:
+                logger.error(f"Render of {key} doesn't match the layout served")
+                raise RuntimeError("Render doesn't match the bytes already served")
+            logger.warning(f"Render of {key} doesn't match its layout, dropping it")
+        if self.disk_cache is not None and self.disk_cache.put(key, data):
+            logger.debug(
+                f"Cached media on disk for {original_audio_file_name} "
+                f"and {ad_file_name}"
+            )
+        stored = data if composed is None else composed
+        self.cache.put(key, stored)
+        logger.debug(
+            f"Cached media for {original_audio_file_name} and {ad_file_name}, "
+            f"cache stats: {self.cache.stats()}"
+        )
+        return stored
+
+    def insert_ad_and_pad(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> bytes | memoryview | ComposedAudio:
+        """Process audio with ad insertion and exact size control.
+
+        Inserts an advertisement into the original audio, applying cross-fades
+        and ensuring the output matches the target size exactly. Uses caching
+        to improve performance for repeated combinations.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            bytes | memoryview | ComposedAudio: Processed audio data matching
+                target size, as a view of a memory mapped file when served
+                from disk, or composed from the music shared between ads when
+                cached in memory
+
+        Note:
+            Results are cached by the content of the inputs and the render
+            parameters. In memory the least recently used results are evicted
+            once over budget, and on disk they're kept across restarts,
+            within their own budget.
+            Concurrent calls for a combination that isn't cached share a
+            single render.
+
+        Raises:
+            RenderQueueFull: If rendering is needed but the engine is busy
+        """
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        cached = self._cached(key, original_audio, ad)
+        if cached is not None:
+            return cached
+
+        # Only one caller renders each key, the rest wait for its result.
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if future is None:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+        if not is_leader:
+            logger.debug(f"Waiting for in-flight render of {key}")
+            return future.result()
+
+        try:
+            # The previous leader may have finished since the cache was checked.
+            data = self._cached(key, original_audio, ad) or self._render(
+                key, original_audio, ad, target_size_bytes
+            )
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+    def insert_ads_and_pad(
+        self,
+        original_audio: StreamAndProbe,
+        ads: list[StreamAndProbe],
+        target_size_bytes: int,
+    ) -> list[bytes | memoryview | ComposedAudio]:
+        """Process audio with each of several ads, rendering them as a batch.
+
+        Like insert_ad_and_pad for every ad, but the ads that aren't cached
+        are rendered together, encoding all their regions in as few ffmpeg
+        runs as possible. Ads already being rendered by another caller are
+        waited for rather than rendered again.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ads (list[StreamAndProbe]): Advertisements to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            list[bytes | memoryview | ComposedAudio]: Processed audio data
+                for each ad, in order
+
+        Raises:
+            RenderQueueFull: If rendering is needed but the engine is busy
+        """
+        keys = [self._cache_key(original_audio, ad, target_size_bytes) for ad in ads]
+        results = [self._cached(key, original_audio, ad) for key, ad in zip(keys, ads)]
+
+        # Claim the renders no one else has started, as in insert_ad_and_pad.
+        led: dict[str, concurrent.futures.Future] = {}
+        waiting: dict[int, concurrent.futures.Future] = {}
+        to_render: list[int] = []
+        with self._in_flight_lock:
+            for i, key in enumerate(keys):
+                if results[i] is not None:
+                    continue
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self._in_flight[key] = future
+                    led[key] = future
+                    to_render.append(i)
+                else:
+                    waiting[i] = future
+
+        try:
+            if to_render:
+                rendered = self._render_batch(
+                    original_audio, [ads[i] for i in to_render], target_size_bytes
+                )
+                for i, data in zip(to_render, rendered):
+                    results[i] = self._store(
+                        keys[i], original_audio, ads[i], target_size_bytes, data
+                    )
+                    led[keys[i]].set_result(results[i])
+        except BaseException as e:
+            for future in led.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                for key in led:
+                    del self._in_flight[key]
+
+        for i, future in waiting.items():
+            results[i] = future.result()
+        done = [result for result in results if result is not None]
+        assert len(done) == len(ads), "Every ad should have been rendered"
+        return done
+
+    async def insert_ad_and_pad_async(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> bytes | memoryview | ComposedAudio:
+        """Process audio with ad insertion without blocking the event loop.
+
+        Runs insert_ad_and_pad on a worker thread, so other requests keep
+        being served while ffmpeg renders.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            bytes | memoryview | ComposedAudio: Processed audio data matching
+                target size
+
+        Raises:
+            RenderQueueFull: If rendering is needed but the engine is busy
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self.insert_ad_and_pad,
+            original_audio,
+            ad,
+            target_size_bytes,
+        )
+
+    def _layout(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> _ByteLayout | None:
+        """Get the byte layout of a render, planning it the first time.
+
+        Never encodes anything. If the music the render copies from hasn't
+        been encoded yet, the layout isn't known until a render encodes it.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            _ByteLayout | None: The layout, or None if the render won't be a
+                frame-level splice or its music hasn't been encoded yet
+        """
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        if key not in self._layouts:
+            chosen = self._choose_music(original_audio, ad, target_size_bytes)
+            file_name = original_audio.probe["format"]["filename"]
+            if chosen is not None and any(
+                (file_name, rate) not in self.music_cache for rate in chosen[0]
+            ):
+                return None
+            plan = self._splice_plan(original_audio, ad, target_size_bytes)
+            self._layouts[key] = None if plan is None else _byte_layout(plan)
+        return self._layouts[key]
+
+    def stream_prefix(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> bytes:
+        """Get the start of a render that's known before it's encoded.
+
+        Frame-level splices are padded at the end, so their leading tag,
+        header frame and the music frames before the ad are fixed by the plan.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            bytes: The first bytes the render will have, or nothing if they
+                aren't known before rendering
+        """
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        layout = self._layout(original_audio, ad, target_size_bytes)
+        if layout is None or not self._serve_layout(key, layout):
+            return b""
+        return layout.before.tobytes()
+
+    def _serve_layout(self, key: str, layout: _ByteLayout) -> bool:
+        """Commit to a layout before serving bytes from it.
+
+        Args:
+            key (str): Cache key of the render
+            layout (_ByteLayout): Layout the bytes are read from
+
+        Returns:
+            bool: Whether the layout is still the render's, so its bytes may
+                be served. Once they have been, the render must match it.
+        """
+        with self._in_flight_lock:
+            if self._layouts.get(key) is not layout:
+                return False
+            self._served_layouts.add(key)
+            return True
+
+    async def read_range_async(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+        start: int,
+        end: int,
+    ) -> tuple[int, list[memoryview]]:
+        """Get a byte range of a render, only rendering if the range needs it.
+
+        Ranges that lie entirely in the music copied before or after the ad,
+        or in the tags and padding, are read from the render's byte layout
+        without encoding anything. Only ranges overlapping the frames
+        re-encoded around the ad wait for a render. The range is returned as
+        views of the buffers holding it, so it's never copied.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+            start (int): Offset of the first byte
+            end (int): Offset just past the last byte, clamped to the size
+
+        Returns:
+            tuple[int, list[memoryview]]: Size of the processed audio and
+                views that together hold the range, in order
+
+        Raises:
+            RenderQueueFull: If rendering is needed but the engine is busy
+        """
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        cached = self._cached(key, original_audio, ad)
+        if cached is None:
+            loop = asyncio.get_running_loop()
+            layout = await loop.run_in_executor(
+                self._executor,
+                self._layout,
+                original_audio,
+                ad,
+                target_size_bytes,
+            )
+            known = None if layout is None else layout.read(start, end)
+            if (
+                layout is not None
+                and known is not None
+                and self._serve_layout(key, layout)
+            ):
+                logger.debug(f"Serving bytes {start}-{end} of {key} without rendering")
+                return layout.size, known.views()
+            cached = await self.insert_ad_and_pad_async(
+                original_audio, ad, target_size_bytes
+            )
+        return len(cached), _views(cached, start, end)
+
+    async def stream_ad_and_pad_async(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> tuple[int, AsyncIterator[bytes | memoryview]]:
+        """Process audio with ad insertion, sending what's known straight away.
+
+        Cached renders are sent as they are. Otherwise the render is started
+        and, when the start of the file is known from the splice plan, that
+        is sent while the region around the ad is encoded.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            tuple[int, AsyncIterator[bytes | memoryview]]: Size of the
+                processed audio and an iterator over its bytes
+
+        Raises:
+            RenderQueueFull: If rendering is needed but the engine is busy
+        """
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        cached = self._cached(key, original_audio, ad)
+        started = None
+        if cached is not None:
+            data = cached
+            prefix = b""
+        else:
+            loop = asyncio.get_running_loop()
+            prefix = await loop.run_in_executor(
+                self._executor,
+                self.stream_prefix,
+                original_audio,
+                ad,
+                target_size_bytes,
+            )
+            if prefix:
+                # Admit the render before the first byte is sent, so a busy
+                # engine is a 503 rather than a truncated response.
+                started = await loop.run_in_executor(
+                    self._executor,
+                    self._start_render,
+                    key,
+                    original_audio,
+                    ad,
+                    target_size_bytes,
+                )
+            if started is None:
+                data = await self.insert_ad_and_pad_async(
+                    original_audio, ad, target_size_bytes
+                )
+                prefix = b""
+            elif started.done():
+                data = await asyncio.wrap_future(started)
+                prefix = b""
+        render = started
+
+        if not prefix:
+
+            async def whole() -> AsyncIterator[bytes | memoryview]:
+                for view in _views(data):
+                    yield view
+
+            return len(data), whole()
+
+        async def streamed() -> AsyncIterator[bytes | memoryview]:
+            yield prefix
+            assert render is not None, "Prefixes are only sent for started renders"
+            rendered = await asyncio.wrap_future(render)
+            if (
+                len(rendered) != target_size_bytes
+                or b"".join(_views(rendered, 0, len(prefix))) != prefix
+            ):
+                logger.error(f"Render of {key} doesn't match the bytes already sent")
+                raise RuntimeError("Render doesn't match the streamed prefix")
+            for view in _views(rendered, len(prefix)):
+                yield view
+
+        return target_size_bytes, streamed()
+
+    def cached_file(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> tuple[BinaryIO, memoryview] | None:
+        """Open the file a render is cached in on disk, if it is.
+
+        Lets callers hand the file to the web server to send, rather than
+        sending the render's bytes themselves. The file is already open, so
+        evicting the render before it's sent doesn't matter.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            tuple[BinaryIO, memoryview] | None: The open file, which the
+                caller must close, and a view of its memory mapping, or None
+                if the render isn't on disk
+        """
+        if self.disk_cache is None:
+            return None
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        return self.disk_cache.open_file(key)
+
+    def etag(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> str:
+        """Get a strong entity tag for a render, without rendering it.
+
+        Renders are deterministic given their cache key, which hashes the
+        contents of the inputs, the render parameters and which way the
+        samples are mixed, so the key identifies the render's bytes before
+        they exist.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            str: The quoted tag, for an ETag header
+        """
+        return f'"{self._cache_key(original_audio, ad, target_size_bytes)}"'
+
+    def is_cached(
+        self,
+        original_audio: StreamAndProbe,
+        ad: StreamAndProbe,
+        target_size_bytes: int,
+    ) -> bool:
+        """Check whether a combination can be served without rendering.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ad (StreamAndProbe): Advertisement to insert
+            target_size_bytes (int): Required output file size
+
+        Returns:
+            bool: True if the render is in the memory or disk cache
+        """
+        key = self._cache_key(original_audio, ad, target_size_bytes)
+        return key in self.cache or (
+            self.disk_cache is not None and key in self.disk_cache
+        )
+
+    async def warm_up_async(
+        self,
+        original_audio: StreamAndProbe,
+        ads: list[StreamAndProbe],
+        target_size_bytes: int,
+        concurrency: int = 1,
+    ) -> None:
+        """Render every ad into the audio ahead of time to fill the cache.
+
+        Combinations that are already cached are skipped. The music the rest
+        are spliced into is encoded first, each encoding once and in
+        parallel. Then they're split into one batch per concurrent render,
+        each rendered by insert_ads_and_pad. When the render engine is busy,
+        jobs are retried until it has room.
+
+        Args:
+            original_audio (StreamAndProbe): Original audio content
+            ads (list[StreamAndProbe]): Advertisements to render
+            target_size_bytes (int): Required output file size
+            concurrency (int, optional): Most batches to render at once.
+                Defaults to 1.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def retry(fn: Callable[..., object], *args: object) -> None:
+            while True:
+                try:
+                    await loop.run_in_executor(self._executor, fn, *args)
+                    return
+                except render_engine.RenderQueueFull:
+                    await asyncio.sleep(_WARM_UP_RETRY_SECONDS)
+                except RuntimeError as e:
+                    # Left for requests to retry, rather than cached broken.
+                    logger.error(f"Failed to warm cache: {e}")
+                    return
+
+        logger.info(f"Warming cache with {len(ads)} ads")
+        uncached = [
+            ad
+            for ad in ads
+            if not self.is_cached(original_audio, ad, target_size_bytes)
+        ]
+        rates = await loop.run_in_executor(
+            self._executor,
+            self._needed_encodings,
+            original_audio,
+            uncached,
+            target_size_bytes,
+        )
+        await asyncio.gather(
+            *(retry(self._music_frames, original_audio, rate) for rate in rates)
+        )
+        batches = [uncached[i::concurrency] for i in range(concurrency)]
+        await asyncio.gather(
+            *(
+                retry(self.insert_ads_and_pad, original_audio, batch, target_size_bytes)
+                for batch in batches
+                if batch
+            )
+        )
+        logger.info(f"Warmed cache with {len(ads)} ads")
+
+    def close(self) -> None:
+        """Stop the worker threads and close the disk cache's mappings."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+
+
+# State of a render engine worker process, set up by its first job.
+_worker_splicer: AudioSplicer | None = None
+_worker_media: dict[str, StreamAndProbe] = {}
+
+
+def _render_in_worker(
+    original_audio_file_name: str,
+    ad_file_name: str,
+    target_size_bytes: int,
+    original_audio_pcm: pcm_cache.DecodedAudio | None = None,
+    ad_pcm: pcm_cache.DecodedAudio | None = None,
+    music: dict[int, bytes | None] | None = None,
+    exact: bool = False,
+) -> bytes:
+    """Render job run by RenderEngine worker processes.
+
+    Each worker keeps its own probes between jobs, so only the first job in a
+    worker pays for them. Decoded samples are read from the files the parent
+    process decoded, so workers share their pages. The music encodings the
+    render copies from are encoded once by the parent and sent with the job,
+    so workers never encode the whole track themselves.
+
+    Args:
+        original_audio_file_name (str): Path of the original audio
+        ad_file_name (str): Path of the advertisement to insert
+        target_size_bytes (int): Required output file size
+        original_audio_pcm (DecodedAudio | None, optional): Decoded samples
+            of the original audio. Defaults to None.
+        ad_pcm (DecodedAudio | None, optional): Decoded samples of the
+            advertisement. Defaults to None.
+        music (dict[int, bytes | None] | None, optional): Files of the music
+            encodings the render copies from, by bitrate. Defaults to None.
+        exact (bool, optional): Whether the render must be the planned
+            frame-level splice, see AudioSplicer._pad_spliced. Defaults to
+            False.
+
+    Returns:
+        bytes: Processed audio data matching target size
+    """
+    _seed_worker_music(original_audio_file_name, music)
+    return _worker_state()._render_uncached(
+        _worker_stream(original_audio_file_name, original_audio_pcm),
+        _worker_stream(ad_file_name, ad_pcm),
+        target_size_bytes,
+        exact,
+    )
+
+
+def _encode_music_in_worker(
+    original_audio_file_name: str,
+    bitrate: int,
+    original_audio_pcm: pcm_cache.DecodedAudio | None = None,
+) -> bytes | None:
+    """Music encoding job run by RenderEngine worker processes.
+
+    Args:
+        original_audio_file_name (str): Path of the original audio
+        bitrate (int): Bitrate in kbps to re-encode at
+        original_audio_pcm (DecodedAudio | None, optional): Decoded samples
+            of the original audio. Defaults to None.
+
+    Returns:
+        bytes | None: The re-encoded music file, ready for splicing, or None
+            if it can't be made
+    """
+    frames = _worker_state()._music_frames(
+        _worker_stream(original_audio_file_name, original_audio_pcm), bitrate
+    )
+    return None if frames is None else frames.data
+
+
+def _render_batch_in_worker(
+    original_audio_file_name: str,
+    ad_file_names: list[str],
+    target_size_bytes: int,
+    original_audio_pcm: pcm_cache.DecodedAudio | None = None,
+    ad_pcms: list[pcm_cache.DecodedAudio | None] | None = None,
+    music: dict[int, bytes | None] | None = None,
+) -> list[bytes]:
+    """Batch render job run by RenderEngine worker processes.
+
+    Args:
+        original_audio_file_name (str): Path of the original audio
+        ad_file_names (list[str]): Paths of the advertisements to insert
+        target_size_bytes (int): Required output file size
+        original_audio_pcm (DecodedAudio | None, optional): Decoded samples
+            of the original audio. Defaults to None.
+        ad_pcms (list[DecodedAudio | None] | None, optional): Decoded
+            samples of each advertisement. Defaults to None.
+        music (dict[int, bytes | None] | None, optional): Files of the music
+            encodings the renders copy from, by bitrate. Defaults to None.
+
+    Returns:
+        list[bytes]: Processed audio data for each ad, in order
+    """
+    _seed_worker_music(original_audio_file_name, music)
+    if ad_pcms is None:
+        ad_pcms = [None] * len(ad_file_names)
+    return _worker_state()._render_batch_uncached(
+        _worker_stream(original_audio_file_name, original_audio_pcm),
+        [_worker_stream(name, pcm) for name, pcm in zip(ad_file_names, ad_pcms)],
+        target_size_bytes,
+    )
+
+
+def _worker_state() -> AudioSplicer:
+    global _worker_splicer
+    if _worker_splicer is None:
+        _worker_splicer = AudioSplicer(cache_budget_bytes=0)
+    return _worker_splicer
+
+
+def _seed_worker_music(
+    original_audio_file_name: str, music: dict[int, bytes | None] | None
+) -> None:
+    # Music encodings the worker already has were sent with an earlier job.
+    splicer = _worker_state()
+    for rate, data in (music or {}).items():
+        key = (original_audio_file_name, rate)
+        if key not in splicer.music_cache:
+            splicer.music_cache[key] = (
+                None if data is None else mp3_frames.Mp3Frames(data)
+            )
+
+
+def _worker_stream(
+    file_name: str, pcm: pcm_cache.DecodedAudio | None
+) -> StreamAndProbe:
+    if file_name not in _worker_media:
+        _worker_media[file_name] = StreamAndProbe(file_name)
+    _worker_media[file_name].pcm = pcm
+    return _worker_media[file_name]
@@ -0,0 +1,123 @@
+"""Byte Budgeted LRU Cache
+
+This module provides an in-memory cache that holds rendered audio up to a
+fixed number of bytes, evicting the least recently used entries to stay
+within budget.
+
+Key Components:
+    ByteBudgetCache: LRU cache bounded by the total size of its values
+
+Technical Details:
+    - Entries are sized by their length in bytes, or by a given function for
+      values that share memory with each other
+    - Lookups move an entry to the most recently used end, so popular
+      combinations stay resident while rarely used ones are evicted
+    - Values larger than the whole budget are never cached
+    - Keeps hit, miss and eviction counts alongside the resident byte total
+    - Safe to use from multiple threads
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Sized
+from typing import Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V", bound=Sized)
+
+
+class ByteBudgetCache(Generic[K, V]):
+    """LRU cache whose values together never exceed a byte budget.
+
+    Args:
+        budget_bytes (int): Most bytes of values to hold at once
+        size_of (Callable[[V], int] | None, optional): Gets the bytes a value
+            counts against the budget. Defaults to None, which uses len.
+
+    Example:
+        ```python
+        cache = ByteBudgetCache(64 * 1024 * 1024)
+        cache.put(("music.mp3", "ad.mp3"), data)
+        data = cache.get(("music.mp3", "ad.mp3"))
+        ```
+    """
+
+    def __init__(
+        self, budget_bytes: int, size_of: Callable[[V], int] | None = None
+    ) -> None:
+        self.budget_bytes = budget_bytes
+        self._size_of: Callable[[V], int] = size_of or len
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+        self._entries: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def get(self, key: K) -> V | None:
+        """Look up a value, marking it as the most recently used.
+
+        Args:
+            key (K): Key to look up
+
+        Returns:
+            V | None: The cached value, or None if it isn't cached
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        """Cache a value, evicting least recently used values to make room.
+
+        Args:
+            key (K): Key to store the value under
+            value (V): Value to cache
+        """
+        size = self._size_of(value)
+        if size > self.budget_bytes:
+            logger.debug(f"Not caching {key}: {size} bytes is over the budget")
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.resident_bytes -= self._size_of(previous)
+            while self._entries and self.resident_bytes + size > self.budget_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.resident_bytes -= self._size_of(evicted)
+                self.evictions += 1
+                logger.debug(f"Evicted {evicted_key} from cache")
+            self._entries[key] = value
+            self.resident_bytes += size
+
+    def stats(self) -> dict[str, int]:
+        """Get counters describing how the cache is performing.
+
+        Returns:
+            dict[str, int]: Hits, misses, evictions, number of entries,
+                resident bytes and the byte budget
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "budget_bytes": self.budget_bytes,
+            }
@@ -0,0 +1,98 @@
+"""Audio Composed From Shared Buffers
+
+This module describes a processed file as an ordered list of segments of
+other buffers, so variants that only differ around the ad can share the
+bytes they have in common rather than each holding a copy.
+
+Key Components:
+    ComposedAudio: A file made of segments, readable by byte range
+
+Technical Details:
+    - Segments are kept as memoryviews, so building, slicing and reading a
+      ComposedAudio never copies the underlying bytes
+    - Range reads find their first segment by binary search over the
+      segments' offsets
+    - Segments given as bytes are counted as owned by the file, while
+      memoryviews are taken to be views of buffers shared with other files
+"""
+
+import bisect
+from collections.abc import Iterable
+
+
+class ComposedAudio:
+    """A file made of segments of other buffers, laid end to end.
+
+    Args:
+        segments (Iterable[bytes | memoryview]): The file's contents in
+            order. Bytes are owned by this file, memoryviews are views of
+            buffers it shares.
+
+    Example:
+        ```python
+        audio = ComposedAudio([header, memoryview(music)[:split], ad_region])
+        size = len(audio)
+        for view in audio.views(start, end):
+            send(view)
+        ```
+    """
+
+    def __init__(self, segments: Iterable[bytes | memoryview]) -> None:
+        self._segments: list[memoryview] = []
+        self._starts: list[int] = []
+        self.owned_bytes = 0
+        size = 0
+        for segment in segments:
+            if not len(segment):
+                continue
+            if isinstance(segment, bytes):
+                self.owned_bytes += len(segment)
+            self._segments.append(memoryview(segment).cast("B"))
+            self._starts.append(size)
+            size += len(segment)
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: slice) -> "ComposedAudio":
+        """Get a byte range, as a ComposedAudio sharing this one's buffers."""
+        start, stop, step = index.indices(self._size)
+        assert step == 1, "Only contiguous ranges can be read"
+        return ComposedAudio(self.views(start, stop))
+
+    def __bytes__(self) -> bytes:
+        return self.tobytes()
+
+    def views(self, start: int = 0, end: int | None = None) -> list[memoryview]:
+        """Get views of the segments covering a byte range, without copying.
+
+        Args:
+            start (int, optional): Offset of the first byte. Defaults to 0.
+            end (int | None, optional): Offset just past the last byte,
+                clamped to the size. Defaults to None, the end of the file.
+
+        Returns:
+            list[memoryview]: Views that together hold the range, in order
+        """
+        end = self._size if end is None else min(end, self._size)
+        views: list[memoryview] = []
+        if start >= end:
+            return views
+        i = bisect.bisect_right(self._starts, start) - 1
+        while i < len(self._segments) and self._starts[i] < end:
+            offset = self._starts[i]
+            segment = self._segments[i]
+            views.append(
+                segment[max(start - offset, 0) : min(end - offset, len(segment))]
+            )
+            i += 1
+        return views
+
+    def tobytes(self) -> bytes:
+        """Copy the whole file into one bytes object.
+
+        Returns:
+            bytes: The file's contents
+        """
+        return b"".join(self._segments)
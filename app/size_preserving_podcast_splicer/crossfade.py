@@ -0,0 +1,163 @@
+"""Cross-Fading and Mixing of Decoded Samples
+
+This module builds the spliced audio around an ad directly from decoded
+samples, as a few vectorised NumPy operations, rather than through an ffmpeg
+filter graph.
+
+Key Components:
+    splice: Mixes the music and an ad into a window of the spliced timeline
+    fade_gains: Gain curves applied across a cross-fade
+
+Technical Details:
+    - The spliced timeline is the music up to `mid_point - fade`, a
+      cross-fade into the ad, the body of the ad, a cross-fade back, and the
+      rest of the music from `mid_point + fade`
+    - Only the requested window of the timeline is produced, so splicing
+      just the part around the ad never touches the rest of the music
+    - Gains follow ffmpeg's acrossfade with its default linear curves, and
+      are computed once per fade length
+    - Reads outside the inputs are silent, as with ffmpeg's apad
+    - Output is 32-bit float, ready to feed to an encoder as "f32le"
+"""
+
+import functools
+
+import numpy as np
+
+# Raw ffmpeg format of the samples splice returns.
+RAW_FORMAT = "f32le"
+
+
+@functools.lru_cache(maxsize=8)
+def fade_gains(length: int) -> tuple[np.ndarray, np.ndarray]:
+    """Get the gains applied across a cross-fade.
+
+    Args:
+        length (int): Length of the cross-fade in samples
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Gains of the audio fading out and of
+            the audio fading in, shaped (length, 1) to scale every channel
+    """
+    # Sample i of the fade has gains (length - 1 - i) / length and i / length.
+    fade_in = (np.arange(length, dtype=np.float32) / np.float32(length)).reshape(-1, 1)
+    fade_out = np.ascontiguousarray(fade_in[::-1])
+    # They're shared between calls, so mustn't be changed.
+    fade_in.flags.writeable = False
+    fade_out.flags.writeable = False
+    return fade_out, fade_in
+
+
+def _as_float(samples: np.ndarray) -> np.ndarray:
+    """Convert samples to 32-bit floats in the range [-1, 1).
+
+    Args:
+        samples (np.ndarray): Samples of any PCM sample format
+
+    Returns:
+        np.ndarray: The samples as floats, without a copy if already floats
+    """
+    if samples.dtype.kind == "f":
+        return samples.astype(np.float32, copy=False)
+    bits = samples.dtype.itemsize * 8
+    if samples.dtype.kind == "u":
+        return (samples.astype(np.float32) - 2 ** (bits - 1)) / 2 ** (bits - 1)
+    return samples.astype(np.float32) / 2 ** (bits - 1)
+
+
+def _window(samples: np.ndarray, first: int, last: int) -> np.ndarray:
+    """Get samples [first, last), with silence for any outside the input.
+
+    Args:
+        samples (np.ndarray): Samples shaped (samples, channels)
+        first (int): First sample to get
+        last (int): Sample after the last one to get
+
+    Returns:
+        np.ndarray: Float samples shaped (last - first, channels)
+    """
+    inside = samples[max(first, 0) : max(min(last, len(samples)), 0)]
+    if first >= 0 and len(inside) == last - first:
+        return _as_float(inside)
+    window = np.zeros((last - first, samples.shape[1]), np.float32)
+    offset = max(-first, 0)
+    window[offset : offset + len(inside)] = _as_float(inside)
+    return window
+
+
+def splice(
+    music: np.ndarray,
+    ad: np.ndarray,
+    start: int,
+    end: int,
+    mid_point: int,
+    fade: int,
+    ad_body: int,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """Mix music and an ad into a window of the spliced timeline.
+
+    Args:
+        music (np.ndarray): Music samples shaped (samples, channels)
+        ad (np.ndarray): Ad samples, with the same rate and channels as the
+            music
+        start (int): First sample of the spliced timeline to produce
+        end (int): Sample of the spliced timeline to stop at
+        mid_point (int): Sample the ad is inserted at in the music
+        fade (int): Length of each cross-fade in samples
+        ad_body (int): Samples of the ad played between the cross-fades
+        out (np.ndarray | None, optional): Float array shaped
+            (end - start, channels) to write the samples into, so several
+            windows can be mixed into one buffer. Defaults to None, which
+            allocates a new array.
+
+    Returns:
+        np.ndarray: Float samples shaped (end - start, channels)
+    """
+    fade_out, fade_in = fade_gains(fade)
+
+    def music_head(first: int, last: int) -> np.ndarray:
+        return _window(music, first, last)
+
+    def fade_into_ad(first: int, last: int) -> np.ndarray:
+        offset = mid_point - fade
+        return (
+            _window(music, offset + first, offset + last) * fade_out[first:last]
+            + _window(ad, first, last) * fade_in[first:last]
+        )
+
+    def ad_main(first: int, last: int) -> np.ndarray:
+        return _window(ad, fade + first, fade + last)
+
+    def fade_out_of_ad(first: int, last: int) -> np.ndarray:
+        offset = fade + ad_body
+        return (
+            _window(ad, offset + first, offset + last) * fade_out[first:last]
+            + _window(music, mid_point + first, mid_point + last) * fade_in[first:last]
+        )
+
+    def music_tail(first: int, last: int) -> np.ndarray:
+        offset = mid_point + fade
+        return _window(music, offset + first, offset + last)
+
+    # Each part of the timeline: where it starts, its length and its samples.
+    parts = [
+        (0, mid_point - fade, music_head),
+        (mid_point - fade, fade, fade_into_ad),
+        (mid_point, ad_body, ad_main),
+        (mid_point + ad_body, fade, fade_out_of_ad),
+        (
+            mid_point + ad_body + fade,
+            max(end - mid_point - ad_body - fade, 0),
+            music_tail,
+        ),
+    ]
+    mixed = np.empty((end - start, music.shape[1]), np.float32) if out is None else out
+    for part_start, length, samples in parts:
+        first = max(start, part_start)
+        last = min(end, part_start + length)
+        if first < last:
+            mixed[first - start : last - start] = samples(
+                first - part_start, last - part_start
+            )
+    return mixed
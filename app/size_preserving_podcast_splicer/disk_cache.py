@@ -0,0 +1,220 @@
+"""Persistent Content-Addressed Disk Cache
+
+This module stores rendered audio on disk under a content hash, so renders
+survive restarts and can be served without holding them on the Python heap.
+
+Key Components:
+    DiskCache: Stores renders in files and serves them through mmap
+    content_key: Hashes the parts that determine a render into a key
+
+Technical Details:
+    - Files are written to a temporary name, flushed to disk and then renamed
+      into place, so a crash never leaves a partial render behind
+    - Reads map the file read only and hand out a memoryview of the mapping,
+      leaving the OS page cache to decide what stays in memory
+    - Each file is mapped once and the mapping reused for later reads
+    - Holds at most a byte budget of files, deleting the least recently used
+      ones to make room, with files already on disk at startup ordered by
+      when they were written. Mappings of deleted files are closed, or left
+      to close once the last view of them is released
+    - Files are never rewritten in place, so they can be handed to the web
+      server to send straight from disk. They're opened under the same lock
+      as eviction, and an open file outlives its deletion, so a file can't
+      be evicted between being looked up and being sent
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+# Default most bytes of renders to keep on disk.
+DEFAULT_BUDGET_BYTES = 1024 * 1024 * 1024
+
+
+def content_key(*parts: object) -> str:
+    """Hash the parts that determine a render into a cache key.
+
+    Args:
+        *parts (object): Values that together identify a render, such as
+            input content hashes and render parameters
+
+    Returns:
+        str: Hex SHA-256 digest of the parts
+    """
+    return hashlib.sha256(
+        "\0".join(str(part) for part in parts).encode("utf-8")
+    ).hexdigest()
+
+
+class DiskCache:
+    """Content-addressed cache of renders stored as files.
+
+    Args:
+        directory (str | Path): Directory to store renders in, created if
+            it doesn't exist
+        budget_bytes (int, optional): Most bytes of renders to keep on disk.
+            Defaults to DEFAULT_BUDGET_BYTES.
+
+    Raises:
+        OSError: If the directory can't be created or read
+
+    Example:
+        ```python
+        cache = DiskCache("/path/to/cache")
+        cache.put(key, data)
+        view = cache.get(key)
+        ```
+    """
+
+    def __init__(
+        self, directory: str | Path, budget_bytes: int = DEFAULT_BUDGET_BYTES
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.budget_bytes = budget_bytes
+        self.resident_bytes = 0
+        self._maps: dict[str, mmap.mmap] = {}
+        # Sizes of the files on disk, least recently used first.
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        files = []
+        for path in self.directory.glob("*.mp3"):
+            stat = path.stat()
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(files):
+                self._track(key, size)
+            self._evict()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.mp3"
+
+    def _track(self, key: str, size: int) -> None:
+        # Marks a file as the most recently used. Called with the lock held.
+        self.resident_bytes += size - self._sizes.pop(key, 0)
+        self._sizes[key] = size
+
+    def _evict(self) -> None:
+        # Deletes files until within budget, always keeping the newest one.
+        # Called with the lock held.
+        while self.resident_bytes > self.budget_bytes and len(self._sizes) > 1:
+            key, size = self._sizes.popitem(last=False)
+            self.resident_bytes -= size
+            try:
+                self._path(key).unlink()
+            except OSError as e:
+                logger.warning(f"Failed to evict {key} from disk cache: {e}")
+            mapped = self._maps.pop(key, None)
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # Still being served, the mapping closes with its views.
+                    pass
+            logger.debug(f"Evicted {key} from disk cache")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._maps or self._path(key).is_file()
+
+    def _view(self, key: str) -> memoryview | None:
+        # Maps a file the first time it's read. Called with the lock held.
+        mapped = self._maps.get(key)
+        if mapped is None:
+            try:
+                with open(self._path(key), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Missing, unreadable or empty, in any case not cached.
+                return None
+            self._maps[key] = mapped
+        self._track(key, len(mapped))
+        return memoryview(mapped)
+
+    def get(self, key: str) -> memoryview | None:
+        """Get a read-only view of a cached render.
+
+        Args:
+            key (str): Content key of the render
+
+        Returns:
+            memoryview | None: View of the memory mapped render, or None if
+                it isn't cached
+        """
+        with self._lock:
+            return self._view(key)
+
+    def open_file(self, key: str) -> tuple[BinaryIO, memoryview] | None:
+        """Open a cached render's file, along with a view of it.
+
+        The file stays readable until it's closed, even if the render is
+        evicted meanwhile, so it can be handed to the web server to send.
+
+        Args:
+            key (str): Content key of the render
+
+        Returns:
+            tuple[BinaryIO, memoryview] | None: The open file, which the
+                caller must close, and a view of its memory mapping, or None
+                if it isn't cached
+        """
+        with self._lock:
+            view = self._view(key)
+            if view is None:
+                return None
+            try:
+                return open(self._path(key), "rb"), view
+            except OSError as e:
+                logger.warning(f"Failed to open {key} in disk cache: {e}")
+                return None
+
+    def put(self, key: str, data: bytes) -> bool:
+        """Atomically write a render to the cache.
+
+        Deletes the least recently used renders if the cache is then over
+        budget.
+
+        Args:
+            key (str): Content key of the render
+            data (bytes): Render to store
+
+        Returns:
+            bool: True if the render was written, False otherwise
+        """
+        path = self._path(key)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            logger.error(f"Failed to write {path} to disk cache: {e}")
+            return False
+        logger.debug(f"Wrote {len(data)} bytes to {path}")
+        with self._lock:
+            self._track(key, len(data))
+            self._evict()
+        return True
+
+    def close(self) -> None:
+        """Close the mappings of every file that isn't still being served."""
+        with self._lock:
+            for key, mapped in list(self._maps.items()):
+                try:
+                    mapped.close()
+                except BufferError:
+                    continue
+                del self._maps[key]
@@ -0,0 +1,249 @@
+"""ID3v2 Tag Padding for Exact File Sizes
+
+This module builds the tags of an MP3 so that the whole file comes out at an
+exact size. Existing ID3v2 tag frames are kept byte for byte, and the space
+left over is filled with NUL bytes in an APEv2 tag after the audio.
+
+Key Components:
+    read_tag: Splits the frames out of an existing ID3v2 tag
+    minimum_size: Size of a tag before any padding is added
+    pad_at_end: Builds a file with its padding after the audio
+    leading_tag: The leading tag that pad_at_end starts a file with
+    trailing_padding: Builds an APEv2 tag of an exact size
+    trailing_padding_parts: The same tag, as parts sharing one NUL filler
+
+Technical Details:
+    - Sizes are computed directly, so padding costs O(tag size) work rather
+      than re-saving the whole file through a tag library
+    - The output is assembled in a single allocation, padding included
+    - Padding goes in an APEv2 tag, before any ID3v1 tag, where decoders
+      expect tags rather than frames. Gaps too small for one are left as the
+      leading tag's own zero padding instead
+    - With padding at the end, the leading tag and audio frames only depend
+      on how much padding there is, not on the audio itself, so the start of
+      a file can be sent before the rest has been encoded
+"""
+
+import struct
+
+# Bytes in an ID3v2 tag header and in each frame header.
+_HEADER_SIZE = 10
+
+_FLAG_EXTENDED_HEADER = 0x40
+_FLAG_FOOTER = 0x10
+
+# APEv2 tags start with a header and end with a matching footer.
+_APE_HEADER_SIZE = 32
+_APE_VERSION = 2000
+_APE_FLAG_HAS_HEADER = 1 << 31
+_APE_FLAG_IS_HEADER = 1 << 29
+_APE_ITEM_BINARY = 1 << 1
+# Key of the APEv2 item holding the padding, NUL terminated.
+_APE_PADDING_KEY = b"Padding\x00"
+_APE_ITEM_HEADER_SIZE = 8
+
+# Smallest APEv2 padding tag: a header, an empty padding item and a footer.
+TRAILING_PADDING_MIN_SIZE = (
+    2 * _APE_HEADER_SIZE + _APE_ITEM_HEADER_SIZE + len(_APE_PADDING_KEY)
+)
+
+# Shared zero filler, grown as needed, so each padded file doesn't need its
+# own padding sized buffer.
+_zeros = b""
+
+
+def synchsafe_encode(value: int) -> bytes:
+    """Encode an integer as a 4 byte synchsafe integer as used by ID3v2.
+
+    Args:
+        value (int): Value to encode, must be below 2**28
+
+    Returns:
+        bytes: The encoded value
+    """
+    assert value < 1 << 28, "Value too large for a synchsafe integer"
+    return bytes(
+        ((value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F)
+    )
+
+
+def _filler(size: int) -> memoryview:
+    global _zeros
+    if len(_zeros) < size:
+        _zeros = bytes(size)
+    return memoryview(_zeros)[:size]
+
+
+def _synchsafe_decode(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _frame_size(version: int, data: bytes) -> int:
+    if version == 4:
+        return _synchsafe_decode(data)
+    return int.from_bytes(data, "big")
+
+
+def read_tag(data: bytes) -> tuple[int, int, bytes, int]:
+    """Split the frames out of the ID3v2 tag at the start of an MP3.
+
+    Args:
+        data (bytes): MP3 data, optionally starting with an ID3v2 tag
+
+    Returns:
+        tuple[int, int, bytes, int]: The tag's major version, its flags, the
+            bytes of its extended header and frames without any padding, and
+            the total size of the tag. Data without a usable tag gives
+            (3, 0, b"", size of any tag found).
+    """
+    if len(data) < _HEADER_SIZE or data[:3] != b"ID3":
+        return 3, 0, b"", 0
+    version = data[3]
+    flags = data[5]
+    body_size = _synchsafe_decode(data[6:10])
+    tag_size = _HEADER_SIZE + body_size + (10 if flags & _FLAG_FOOTER else 0)
+    if version not in (3, 4):
+        # ID3v2.2 frames use a different layout, so they're dropped.
+        return 3, 0, b"", tag_size
+
+    end = _HEADER_SIZE + body_size
+    position = _HEADER_SIZE
+    if flags & _FLAG_EXTENDED_HEADER:
+        extended_size = _frame_size(version, data[position : position + 4])
+        # Only ID3v2.3 leaves the size field out of the size.
+        position += extended_size + (4 if version == 3 else 0)
+    while position + _HEADER_SIZE <= end and data[position] != 0:
+        size = _frame_size(version, data[position + 4 : position + 8])
+        if position + _HEADER_SIZE + size > end:
+            break
+        position += _HEADER_SIZE + size
+    return version, flags & ~_FLAG_FOOTER, data[_HEADER_SIZE:position], tag_size
+
+
+def minimum_size(tag: bytes) -> int:
+    """Get the size of the smallest leading tag pad_at_end builds from a tag.
+
+    Args:
+        tag (bytes): Data starting with an existing ID3v2 tag, if any
+
+    Returns:
+        int: Size in bytes of the tag's frames plus a tag header
+    """
+    return _HEADER_SIZE + len(read_tag(tag)[2])
+
+
+def trailing_padding(size: int) -> bytes:
+    """Build an APEv2 tag of an exact size, to place after the audio frames.
+
+    Args:
+        size (int): Size of the tag in bytes, at least
+            TRAILING_PADDING_MIN_SIZE
+
+    Returns:
+        bytes: A tag holding a single binary item of NUL bytes
+    """
+    return b"".join(trailing_padding_parts(size))
+
+
+def trailing_padding_parts(size: int) -> list[bytes | memoryview]:
+    """Build an APEv2 tag of an exact size, without copying its NUL filler.
+
+    Args:
+        size (int): Size of the tag in bytes, at least
+            TRAILING_PADDING_MIN_SIZE
+
+    Returns:
+        list[bytes | memoryview]: The tag's header and item header, a view of
+            the filler shared by every tag, and the tag's footer
+    """
+    assert size >= TRAILING_PADDING_MIN_SIZE, "Padding too small for a tag"
+    value_size = size - TRAILING_PADDING_MIN_SIZE
+    item_header = struct.pack("<II", value_size, _APE_ITEM_BINARY)
+    # The tag size covers the items and footer, but not the header.
+    tag_size = size - _APE_HEADER_SIZE
+
+    def ape_header(flags: int) -> bytes:
+        return b"APETAGEX" + struct.pack("<IIIIQ", _APE_VERSION, tag_size, 1, flags, 0)
+
+    return [
+        ape_header(_APE_FLAG_HAS_HEADER | _APE_FLAG_IS_HEADER)
+        + item_header
+        + _APE_PADDING_KEY,
+        _filler(value_size),
+        ape_header(_APE_FLAG_HAS_HEADER),
+    ]
+
+
+def leading_padding(gap: int) -> int:
+    """Get how much of the padding pad_at_end puts in the leading tag.
+
+    Args:
+        gap (int): Bytes of padding the file needs
+
+    Returns:
+        int: The whole gap if it's too small for a trailing tag, else 0
+    """
+    return gap if gap < TRAILING_PADDING_MIN_SIZE else 0
+
+
+def leading_tag(frames: bytes, gap: int, version: int = 3, flags: int = 0) -> bytes:
+    """Build the leading tag that pad_at_end starts a file with.
+
+    Args:
+        frames (bytes): Tag frames (and any extended header) to keep
+        gap (int): Bytes of padding the file needs
+        version (int, optional): Major version of the tag the frames came from.
+            Defaults to 3.
+        flags (int, optional): Flags of the tag the frames came from, without
+            the footer flag. Defaults to 0.
+
+    Returns:
+        bytes: The tag, with any padding too small for a trailing tag
+    """
+    padding = leading_padding(gap)
+    return b"".join(
+        (
+            b"ID3",
+            bytes((version, 0, flags)),
+            synchsafe_encode(len(frames) + padding),
+            frames,
+            _filler(padding),
+        )
+    )
+
+
+def pad_at_end(
+    frames: bytes,
+    audio: bytes,
+    trailer: bytes,
+    target_size: int,
+    version: int = 3,
+    flags: int = 0,
+) -> bytes:
+    """Build an MP3 of an exact size with its padding after the audio.
+
+    The padding goes in an APEv2 tag between the audio and the trailing tags,
+    so the leading tag stays at its minimum size unless the padding is too
+    small for a tag of its own.
+
+    Args:
+        frames (bytes): Leading tag frames (and any extended header) to keep
+        audio (bytes): MP3 data to follow the tag, without any tags
+        trailer (bytes): Tags to keep at the very end, such as ID3v1
+        target_size (int): Desired final size in bytes
+        version (int, optional): Major version of the tag the frames came from.
+            Defaults to 3.
+        flags (int, optional): Flags of the tag the frames came from, without
+            the footer flag. Defaults to 0.
+
+    Returns:
+        bytes: The padded MP3
+
+    Raises:
+        ValueError: If the tags and audio are already larger than the target
+    """
+    gap = target_size - _HEADER_SIZE - len(frames) - len(audio) - len(trailer)
+    if gap < 0:
+        raise ValueError(f"Data already larger than target by {-gap} bytes")
+    padding = trailing_padding(gap) if gap >= TRAILING_PADDING_MIN_SIZE else b""
+    return b"".join((leading_tag(frames, gap, version, flags), audio, padding, trailer))
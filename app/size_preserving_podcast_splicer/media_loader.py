@@ -9,16 +9,30 @@ Classes:
     MediaLoader: Loads the music and ads that the app uses
 """
 
-import random
+import hashlib
+import logging
+import time
+from collections.abc import Callable
 from pathlib import Path
 
 import ffmpeg  # type: ignore
 
+from app.size_preserving_podcast_splicer import pcm_cache
+
 BASE_DIR = Path(__file__).parent.parent.parent.resolve()
 MEDIA_DIR = BASE_DIR / "media"
 ADS_DIR = MEDIA_DIR / "ads"
 MUSIC_DIR = MEDIA_DIR / "music"
 
+# Bytes added to the predicted size of the largest render to get the enclosure
+# size, in case a render comes out slightly larger than predicted.
+ENCLOSURE_MARGIN_BYTES = 16 * 1024
+
+# Default seconds a listener keeps the same ad before it may change.
+DEFAULT_ROTATION_SECONDS = 60 * 60
+
+logger = logging.getLogger(__name__)
+
 
 class StreamAndProbe:
     """Wrapper class for ffmpeg audio streams with probe metadata.
@@ -44,6 +58,9 @@ class StreamAndProbe:
         self.probe = ffmpeg.probe(file_path)
         # We expect the first stream in each file to be audio.
         assert self.probe["streams"][0]["codec_type"] == "audio"
+        self._content_hash: str | None = None
+        # Decoded samples, once load_pcm has decoded them.
+        self.pcm: pcm_cache.DecodedAudio | None = None
 
     def duration(self) -> float:
         """Get the duration of the audio stream.
@@ -61,13 +78,62 @@ class StreamAndProbe:
         """
         return int(self.probe["format"]["size"])
 
+    def content_hash(self) -> str:
+        """Get a hash of the audio file's contents.
+
+        The file is only read the first time, later calls reuse the hash.
+
+        Returns:
+            str: Hex SHA-256 digest of the file
+        """
+        if self._content_hash is None:
+            digest = hashlib.sha256()
+            with open(self.probe["format"]["filename"], "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    digest.update(chunk)
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def sample_fmt(self) -> str:
+        """Get the sample format of the audio stream.
+
+        Returns:
+            str: ffmpeg sample format, defaulting to "s16" if not specified
+        """
+        return self.probe["streams"][0].get("sample_fmt", "s16")
+
+    def load_pcm(
+        self, directory: str | Path, like: "StreamAndProbe | None" = None
+    ) -> None:
+        """Decode the audio to raw PCM, so it's only decoded once.
+
+        Decoding to another stream's parameters converts the audio once, so
+        it can be mixed with that stream without resampling each time. If it
+        can't be decoded, pcm stays None and the file is decoded as needed.
+
+        Args:
+            directory (str | Path): Directory to keep decoded audio in
+            like (StreamAndProbe | None, optional): Audio whose sample rate,
+                channels and sample format to decode to. Defaults to None,
+                which keeps the audio's own.
+        """
+        stream = (like or self).probe["streams"][0]
+        self.pcm = pcm_cache.decode(
+            self.probe["format"]["filename"],
+            self.content_hash(),
+            int(stream["sample_rate"]),
+            int(stream["channels"]),
+            (like or self).sample_fmt(),
+            directory,
+        )
+
 
 class MediaLoader:
     """Manages access to music tracks and advertisement audio files.
 
     Loads and provides access to a music track and a collection of
-    advertisements from predefined directories. Handles random ad selection
-    and calculates target byte sizes for combined audio content.
+    advertisements from predefined directories. Handles sticky ad
+    selection and calculates target byte sizes for combined audio content.
 
     The loader expects:
         - Advertisements in BASE_DIR/media/ads/
@@ -75,14 +141,36 @@ class MediaLoader:
 
     On initialization, loads all advertisements from the ads directory
     and a specific Bach music track.
+
+    Args:
+        size_estimator (Callable | None, optional): Predicts the size the
+            render of the music and an ad needs, or None if it can't. When
+            given, the target size is derived from its predictions rather
+            than the size heuristic. Defaults to None.
+        pcm_dir (str | Path | None, optional): Directory to decode the music
+            and ads into, with the ads converted to the music's sample rate,
+            channels and sample format, so renders don't need to decode or
+            resample them. Defaults to None, which doesn't decode them.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        size_estimator: (
+            Callable[[StreamAndProbe, StreamAndProbe], int | None] | None
+        ) = None,
+        pcm_dir: str | Path | None = None,
+    ) -> None:
         """Initialize the MediaLoader with advertisements and music track.
         
         Loads all audio files from the ads directory and a specific Bach music track
         from the music directory. The paths are determined relative to the module location.
         """
+        self.size_estimator = size_estimator
+        self.pcm_dir = pcm_dir
+        # Content hashes of the inventory the target size was last computed
+        # for, and the size.
+        self._target_size: tuple[tuple[str, ...], int] | None = None
+        self._ads_listing = _listing(ADS_DIR)
         self.ads = [StreamAndProbe(str(path)) for path in ADS_DIR.glob("*")]
         self.music_track = StreamAndProbe(
             str(
@@ -90,15 +178,68 @@ class MediaLoader:
                 / "Kimiko Ishizaka - J.S. Bach- -Open- Goldberg Variations, BWV 988 (Piano) - 15 Variatio 14 a 2 Clav.mp3"
             )
         )
-
-    def random_ad(self) -> StreamAndProbe:
-        """Select a random advertisement from the loaded collection.
+        if self.pcm_dir is not None:
+            self.music_track.load_pcm(self.pcm_dir)
+        self._load_ads_pcm(self.ads)
+
+    def _load_ads_pcm(self, ads: list[StreamAndProbe]) -> None:
+        # Ads are converted to the music's parameters as they're decoded, so
+        # renders never need to resample them.
+        if self.pcm_dir is None:
+            return
+        for ad in ads:
+            ad.load_pcm(self.pcm_dir, like=self.music_track)
+
+    def sticky_ad(
+        self,
+        listener: str,
+        rotation_seconds: float = DEFAULT_ROTATION_SECONDS,
+        now: float | None = None,
+    ) -> StreamAndProbe:
+        """Select the advertisement a listener hears, the same on every call.
+
+        Every request of one download is given the same ad, so the download
+        isn't assembled from several variants and each request can be served
+        from the same cached render. The ad changes each rotation window.
+
+        The ad is chosen by rendezvous hashing: each ad is scored by a hash of
+        the listener, the window and the ad's contents, and the highest
+        scoring ad wins. Adding or removing an ad only moves the listeners
+        whose ad it gains or loses, regardless of the order ads are loaded.
+
+        Args:
+            listener (str): Key identifying the listener, such as their
+                address and user agent
+            rotation_seconds (float, optional): Length of the window a
+                listener keeps their ad for. Defaults to
+                DEFAULT_ROTATION_SECONDS.
+            now (float | None, optional): Time to choose the ad for, in
+                seconds since the epoch. Defaults to None, the current time.
 
         Returns:
-            StreamAndProbe: Randomly selected advertisement stream
+            StreamAndProbe: The listener's advertisement
+
+        Raises:
+            ValueError: If rotation_seconds isn't positive
         """
-        index = random.randint(0, len(self.ads) - 1)
-        return self.ads[index]
+        if rotation_seconds <= 0:
+            raise ValueError(f"Rotation must be positive, got {rotation_seconds}")
+        if now is None:
+            now = time.time()
+        listener_hash = hashlib.sha256(listener.encode("utf-8")).digest()
+        # Offset each listener's windows, so that listeners don't all change
+        # ads at once and few downloads straddle a change.
+        offset = int.from_bytes(listener_hash[:8], "big") % max(
+            int(rotation_seconds), 1
+        )
+        window = int((now + offset) // rotation_seconds)
+
+        def score(ad: StreamAndProbe) -> bytes:
+            return hashlib.sha256(
+                b"%s:%d:%s" % (listener_hash, window, ad.content_hash().encode())
+            ).digest()
+
+        return max(self.ads, key=score)
 
     def music(self) -> StreamAndProbe:
         """Get the main music track.
@@ -108,11 +249,37 @@ class MediaLoader:
         """
         return self.music_track
 
+    def reload_ads(self) -> bool:
+        """Reload the advertisements if the ads directory has changed.
+
+        Ads are only probed again if a file was added, removed or modified
+        since they were last loaded. The new ads are decoded if there's a
+        pcm_dir, and the target size recomputed for them, before they
+        replace the old ones.
+
+        Returns:
+            bool: True if the ads were reloaded
+        """
+        listing = _listing(ADS_DIR)
+        if listing == self._ads_listing:
+            return False
+        logger.info(f"Reloading ads from {ADS_DIR}")
+        ads = [StreamAndProbe(str(path)) for path in ADS_DIR.glob("*")]
+        self._load_ads_pcm(ads)
+        target_size = self._target_size_for(ads)
+        self.ads, self._target_size, self._ads_listing = ads, target_size, listing
+        return True
+
     def target_bytes_size(self) -> int:
         """Calculate target size for combined music and ad content.
 
-        Determines the optimal file size that can accommodate both the
-        music track and an advertisement. Returns the smaller of:
+        With a size estimator, returns the largest predicted render size plus
+        ENCLOSURE_MARGIN_BYTES. The result is cached until the music or ads
+        change.
+
+        Otherwise, or if any render can't be predicted, determines a file
+        size that can accommodate both the music track and an advertisement.
+        Returns the smaller of:
             - Music size + largest ad size
             - Music size + 10% buffer
 
@@ -125,8 +292,29 @@ class MediaLoader:
             This calculation ensures the final file size will be consistent
             regardless of which advertisement is inserted.
         """
+        ads = self.ads
+        if self._target_size is None or self._target_size[0] != _inventory(
+            self.music_track, ads
+        ):
+            self._target_size = self._target_size_for(ads)
+        return self._target_size[1]
+
+    def _target_size_for(
+        self, ads: list[StreamAndProbe]
+    ) -> tuple[tuple[str, ...], int]:
+        return _inventory(self.music_track, ads), self._calculate_target_bytes_size(ads)
+
+    def _calculate_target_bytes_size(self, ads: list[StreamAndProbe]) -> int:
+        if self.size_estimator is not None:
+            predicted = [self.size_estimator(self.music_track, ad) for ad in ads]
+            if predicted and None not in predicted:
+                size = max(p for p in predicted if p is not None)
+                logger.info(f"Enclosure size from predicted renders: {size}")
+                return size + ENCLOSURE_MARGIN_BYTES
+            logger.info("Can't predict every render, estimating enclosure size")
+
         largest_ad_bytes_count = 0
-        for ad in self.ads:
+        for ad in ads:
             if ad.size() > largest_ad_bytes_count:
                 largest_ad_bytes_count = ad.size()
 
@@ -140,3 +328,17 @@ class MediaLoader:
         if music_and_largest_ad_bytes_count <= music_and_ten_percent_more_bytes_count:
             return music_and_largest_ad_bytes_count
         return music_and_ten_percent_more_bytes_count
+
+
+def _inventory(music: StreamAndProbe, ads: list[StreamAndProbe]) -> tuple[str, ...]:
+    # Keyed on contents, so replacing a file under the same name counts.
+    return tuple(stream.content_hash() for stream in [music, *ads])
+
+
+def _listing(directory: Path) -> list[tuple[str, int, int]]:
+    """List a directory's files with their modification times and sizes."""
+    listing = []
+    for path in sorted(directory.glob("*")):
+        stat = path.stat()
+        listing.append((path.name, stat.st_mtime_ns, stat.st_size))
+    return listing
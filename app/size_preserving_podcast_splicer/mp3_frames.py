@@ -0,0 +1,711 @@
+"""MPEG Audio Frame Parsing and Rewriting
+
+This module provides frame-level access to MP3 data so that audio can be
+spliced without decoding and re-encoding the parts that don't change. It
+understands just enough of the MPEG-1/2/2.5 Layer III bitstream to walk the
+frames of a file, find the bytes each frame's main data lives in, and rewrite
+the Xing/LAME header that players use for duration, seeking and gapless
+playback.
+
+Key Components:
+    FrameHeader: Decoded 4 byte MPEG audio frame header
+    XingHeader: Xing/Info (and LAME) header found in the first frame of a file
+    Mp3Frames: Index of all frames in an MP3 buffer
+    build_frame: Assembles a frame from a header, side info and payload
+
+Technical Details:
+    - Only Layer III is supported, as that's all the app serves
+    - Layer III frames can store part of their main data in earlier frames
+      (the bit reservoir), which is tracked via main_data_begin so splices
+      can keep the bytes a copied frame depends on
+    - Leading ID3v2 tags and trailing ID3v1/APE tags are kept as opaque bytes
+    - Sizes of libmp3lame CBR streams can be computed exactly ahead of encoding,
+      by following its frame count and padding bit rules
+"""
+
+from dataclasses import dataclass
+
+# Layer III bitrates in kbps, indexed by the header's bitrate index. Index 0
+# (free format) and 15 (bad) are not supported.
+_MPEG1_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+_MPEG2_BITRATES = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+MAX_BITRATE_INDEX = 14
+
+# Sample rates indexed by the header's version bits then sample rate index.
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),  # MPEG-2.5
+}
+
+_MONO = 3  # Channel mode value for single channel frames.
+
+# Decoders skip this many samples on top of the encoder delay recorded in the
+# LAME tag, it's the delay of the layer III synthesis filterbank.
+DECODER_DELAY = 529
+
+# libmp3lame's encoder delay in samples, it's recorded in the LAME tag of
+# anything it encodes.
+LAME_ENCODER_DELAY = 576
+
+# libmp3lame pads the end of a stream with at least a granule of silence so
+# the last real samples can be fully decoded.
+_LAME_MIN_END_PADDING = 576
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    """A decoded MPEG audio Layer III frame header.
+
+    Attributes:
+        version_bits (int): Raw version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+        protected (bool): Whether a 16 bit CRC follows the header
+        bitrate_index (int): Index into the bitrate table
+        sample_rate_index (int): Index into the sample rate table
+        padding (int): 1 if the frame has an extra padding byte, else 0
+        raw (bytes): The original 4 header bytes
+    """
+
+    version_bits: int
+    protected: bool
+    bitrate_index: int
+    sample_rate_index: int
+    padding: int
+    raw: bytes
+
+    @property
+    def is_mpeg1(self) -> bool:
+        return self.version_bits == 3
+
+    @property
+    def bitrate_kbps(self) -> int:
+        table = _MPEG1_BITRATES if self.is_mpeg1 else _MPEG2_BITRATES
+        return table[self.bitrate_index]
+
+    @property
+    def sample_rate(self) -> int:
+        return _SAMPLE_RATES[self.version_bits][self.sample_rate_index]
+
+    @property
+    def channels(self) -> int:
+        return 1 if self.raw[3] >> 6 == _MONO else 2
+
+    @property
+    def samples_per_frame(self) -> int:
+        return 1152 if self.is_mpeg1 else 576
+
+    @property
+    def side_info_size(self) -> int:
+        if self.is_mpeg1:
+            return 17 if self.channels == 1 else 32
+        return 9 if self.channels == 1 else 17
+
+    @property
+    def payload_offset(self) -> int:
+        """Offset of the main data area from the start of the frame."""
+        return 4 + (2 if self.protected else 0) + self.side_info_size
+
+    @property
+    def length(self) -> int:
+        """Total length of the frame in bytes, including the header."""
+        return frame_length(
+            self.is_mpeg1, self.bitrate_kbps, self.sample_rate, self.padding
+        )
+
+    def with_bitrate(self, bitrate_index: int, padding: int) -> "FrameHeader":
+        """Create a copy of this header with a different frame size.
+
+        Args:
+            bitrate_index (int): New bitrate index
+            padding (int): New padding bit
+
+        Returns:
+            FrameHeader: Header identical to this one except for its size
+        """
+        raw = bytearray(self.raw)
+        raw[2] = (bitrate_index << 4) | (raw[2] & 0x0C) | (padding << 1) | (raw[2] & 1)
+        return FrameHeader(
+            self.version_bits,
+            self.protected,
+            bitrate_index,
+            self.sample_rate_index,
+            padding,
+            bytes(raw),
+        )
+
+
+def frame_length(
+    is_mpeg1: bool, bitrate_kbps: int, sample_rate: int, padding: int
+) -> int:
+    """Calculate the size of a Layer III frame in bytes.
+
+    Args:
+        is_mpeg1 (bool): True for MPEG-1, False for MPEG-2/2.5
+        bitrate_kbps (int): Frame bitrate in kbps
+        sample_rate (int): Sample rate in Hz
+        padding (int): Padding bit of the frame
+
+    Returns:
+        int: Frame length in bytes
+    """
+    coefficient = 144000 if is_mpeg1 else 72000
+    return coefficient * bitrate_kbps // sample_rate + padding
+
+
+def bitrate_index(is_mpeg1: bool, bitrate_kbps: int) -> int:
+    """Look up the header bitrate index for a bitrate.
+
+    Args:
+        is_mpeg1 (bool): True for MPEG-1, False for MPEG-2/2.5
+        bitrate_kbps (int): Bitrate in kbps
+
+    Returns:
+        int: Bitrate index
+
+    Raises:
+        ValueError: If the bitrate isn't valid for the MPEG version
+    """
+    table = _MPEG1_BITRATES if is_mpeg1 else _MPEG2_BITRATES
+    return table.index(bitrate_kbps, 1)
+
+
+def bitrates(is_mpeg1: bool) -> list[int]:
+    """Get the Layer III bitrates for an MPEG version.
+
+    Args:
+        is_mpeg1 (bool): True for MPEG-1, False for MPEG-2/2.5
+
+    Returns:
+        list[int]: Valid bitrates in kbps, lowest first
+    """
+    return (_MPEG1_BITRATES if is_mpeg1 else _MPEG2_BITRATES)[1:]
+
+
+def lame_frame_count(sample_count: int, samples_per_frame: int) -> int:
+    """Count the frames libmp3lame encodes audio into.
+
+    Args:
+        sample_count (int): Samples per channel of audio encoded
+        samples_per_frame (int): Samples per frame of the output
+
+    Returns:
+        int: Number of audio frames, not counting any Xing/Info frame
+    """
+    total = sample_count + LAME_ENCODER_DELAY + _LAME_MIN_END_PADDING
+    return -(-total // samples_per_frame)
+
+
+def lame_cbr_size(
+    is_mpeg1: bool, bitrate_kbps: int, sample_rate: int, start: int, end: int
+) -> int:
+    """Calculate the size of a run of frames from a libmp3lame CBR encode.
+
+    CBR frames are only whole bytes long, so LAME sets the padding bit on
+    some frames to keep the average bitrate exact. It keeps a running
+    remainder that starts out at one frame's fraction of a byte and pads
+    whenever the remainder goes negative, so the number of padded frames
+    before frame k is ceil((k - 1) * fraction / sample_rate).
+
+    Args:
+        is_mpeg1 (bool): True for MPEG-1, False for MPEG-2/2.5
+        bitrate_kbps (int): Bitrate of the encode in kbps
+        sample_rate (int): Sample rate in Hz
+        start (int): Index of the first frame of the run
+        end (int): Index one past the last frame of the run
+
+    Returns:
+        int: Total length of frames [start, end) in bytes
+    """
+    coefficient = 144000 if is_mpeg1 else 72000
+    fraction = coefficient * bitrate_kbps % sample_rate
+
+    def padded_before(index: int) -> int:
+        return -(-(index - 1) * fraction // sample_rate)
+
+    unpadded = frame_length(is_mpeg1, bitrate_kbps, sample_rate, 0)
+    return (end - start) * unpadded + padded_before(end) - padded_before(start)
+
+
+def parse_frame_header(data: bytes, offset: int) -> FrameHeader | None:
+    """Parse the frame header at an offset.
+
+    Args:
+        data (bytes): Buffer containing MP3 data
+        offset (int): Offset of the candidate header
+
+    Returns:
+        FrameHeader | None: The header, or None if there isn't a valid Layer III
+            header at the offset
+    """
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset : offset + 4]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version_bits = (b1 >> 3) & 3
+    layer_bits = (b1 >> 1) & 3
+    index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 3
+    if (
+        version_bits == 1  # Reserved.
+        or layer_bits != 1  # Only layer III.
+        or index == 0  # Free format.
+        or index == 15
+        or sample_rate_index == 3
+    ):
+        return None
+    return FrameHeader(
+        version_bits=version_bits,
+        protected=not (b1 & 1),
+        bitrate_index=index,
+        sample_rate_index=sample_rate_index,
+        padding=(b2 >> 1) & 1,
+        raw=bytes((b0, b1, b2, b3)),
+    )
+
+
+def id3v2_size(data: bytes) -> int:
+    """Get the size of any ID3v2 tags at the start of a buffer.
+
+    Args:
+        data (bytes): Buffer containing an MP3 file
+
+    Returns:
+        int: Number of bytes taken by leading ID3v2 tags, 0 if there are none
+    """
+    offset = 0
+    while data[offset : offset + 3] == b"ID3" and len(data) >= offset + 10:
+        size = synchsafe_decode(data[offset + 6 : offset + 10])
+        has_footer = data[offset + 5] & 0x10
+        offset += 10 + size + (10 if has_footer else 0)
+    return offset
+
+
+def synchsafe_decode(data: bytes) -> int:
+    """Decode a 4 byte synchsafe integer as used by ID3v2.
+
+    Args:
+        data (bytes): The 4 encoded bytes
+
+    Returns:
+        int: The decoded value
+    """
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def main_data_begin(header: FrameHeader, side_info: bytes) -> int:
+    """Read how many bytes before a frame its main data starts.
+
+    Args:
+        header (FrameHeader): Header of the frame
+        side_info (bytes): Side info of the frame
+
+    Returns:
+        int: Back pointer into the bit reservoir in bytes
+    """
+    if header.is_mpeg1:
+        return (side_info[0] << 1) | (side_info[1] >> 7)
+    return side_info[0]
+
+
+def with_main_data_begin(header: FrameHeader, side_info: bytes, value: int) -> bytes:
+    """Rewrite the main_data_begin field of a frame's side info.
+
+    Args:
+        header (FrameHeader): Header of the frame
+        side_info (bytes): Side info of the frame
+        value (int): New back pointer into the bit reservoir
+
+    Returns:
+        bytes: Updated side info
+    """
+    updated = bytearray(side_info)
+    if header.is_mpeg1:
+        updated[0] = value >> 1
+        updated[1] = (updated[1] & 0x7F) | ((value & 1) << 7)
+    else:
+        updated[0] = value
+    return bytes(updated)
+
+
+def max_main_data_begin(header: FrameHeader) -> int:
+    """Largest back pointer the frame's main_data_begin field can hold."""
+    return 511 if header.is_mpeg1 else 255
+
+
+def main_data_length(header: FrameHeader, side_info: bytes) -> int:
+    """Calculate how many bytes of main data a frame uses.
+
+    Sums the part2_3_length of each granule and channel in the side info.
+
+    Args:
+        header (FrameHeader): Header of the frame
+        side_info (bytes): Side info of the frame
+
+    Returns:
+        int: Length of the frame's main data in bytes
+    """
+    bits = int.from_bytes(side_info, "big")
+    total_bits = len(side_info) * 8
+    channels = header.channels
+    if header.is_mpeg1:
+        start = 9 + (5 if channels == 1 else 3) + 4 * channels
+        granules, stride = 2, 59
+    else:
+        start = 8 + (1 if channels == 1 else 2)
+        granules, stride = 1, 63
+    length = 0
+    for index in range(granules * channels):
+        shift = total_bits - (start + index * stride) - 12
+        length += (bits >> shift) & 0xFFF
+    return (length + 7) // 8
+
+
+def build_frame(header: FrameHeader, side_info: bytes, payload: bytes) -> bytes:
+    """Assemble a frame from its parts.
+
+    Args:
+        header (FrameHeader): Header of the frame, its size must match the data
+            and it must not be CRC protected
+        side_info (bytes): Side info of the frame
+        payload (bytes): Main data area of the frame
+
+    Returns:
+        bytes: The complete frame
+    """
+    assert not header.protected, "Frames with a CRC aren't supported"
+    frame = header.raw + side_info + payload
+    assert len(frame) == header.length, "Frame data doesn't match header size"
+    return frame
+
+
+def _crc16(data: bytes) -> int:
+    """CRC-16 (polynomial 0x8005, reflected) as used by the LAME tag."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+class XingHeader:
+    """The Xing/Info header stored in the first frame of many MP3 files.
+
+    Players use it to find the duration (frame count), to seek (the TOC) and,
+    via the LAME extension, to trim encoder delay and padding for gapless
+    playback. When frames are added or removed the header needs rebuilding
+    so that it still describes the file.
+
+    Args:
+        frame (bytes): The complete first frame of the file
+        header (FrameHeader): Parsed header of that frame
+        offset (int): Offset of the b"Xing"/b"Info" marker within the frame
+    """
+
+    _FRAMES_FLAG = 1
+    _BYTES_FLAG = 2
+    _TOC_FLAG = 4
+    _QUALITY_FLAG = 8
+
+    def __init__(self, frame: bytes, header: FrameHeader, offset: int) -> None:
+        self.frame = frame
+        self.header = header
+        self.offset = offset
+        self.flags = int.from_bytes(frame[offset + 4 : offset + 8], "big")
+        position = offset + 8
+        self.frames_offset = self.bytes_offset = self.toc_offset = None
+        if self.flags & self._FRAMES_FLAG:
+            self.frames_offset = position
+            position += 4
+        if self.flags & self._BYTES_FLAG:
+            self.bytes_offset = position
+            position += 4
+        if self.flags & self._TOC_FLAG:
+            self.toc_offset = position
+            position += 100
+        if self.flags & self._QUALITY_FLAG:
+            position += 4
+        # The LAME extension follows directly and is 36 bytes long.
+        self.lame_offset: int | None = None
+        if position + 36 <= len(frame) and frame[position : position + 4] in (
+            b"LAME",
+            b"Lavc",
+            b"Lavf",
+        ):
+            self.lame_offset = position
+
+    @classmethod
+    def parse(cls, frame: bytes, header: FrameHeader) -> "XingHeader | None":
+        """Find a Xing/Info header in a frame.
+
+        Args:
+            frame (bytes): The complete first frame of a file
+            header (FrameHeader): Parsed header of that frame
+
+        Returns:
+            XingHeader | None: The header, or None if the frame is regular audio
+        """
+        offset = header.payload_offset
+        if frame[offset : offset + 4] not in (b"Xing", b"Info"):
+            return None
+        return cls(frame, header, offset)
+
+    def encoder_delay(self) -> int:
+        """Samples of encoder delay from the LAME tag, 0 if there's no tag."""
+        if self.lame_offset is None:
+            return 0
+        return (
+            int.from_bytes(
+                self.frame[self.lame_offset + 21 : self.lame_offset + 24], "big"
+            )
+            >> 12
+        )
+
+    def encoder_padding(self) -> int:
+        """Samples of end padding from the LAME tag, 0 if there's no tag."""
+        if self.lame_offset is None:
+            return 0
+        return (
+            int.from_bytes(
+                self.frame[self.lame_offset + 21 : self.lame_offset + 24], "big"
+            )
+            & 0xFFF
+        )
+
+    def frame_count(self) -> int | None:
+        """Number of audio frames (excluding this one) the header describes."""
+        if self.frames_offset is None:
+            return None
+        return int.from_bytes(
+            self.frame[self.frames_offset : self.frames_offset + 4], "big"
+        )
+
+    def rebuild(
+        self,
+        headers: list[FrameHeader],
+        gapless: tuple[int, int] | None = None,
+    ) -> bytes:
+        """Create an updated copy of the header frame.
+
+        Args:
+            headers (list[FrameHeader]): Headers of the audio frames that will
+                follow the header frame
+            gapless (tuple[int, int] | None, optional): Encoder delay and end
+                padding in samples to record in the LAME tag. Defaults to None,
+                which keeps the existing values.
+
+        Returns:
+            bytes: The rebuilt header frame
+        """
+        frame = bytearray(self.frame)
+        frame_offsets = []
+        byte_count = len(frame)
+        for header in headers:
+            frame_offsets.append(byte_count)
+            byte_count += header.length
+        vbr = len({header.bitrate_index for header in headers}) > 1
+
+        frame[self.offset : self.offset + 4] = b"Xing" if vbr else b"Info"
+        if self.frames_offset is not None:
+            frame[self.frames_offset : self.frames_offset + 4] = len(headers).to_bytes(
+                4, "big"
+            )
+        if self.bytes_offset is not None:
+            frame[self.bytes_offset : self.bytes_offset + 4] = byte_count.to_bytes(
+                4, "big"
+            )
+        if self.toc_offset is not None:
+            for i in range(100):
+                position = frame_offsets[i * len(frame_offsets) // 100]
+                frame[self.toc_offset + i] = min(255, 256 * position // byte_count)
+        if self.lame_offset is not None:
+            lame = self.lame_offset
+            if gapless is not None:
+                delay, padding = gapless
+                frame[lame + 21 : lame + 24] = ((delay << 12) | padding).to_bytes(
+                    3, "big"
+                )
+            frame[lame + 28 : lame + 32] = byte_count.to_bytes(4, "big")
+            frame[lame + 34 : lame + 36] = _crc16(bytes(frame[: lame + 34])).to_bytes(
+                2, "big"
+            )
+        return bytes(frame)
+
+
+class Mp3Frames:
+    """Index of the Layer III frames in an MP3 buffer.
+
+    Splits a buffer into leading tags, an optional Xing/Info header frame,
+    the audio frames and any trailing bytes (usually ID3v1 or APE tags).
+
+    Args:
+        data (bytes): Complete MP3 file or raw MP3 stream
+
+    Raises:
+        ValueError: If no frames are found or the frames change sample rate,
+            channel count or MPEG version part way through
+
+    Example:
+        ```python
+        frames = Mp3Frames(open("/path/to/audio.mp3", "rb").read())
+        first_half = frames.frame_bytes(0, len(frames.offsets) // 2)
+        ```
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.audio_start = id3v2_size(data)
+        self.offsets: list[int] = []
+        self.headers: list[FrameHeader] = []
+        offset = self.audio_start
+        while (header := parse_frame_header(data, offset)) is not None:
+            if offset + header.length > len(data):
+                break
+            self.offsets.append(offset)
+            self.headers.append(header)
+            offset += header.length
+        self.audio_end = offset
+        if not self.headers:
+            raise ValueError("No MPEG Layer III frames found")
+        first = self.headers[0]
+        for header in self.headers:
+            if (
+                header.version_bits != first.version_bits
+                or header.sample_rate_index != first.sample_rate_index
+                or header.channels != first.channels
+            ):
+                raise ValueError("Stream parameters change between frames")
+
+        self.xing: XingHeader | None = XingHeader.parse(
+            data[self.offsets[0] : self.offsets[0] + first.length], first
+        )
+        if self.xing is not None:
+            self.offsets.pop(0)
+            self.headers.pop(0)
+
+    @property
+    def sample_rate(self) -> int:
+        return self.headers[0].sample_rate
+
+    @property
+    def channels(self) -> int:
+        return self.headers[0].channels
+
+    @property
+    def samples_per_frame(self) -> int:
+        return self.headers[0].samples_per_frame
+
+    @property
+    def is_mpeg1(self) -> bool:
+        return self.headers[0].is_mpeg1
+
+    def decoder_skip(self) -> int:
+        """Samples a gapless decoder drops from the start of the stream."""
+        if self.xing is None or self.xing.lame_offset is None:
+            return 0
+        return self.xing.encoder_delay() + DECODER_DELAY
+
+    def sample_count(self) -> int:
+        """Number of samples a gapless decoder outputs for the stream."""
+        total = len(self.offsets) * self.samples_per_frame
+        if self.xing is None or self.xing.lame_offset is None:
+            return total
+        return total - self.xing.encoder_delay() - self.xing.encoder_padding()
+
+    def tag_bytes(self) -> bytes:
+        """Leading ID3v2 tag bytes."""
+        return self.data[: self.audio_start]
+
+    def trailer_bytes(self) -> bytes:
+        """Bytes after the last frame, usually ID3v1 or APE tags."""
+        return self.data[self.audio_end :]
+
+    def frame_bytes(self, start: int, end: int) -> bytes:
+        """Get the bytes of a run of consecutive audio frames.
+
+        Args:
+            start (int): Index of the first frame
+            end (int): Index one past the last frame
+
+        Returns:
+            bytes: The frames, copied verbatim
+        """
+        if start >= end:
+            return b""
+        end_offset = self.audio_end if end >= len(self.offsets) else self.offsets[end]
+        return self.data[self.offsets[start] : end_offset]
+
+    def side_info(self, index: int) -> bytes:
+        """Get the side info of an audio frame."""
+        header = self.headers[index]
+        start = self.offsets[index] + 4 + (2 if header.protected else 0)
+        return self.data[start : start + header.side_info_size]
+
+    def payload(self, index: int) -> bytes:
+        """Get the main data area of an audio frame."""
+        header = self.headers[index]
+        start = self.offsets[index] + header.payload_offset
+        return self.data[start : self.offsets[index] + header.length]
+
+    def main_data(self, index: int) -> bytes:
+        """Get a frame's own main data, assuming it doesn't use the reservoir.
+
+        Args:
+            index (int): Index of the audio frame
+
+        Returns:
+            bytes: The frame's main data
+
+        Raises:
+            ValueError: If the frame's main data starts in an earlier frame
+        """
+        header = self.headers[index]
+        side_info = self.side_info(index)
+        if main_data_begin(header, side_info) != 0:
+            raise ValueError("Frame uses the bit reservoir")
+        return self.payload(index)[: main_data_length(header, side_info)]
+
+    def reservoir_needed(self, index: int) -> int:
+        """Count the bytes before a frame that it or later frames depend on.
+
+        Frames can start their main data in the payloads of earlier frames. If
+        the frames before `index` are replaced, this many bytes from the end of
+        their payloads need to be kept for the frames from `index` on to decode.
+
+        Args:
+            index (int): Index of the first frame that will be kept
+
+        Returns:
+            int: Number of reservoir bytes required
+        """
+        needed = 0
+        available = 0  # Payload bytes between frame `index` and the current one.
+        for i in range(index, len(self.offsets)):
+            if available >= 511:
+                break
+            back = main_data_begin(self.headers[i], self.side_info(i))
+            needed = max(needed, back - available)
+            available += self.headers[i].length - self.headers[i].payload_offset
+        return needed
+
+    def reservoir_bytes(self, index: int, count: int) -> bytes:
+        """Get the last bytes of the payloads before a frame.
+
+        Args:
+            index (int): Index of the frame
+            count (int): Number of bytes to collect
+
+        Returns:
+            bytes: The reservoir bytes, in stream order
+        """
+        chunks: list[bytes] = []
+        remaining = count
+        i = index - 1
+        while remaining > 0 and i >= 0:
+            payload = self.payload(i)
+            take = min(remaining, len(payload))
+            chunks.append(payload[len(payload) - take :])
+            remaining -= take
+            i -= 1
+        return b"".join(reversed(chunks))
@@ -0,0 +1,199 @@
+"""Decoded PCM Cache
+
+This module decodes audio files once into raw PCM files on disk, so that
+renders read decoded samples rather than decoding MP3s every time.
+
+Key Components:
+    DecodedAudio: A raw PCM file, readable as a memory mapped NumPy array
+    decode: Decodes an audio file into the cache, reusing an earlier decode
+
+Technical Details:
+    - Samples are stored interleaved in the packed form of the requested
+      sample format, e.g. 32-bit floats for ffmpeg's "fltp"
+    - Files are named by the content hash of the source and the decode
+      parameters, so they survive restarts and are never stale
+    - Files are decoded to a temporary name and renamed into place, so a
+      crash never leaves a partial decode behind
+    - Mappings are read only and backed by the OS page cache, so processes
+      reading the same file share its pages rather than each holding a copy
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import ffmpeg  # type: ignore
+import numpy as np
+
+from app.size_preserving_podcast_splicer import disk_cache
+
+logger = logging.getLogger(__name__)
+
+# Raw ffmpeg format and NumPy dtype for each packed ffmpeg sample format.
+_RAW_FORMATS = {
+    "u8": ("u8", "u1"),
+    "s16": ("s16le", "<i2"),
+    "s32": ("s32le", "<i4"),
+    "s64": ("s64le", "<i8"),
+    "flt": ("f32le", "<f4"),
+    "dbl": ("f64le", "<f8"),
+}
+
+
+def packed_format(sample_fmt: str) -> str:
+    """Get the packed form of an ffmpeg sample format, as samples are stored.
+
+    Planar formats ("fltp") are stored interleaved, as raw files can't be
+    planar.
+
+    Args:
+        sample_fmt (str): ffmpeg sample format, packed or planar
+
+    Returns:
+        str: The packed sample format, e.g. "flt" for "fltp"
+    """
+    return sample_fmt[:-1] if sample_fmt.endswith("p") else sample_fmt
+
+
+def supports(sample_fmt: str) -> bool:
+    """Check whether samples in an ffmpeg sample format can be cached.
+
+    Args:
+        sample_fmt (str): ffmpeg sample format, e.g. "s16" or "fltp"
+
+    Returns:
+        bool: True if the format has a raw PCM equivalent
+    """
+    return packed_format(sample_fmt) in _RAW_FORMATS
+
+
+class DecodedAudio:
+    """Decoded audio stored as a raw PCM file.
+
+    The samples are mapped into memory the first time they're used. Pickling
+    only keeps the file's details, so a DecodedAudio can be handed to worker
+    processes, which map the same file and so share its pages.
+
+    Args:
+        path (str | Path): Path of the raw PCM file
+        sample_rate (int): Sample rate in Hz
+        channels (int): Number of channels
+        sample_fmt (str): ffmpeg sample format of the samples, packed or planar
+
+    Example:
+        ```python
+        decoded = decode("music.mp3", digest, 44100, 2, "fltp", "/path/to/pcm")
+        left = decoded.samples[:, 0]
+        stream = decoded.stream()
+        ```
+    """
+
+    def __init__(
+        self, path: str | Path, sample_rate: int, channels: int, sample_fmt: str
+    ) -> None:
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_fmt = packed_format(sample_fmt)
+        self.raw_format, dtype = _RAW_FORMATS[self.sample_fmt]
+        self.dtype = np.dtype(dtype)
+        self._samples: np.ndarray | None = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_samples"] = None
+        return state
+
+    @property
+    def samples(self) -> np.ndarray:
+        """Read-only view of the samples, shaped (samples, channels)."""
+        if self._samples is None:
+            if self.sample_count() == 0:
+                self._samples = np.zeros((0, self.channels), self.dtype)
+            else:
+                self._samples = np.memmap(
+                    self.path, dtype=self.dtype, mode="r"
+                ).reshape(-1, self.channels)
+        return self._samples
+
+    def sample_count(self) -> int:
+        """Get the number of samples per channel.
+
+        Returns:
+            int: Samples per channel in the file
+        """
+        return self.path.stat().st_size // (self.dtype.itemsize * self.channels)
+
+    def stream(self):
+        """Get an ffmpeg input that reads the decoded samples.
+
+        Returns:
+            ffmpeg input stream of the raw PCM file -- this is an
+                ffmpeg.FilterableStream but ffmpeg doesn't expose that type
+        """
+        return ffmpeg.input(
+            str(self.path),
+            f=self.raw_format,
+            ar=self.sample_rate,
+            ac=self.channels,
+        )
+
+
+def decode(
+    file_path: str,
+    content_hash: str,
+    sample_rate: int,
+    channels: int,
+    sample_fmt: str,
+    directory: str | Path,
+) -> DecodedAudio | None:
+    """Decode an audio file to raw PCM, unless it's already been decoded.
+
+    Args:
+        file_path (str): Path of the audio file to decode
+        content_hash (str): Hash of the file's contents
+        sample_rate (int): Sample rate in Hz to decode at
+        channels (int): Number of channels to decode to
+        sample_fmt (str): ffmpeg sample format to decode to
+        directory (str | Path): Directory to keep decoded files in, created
+            if it doesn't exist
+
+    Returns:
+        DecodedAudio | None: The decoded audio, or None if it couldn't be
+            decoded
+    """
+    if not supports(sample_fmt):
+        logger.info(f"Can't cache samples in {sample_fmt} format")
+        return None
+    directory = Path(directory)
+    packed = packed_format(sample_fmt)
+    key = disk_cache.content_key(content_hash, packed, sample_rate, channels)
+    decoded = DecodedAudio(directory / f"{key}.pcm", sample_rate, channels, packed)
+    if decoded.path.is_file():
+        logger.debug(f"Using decoded samples of {file_path} from {decoded.path}")
+        return decoded
+
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            ffmpeg.input(file_path).audio.output(
+                temp_path,
+                f=decoded.raw_format,
+                ar=sample_rate,
+                ac=channels,
+            ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+            os.replace(temp_path, decoded.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except ffmpeg.Error as e:
+        logger.error(f"FFmpeg error occurred: {e}")
+        return None
+    except OSError as e:
+        logger.error(f"Failed to write decoded samples of {file_path}: {e}")
+        return None
+    logger.info(f"Decoded {file_path} to {decoded.path}")
+    return decoded
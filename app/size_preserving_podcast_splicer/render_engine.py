@@ -0,0 +1,185 @@
+"""Bounded Process Pool for Rendering
+
+This module runs render jobs in a pool of worker processes with a bounded
+queue in front of it, so a burst of requests can't start an unbounded number
+of renders on a small machine.
+
+Key Components:
+    RenderEngine: Process pool that rejects jobs once its queue is full
+    RenderQueueFull: Raised when a job is submitted to a full queue
+
+Technical Details:
+    - The pool defaults to one worker per core available to the process
+    - Up to max_queue jobs wait for a worker; beyond that submissions fail
+      immediately rather than piling up
+    - Workers are spawned rather than forked, so they don't inherit the web
+      server's threads or event loop
+    - Job functions and their arguments must be picklable
+    - If a worker dies the pool is replaced, failing only the jobs that were
+      running or queued in it
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Default number of jobs allowed to wait for a worker.
+DEFAULT_MAX_QUEUE = 8
+
+
+class RenderQueueFull(Exception):
+    """Raised when a job is submitted while the render queue is full."""
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not every platform can report the cores available to a process.
+        return os.cpu_count() or 1
+
+
+class RenderEngine:
+    """Process pool for render jobs with a bounded queue.
+
+    Args:
+        max_workers (int | None, optional): Number of worker processes.
+            Defaults to None, which uses one per available core.
+        max_queue (int, optional): Most jobs that may wait for a worker.
+            Defaults to DEFAULT_MAX_QUEUE.
+
+    Example:
+        ```python
+        engine = RenderEngine()
+        try:
+            future = engine.submit(render, "music.mp3", "ad.mp3")
+        except RenderQueueFull:
+            ...  # Tell the client to retry later
+        ```
+    """
+
+    def __init__(
+        self, max_workers: int | None = None, max_queue: int = DEFAULT_MAX_QUEUE
+    ) -> None:
+        self.max_workers = max_workers or _available_cores()
+        self.max_queue = max_queue
+        self._pool = self._new_pool()
+        self._pending = 0
+        self._rejected = 0
+        self._restarts = 0
+        self._lock = threading.Lock()
+
+    def _new_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _replace_pool(self, broken: concurrent.futures.ProcessPoolExecutor) -> None:
+        """Start a new pool in place of one a worker died in.
+
+        A broken pool fails every job that was running or queued in it, and
+        every job submitted to it afterwards, so it's replaced the first time
+        the breakage is seen.
+
+        Args:
+            broken (ProcessPoolExecutor): The pool that broke, so it's only
+                replaced once however many of its jobs report it
+        """
+        with self._lock:
+            if self._pool is not broken:
+                return
+            self._pool = self._new_pool()
+            self._restarts += 1
+        logger.error("Render worker died, replacing the process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of submitted jobs waiting for a worker."""
+        return max(0, self._pending - self.max_workers)
+
+    @property
+    def is_full(self) -> bool:
+        """Whether a job submitted now would be rejected."""
+        return self._pending >= self.max_workers + self.max_queue
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> concurrent.futures.Future:
+        """Queue a job to run in a worker process.
+
+        Args:
+            fn (Callable[..., Any]): Module level function to run
+            *args (Any): Arguments to call it with
+
+        Returns:
+            Future: Resolves to the function's result
+
+        Raises:
+            RenderQueueFull: If max_queue jobs are already waiting
+        """
+        with self._lock:
+            if self.is_full:
+                self._rejected += 1
+                raise RenderQueueFull(
+                    f"Render queue is full with {self.max_queue} jobs waiting"
+                )
+            self._pending += 1
+        logger.debug(f"Queued render job, queue depth: {self.queue_depth}")
+        pool = self._pool
+        try:
+            try:
+                future = pool.submit(fn, *args)
+            except concurrent.futures.process.BrokenProcessPool:
+                self._replace_pool(pool)
+                pool = self._pool
+                future = pool.submit(fn, *args)
+        except BaseException:
+            self._job_done(pool, None)
+            raise
+        future.add_done_callback(lambda done: self._job_done(pool, done))
+        return future
+
+    def _job_done(
+        self,
+        pool: concurrent.futures.ProcessPoolExecutor,
+        future: concurrent.futures.Future | None,
+    ) -> None:
+        with self._lock:
+            self._pending -= 1
+        if (
+            future is not None
+            and not future.cancelled()
+            and isinstance(
+                future.exception(), concurrent.futures.process.BrokenProcessPool
+            )
+        ):
+            self._replace_pool(pool)
+
+    def stats(self) -> dict[str, int]:
+        """Get counters describing the engine's load.
+
+        Returns:
+            dict[str, int]: Workers, jobs running or queued, queue depth and
+                limit, jobs rejected because the queue was full, and how many
+                times the pool was replaced after a worker died
+        """
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "pending": self._pending,
+                "queue_depth": max(0, self._pending - self.max_workers),
+                "max_queue": self.max_queue,
+                "rejected": self._rejected,
+                "restarts": self._restarts,
+            }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes once their current jobs finish."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,96 @@
+import asyncio
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from app.size_preserving_podcast_splicer import media_loader
+from app.size_preserving_podcast_splicer.audio_splicer import AudioSplicer
+from app.size_preserving_podcast_splicer.media_loader import StreamAndProbe
+
+
+def stream(content_hash: str, pcm: object = None) -> SimpleNamespace:
+    return SimpleNamespace(
+        content_hash=lambda: content_hash,
+        pcm=pcm,
+        probe={"format": {"filename": content_hash}},
+    )
+
+
+def test_etag_depends_on_the_inputs_and_how_they_are_mixed():
+    splicer = AudioSplicer(cache_budget_bytes=0)
+    pcm = SimpleNamespace(sample_rate=44100, channels=2)
+    music, ad = stream("music"), stream("ad")
+
+    etag = splicer.etag(music, ad, 1000)
+
+    assert etag.startswith('"') and etag.endswith('"')
+    assert splicer.etag(music, ad, 1000) == etag
+    assert splicer.etag(music, ad, 1001) != etag
+    assert splicer.etag(music, stream("other ad"), 1000) != etag
+    # Mixing decoded samples renders different bytes to the filter graph.
+    assert splicer.etag(stream("music", pcm), stream("ad", pcm), 1000) != etag
+    splicer.close()
+
+
+def splicer_with_layout(served: bool) -> tuple[AudioSplicer, str, object]:
+    splicer = AudioSplicer()
+    key = splicer._cache_key(stream("music"), stream("ad"), 1000)
+    layout = SimpleNamespace(compose=lambda data: None)
+    splicer._layouts[key] = layout  # type: ignore[assignment]
+    if served:
+        assert splicer._serve_layout(key, layout)  # type: ignore[arg-type]
+    return splicer, key, layout
+
+
+def test_renders_not_matching_a_served_layout_are_rejected():
+    splicer, key, layout = splicer_with_layout(served=True)
+
+    with pytest.raises(RuntimeError):
+        splicer._store(key, stream("music"), stream("ad"), 1000, bytes(1000))
+
+    assert key not in splicer.cache
+    assert splicer._layouts[key] is layout
+    splicer.close()
+
+
+def test_renders_not_matching_an_unserved_layout_replace_it():
+    splicer, key, layout = splicer_with_layout(served=False)
+
+    stored = splicer._store(key, stream("music"), stream("ad"), 1000, bytes(1000))
+
+    assert stored == bytes(1000)
+    assert splicer._layouts[key] is None
+    # Once replaced, the old layout can't be served from.
+    assert not splicer._serve_layout(key, layout)  # type: ignore[arg-type]
+    splicer.close()
+
+
+@pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="Rendering needs ffmpeg",
+)
+def test_ranges_served_before_rendering_match_the_render():
+    music = StreamAndProbe(str(next(media_loader.MUSIC_DIR.glob("*.mp3"))))
+    ad = StreamAndProbe(str(media_loader.ADS_DIR / "OldRadio_Adv--Glocoat_Wax.mp3"))
+    splicer = AudioSplicer()
+    try:
+        required = splicer.required_size(music, ad)
+        assert required is not None
+        target = required + media_loader.ENCLOSURE_MARGIN_BYTES
+        ranges = [(0, 4096), (1_000_000, 1_100_000), (target - 4096, target)]
+
+        served = [
+            asyncio.run(splicer.read_range_async(music, ad, target, start, end))
+            for start, end in ranges
+        ]
+        # They came from the layout, without rendering.
+        assert not splicer.is_cached(music, ad, target)
+
+        rendered = bytes(splicer.insert_ad_and_pad(music, ad, target))
+        assert len(rendered) == target
+        for (start, end), (size, views) in zip(ranges, served):
+            assert size == target
+            assert b"".join(views) == rendered[start:end]
+    finally:
+        splicer.close()
@@ -0,0 +1,101 @@
+from app.size_preserving_podcast_splicer.byte_cache import ByteBudgetCache
+
+
+def test_evicts_least_recently_used_first():
+    cache = ByteBudgetCache(30)
+    cache.put("a", bytes(10))
+    cache.put("b", bytes(10))
+    cache.put("c", bytes(10))
+    cache.get("a")
+
+    cache.put("d", bytes(10))
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert "d" in cache
+    assert cache.resident_bytes == 30
+
+    cache.put("e", bytes(20))
+
+    assert "c" not in cache
+    assert "a" not in cache
+    assert list(cache._entries) == ["d", "e"]
+
+
+def test_rejects_values_larger_than_the_budget():
+    cache = ByteBudgetCache(10)
+    cache.put("a", bytes(5))
+
+    cache.put("big", bytes(11))
+
+    assert "big" not in cache
+    assert "a" in cache
+    assert cache.resident_bytes == 5
+    assert cache.evictions == 0
+
+
+def test_value_filling_the_budget_is_cached():
+    cache = ByteBudgetCache(10)
+    cache.put("a", bytes(5))
+
+    cache.put("b", bytes(10))
+
+    assert list(cache._entries) == ["b"]
+    assert cache.resident_bytes == 10
+
+
+def test_replacing_a_key_updates_its_size():
+    cache = ByteBudgetCache(20)
+    cache.put("a", bytes(15))
+    cache.put("b", bytes(5))
+
+    cache.put("a", bytes(3))
+
+    assert cache.resident_bytes == 8
+    assert len(cache) == 2
+    assert cache.evictions == 0
+    assert len(cache.get("a") or b"") == 3
+    # Replacing marks the key as the most recently used.
+    assert list(cache._entries) == ["b", "a"]
+
+
+def test_replacing_a_key_can_evict_others():
+    cache = ByteBudgetCache(20)
+    cache.put("a", bytes(5))
+    cache.put("b", bytes(10))
+
+    cache.put("b", bytes(18))
+
+    assert "a" not in cache
+    assert cache.resident_bytes == 18
+    assert cache.evictions == 1
+
+
+def test_stats_count_hits_misses_and_evictions():
+    cache = ByteBudgetCache(10)
+    cache.put("a", bytes(6))
+    cache.get("a")
+    cache.get("a")
+    cache.get("missing")
+    cache.put("b", bytes(6))
+    cache.get("a")
+
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 2,
+        "evictions": 1,
+        "entries": 1,
+        "resident_bytes": 6,
+        "budget_bytes": 10,
+    }
+
+
+def test_size_of_sets_what_counts_against_the_budget():
+    cache = ByteBudgetCache(10, size_of=lambda v: 1)
+
+    for i in range(10):
+        cache.put(str(i), bytes(100))
+
+    assert len(cache) == 10
+    assert cache.resident_bytes == 10
@@ -0,0 +1,112 @@
+import pytest
+
+from app import byte_ranges
+from app.byte_ranges import ByteRange, RangeNotSatisfiable, parse_range
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", [ByteRange(0, 100)]),
+        ("bytes=900-", [ByteRange(900, 1000)]),
+        ("bytes=-100", [ByteRange(900, 1000)]),
+        # Ranges past the end are clamped to the file.
+        ("bytes=900-5000", [ByteRange(900, 1000)]),
+        ("bytes=-5000", [ByteRange(0, 1000)]),
+        ("Bytes = 0-0", [ByteRange(0, 1)]),
+    ],
+)
+def test_parse_single_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+def test_parse_multiple_ranges_in_order():
+    assert parse_range("bytes=500-599, 0-9,-10", SIZE) == [
+        ByteRange(0, 10),
+        ByteRange(500, 600),
+        ByteRange(990, 1000),
+    ]
+
+
+def test_overlapping_and_adjacent_ranges_are_merged():
+    assert parse_range("bytes=0-99,50-149,150-199,-1", SIZE) == [
+        ByteRange(0, 200),
+        ByteRange(999, 1000),
+    ]
+    assert parse_range("bytes=" + ",".join(["0-999"] * 50), SIZE) == [
+        ByteRange(0, 1000)
+    ]
+
+
+def test_unsatisfiable_ranges_are_dropped():
+    assert parse_range("bytes=0-9,5000-6000,-0", SIZE) == [ByteRange(0, 10)]
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        None,
+        "",
+        "items=0-9",
+        "bytes",
+        "bytes=",
+        "bytes=abc",
+        "bytes=9-0",
+        "bytes=0-9,x-y",
+        "bytes=--5",
+    ],
+)
+def test_unparseable_headers_serve_the_whole_file(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_ranges_outside_the_file_are_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, SIZE)
+
+
+def test_too_many_ranges_are_not_satisfiable():
+    header = "bytes=" + ",".join(
+        f"{i * 10}-{i * 10}" for i in range(byte_ranges.MAX_RANGES + 1)
+    )
+
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, SIZE)
+
+
+def test_content_range_headers():
+    assert ByteRange(0, 100).content_range(SIZE) == "bytes 0-99/1000"
+    assert len(ByteRange(10, 20)) == 10
+    assert byte_ranges.unsatisfied_range(SIZE) == "bytes */1000"
+
+
+def test_multipart_byteranges_holds_each_range():
+    data = bytes(range(256)) * 4
+    view = memoryview(data)
+    ranges = [ByteRange(0, 10), ByteRange(990, 1000)]
+
+    body = byte_ranges.multipart_byteranges(
+        [(r, [view[r.start : r.end]]) for r in ranges],
+        len(data),
+        "audio/mpeg",
+        "BOUNDARY",
+    )
+
+    assert b"".join(body) == (
+        b"\r\n--BOUNDARY\r\n"
+        b"Content-Type: audio/mpeg\r\n"
+        b"Content-Range: bytes 0-9/1024\r\n\r\n" + data[:10] + b"\r\n--BOUNDARY\r\n"
+        b"Content-Type: audio/mpeg\r\n"
+        b"Content-Range: bytes 990-999/1024\r\n\r\n"
+        + data[990:1000]
+        + b"\r\n--BOUNDARY--\r\n"
+    )
+    # The ranges are passed through as views, not copied.
+    assert any(isinstance(part, memoryview) for part in body)
+
+
+def test_boundaries_are_unique():
+    assert byte_ranges.make_boundary() != byte_ranges.make_boundary()
@@ -0,0 +1,86 @@
+import pytest
+
+from app.size_preserving_podcast_splicer.audio_splicer import _resident_size
+from app.size_preserving_podcast_splicer.byte_cache import ByteBudgetCache
+from app.size_preserving_podcast_splicer.composed_audio import ComposedAudio
+
+MUSIC = bytes(range(256)) * 40
+AD = b"ad" * 500
+
+
+def composed() -> ComposedAudio:
+    music = memoryview(MUSIC)
+    return ComposedAudio([music[:4000], AD, b"", music[6000:]])
+
+
+def test_len_counts_every_segment():
+    audio = composed()
+
+    assert len(audio) == 4000 + len(AD) + len(MUSIC) - 6000
+    assert len(ComposedAudio([])) == 0
+
+
+def test_bytes_follow_the_segments_in_order():
+    expected = MUSIC[:4000] + AD + MUSIC[6000:]
+
+    assert composed().tobytes() == expected
+    assert bytes(composed()) == expected
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        (0, 10),
+        (3990, 4010),
+        (3990, 5010),
+        (4500, 4600),
+        (4999, 5001),
+        (0, 99999),
+        (5000, 5000),
+    ],
+)
+def test_reads_across_segment_boundaries(start, end):
+    audio = composed()
+    expected = audio.tobytes()[start:end]
+
+    assert b"".join(audio.views(start, end)) == expected
+    assert audio[start:end].tobytes() == expected
+    assert len(audio[start:end]) == len(expected)
+
+
+def test_views_dont_copy_the_segments():
+    audio = composed()
+
+    views = audio.views(3990, 5010)
+
+    assert [view.obj for view in views] == [MUSIC, AD, MUSIC]
+    assert [len(view) for view in views] == [10, 1000, 10]
+
+
+def test_slices_share_the_buffers():
+    sliced = composed()[3990:5010]
+
+    assert sliced.owned_bytes == 0
+    assert all(view.obj in (MUSIC, AD) for view in sliced.views())
+    assert sliced[5:15].views()[1].obj is AD
+
+
+def test_only_bytes_segments_are_owned():
+    assert composed().owned_bytes == len(AD)
+
+
+def test_byte_budget_counts_only_owned_bytes():
+    cache = ByteBudgetCache(3 * len(AD), size_of=_resident_size)
+
+    for key in "abc":
+        cache.put(key, composed())
+
+    # Each is much longer than the budget allows, but shares the music.
+    assert len(composed()) > cache.budget_bytes
+    assert cache.resident_bytes == 3 * len(AD)
+    assert len(cache) == 3
+
+    cache.put("whole", bytes(10))
+
+    assert cache.resident_bytes == 2 * len(AD) + 10
+    assert "a" not in cache
@@ -0,0 +1,31 @@
+import pytest
+
+from app.conditional import if_range_matches, none_match
+
+ETAG = '"abc"'
+
+
+@pytest.mark.parametrize(
+    "header",
+    ['"abc"', 'W/"abc"', '"xyz", "abc"', '"xyz",W/"abc"', "*", " * "],
+)
+def test_none_match_matches(header):
+    assert none_match(header, ETAG)
+
+
+@pytest.mark.parametrize("header", [None, "", '"xyz"', '"ab"', "abc", '"abc'])
+def test_none_match_does_not_match(header):
+    assert not none_match(header, ETAG)
+
+
+@pytest.mark.parametrize("header", [None, "", '"abc"', ' "abc" '])
+def test_if_range_matches_the_same_render(header):
+    assert if_range_matches(header, ETAG)
+
+
+@pytest.mark.parametrize(
+    "header",
+    ['"xyz"', 'W/"abc"', "Wed, 21 Oct 2015 07:28:00 GMT", '"abc", "xyz"'],
+)
+def test_if_range_sends_the_whole_file_otherwise(header):
+    assert not if_range_matches(header, ETAG)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from app.size_preserving_podcast_splicer import crossfade
+
+
+def test_fade_gains_are_linear_ramps():
+    fade_out, fade_in = crossfade.fade_gains(4)
+
+    assert fade_in.shape == (4, 1)
+    assert fade_in.dtype == np.float32
+    assert fade_in.ravel().tolist() == [0, 0.25, 0.5, 0.75]
+    assert fade_out.ravel().tolist() == [0.75, 0.5, 0.25, 0]
+    # They never sum past unity gain.
+    assert np.all(fade_out + fade_in <= 1)
+
+
+def test_fade_gains_are_shared_and_read_only():
+    fade_out, fade_in = crossfade.fade_gains(16)
+
+    assert crossfade.fade_gains(16)[1] is fade_in
+    with pytest.raises(ValueError):
+        fade_out[0] = 1
+
+
+@pytest.mark.parametrize(
+    "dtype, low, high, expected_low, expected_high",
+    [
+        (np.int16, -32768, 32767, -1.0, 32767 / 32768),
+        (np.int32, -(2**31), 2**31 - 1, -1.0, 1.0),
+        (np.uint8, 0, 255, -1.0, 127 / 128),
+        (np.float32, -1.0, 1.0, -1.0, 1.0),
+        (np.float64, -1.0, 1.0, -1.0, 1.0),
+    ],
+)
+def test_full_scale_samples_stay_within_full_scale(
+    dtype, low, high, expected_low, expected_high
+):
+    samples = np.array([[low], [high]], dtype=dtype)
+
+    converted = crossfade._as_float(samples)
+
+    assert converted.dtype == np.float32
+    assert converted[0, 0] == pytest.approx(expected_low)
+    assert converted[1, 0] == pytest.approx(expected_high)
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.float32])
+def test_mixing_full_scale_inputs_doesnt_saturate(dtype):
+    peak = 1.0 if np.dtype(dtype).kind == "f" else np.iinfo(dtype).max
+    music = np.full((100, 2), peak, dtype=dtype)
+    ad = np.full((60, 2), peak, dtype=dtype)
+
+    mixed = crossfade.splice(music, ad, 0, 140, 40, 10, 40)
+
+    assert mixed.dtype == np.float32
+    assert np.all(np.abs(mixed) <= 1)
+
+
+def test_splice_lays_out_the_timeline():
+    music = np.arange(100, dtype=np.float32).reshape(-1, 1) / 100
+    ad = -np.ones((30, 1), dtype=np.float32)
+
+    mixed = crossfade.splice(music, ad, 0, 120, 40, 10, 10)
+
+    fade_out, fade_in = crossfade.fade_gains(10)
+    assert len(mixed) == 120
+    np.testing.assert_array_equal(mixed[:30], music[:30])
+    np.testing.assert_allclose(mixed[30:40], music[30:40] * fade_out - fade_in)
+    np.testing.assert_array_equal(mixed[40:50], ad[10:20])
+    np.testing.assert_allclose(mixed[50:60], -fade_out + music[40:50] * fade_in)
+    np.testing.assert_array_equal(mixed[60:110], music[50:])
+    # Reads past the end of the music are silent.
+    assert not mixed[110:].any()
+
+
+def test_splice_windows_match_the_whole_timeline():
+    rng = np.random.default_rng(0)
+    music = rng.uniform(-1, 1, (500, 2)).astype(np.float32)
+    ad = rng.uniform(-1, 1, (120, 2)).astype(np.float32)
+    whole = crossfade.splice(music, ad, 0, 580, 200, 30, 60)
+
+    out = np.zeros((580, 2), np.float32)
+    for start in range(0, 580, 70):
+        end = min(start + 70, 580)
+        crossfade.splice(music, ad, start, end, 200, 30, 60, out=out[start:end])
+
+    np.testing.assert_array_equal(out, whole)
+
+
+def test_equal_length_inputs_keep_the_sample_count():
+    music = np.ones((400, 2), dtype=np.int16)
+    ad = np.ones((400, 2), dtype=np.int16)
+    fade = 50
+
+    mixed = crossfade.splice(music, ad, 0, 400 + 400 - 2 * fade, 200, fade, 300)
+
+    assert mixed.shape == (700, 2)
+    assert np.all(mixed[-1] == np.float32(1 / 32768))
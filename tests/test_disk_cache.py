@@ -0,0 +1,99 @@
+import os
+
+from app.size_preserving_podcast_splicer import disk_cache
+from app.size_preserving_podcast_splicer.audio_splicer import AudioSplicer
+
+
+def test_put_and_get(tmp_path):
+    cache = disk_cache.DiskCache(tmp_path)
+
+    assert cache.put("a", b"render")
+
+    assert "a" in cache
+    assert bytes(cache.get("a")) == b"render"
+    assert cache.get("missing") is None
+    assert cache.open_file("missing") is None
+
+
+def test_open_file_gives_the_file_and_its_view(tmp_path):
+    cache = disk_cache.DiskCache(tmp_path)
+    cache.put("a", b"render")
+
+    opened = cache.open_file("a")
+
+    assert opened is not None
+    file, view = opened
+    with file:
+        assert file.name == str(tmp_path / "a.mp3")
+        assert file.read() == b"render"
+    assert bytes(view) == b"render"
+
+
+def test_open_files_survive_eviction(tmp_path):
+    cache = disk_cache.DiskCache(tmp_path, budget_bytes=15)
+    cache.put("a", b"a" * 10)
+    opened = cache.open_file("a")
+    assert opened is not None
+    file, view = opened
+
+    cache.put("b", bytes(10))
+
+    assert "a" not in cache
+    with file:
+        assert file.read() == b"a" * 10
+    assert bytes(view) == b"a" * 10
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = disk_cache.DiskCache(tmp_path, budget_bytes=25)
+    cache.put("a", bytes(10))
+    cache.put("b", bytes(10))
+    cache.get("a")
+
+    cache.put("c", bytes(10))
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.resident_bytes == 20
+
+
+def test_eviction_keeps_views_being_served(tmp_path):
+    cache = disk_cache.DiskCache(tmp_path, budget_bytes=15)
+    cache.put("a", b"a" * 10)
+    view = cache.get("a")
+
+    cache.put("b", bytes(10))
+
+    assert "a" not in cache
+    assert bytes(view) == b"a" * 10
+
+
+def test_keeps_newest_render_over_budget(tmp_path):
+    cache = disk_cache.DiskCache(tmp_path, budget_bytes=5)
+
+    cache.put("a", bytes(10))
+
+    assert "a" in cache
+
+
+def test_evicts_oldest_files_at_startup(tmp_path):
+    for age, key in enumerate(("new", "old")):
+        path = tmp_path / f"{key}.mp3"
+        path.write_bytes(bytes(10))
+        os.utime(path, (1000 - age, 1000 - age))
+
+    cache = disk_cache.DiskCache(tmp_path, budget_bytes=15)
+
+    assert "new" in cache
+    assert "old" not in cache
+
+
+def test_splicer_falls_back_to_memory_without_a_cache_dir(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_bytes(b"")
+
+    splicer = AudioSplicer(cache_dir=blocker / "cache")
+
+    assert splicer.disk_cache is None
+    splicer.close()
@@ -0,0 +1,102 @@
+import struct
+
+import pytest
+
+from app.size_preserving_podcast_splicer import id3_padding
+
+MIN_SIZE = id3_padding.TRAILING_PADDING_MIN_SIZE
+FRAMES = b"TIT2\x00\x00\x00\x06\x00\x00\x00Title"
+AUDIO = b"\xff\xfb" + bytes(998)
+TRAILER = b"TAG" + bytes(125)
+# Leading tag header and frames, audio and trailer, before any padding.
+UNPADDED_SIZE = 10 + len(FRAMES) + len(AUDIO) + len(TRAILER)
+
+
+def parse_ape_tag(tag: bytes) -> bytes:
+    """Check an APEv2 padding tag's header and footer, and return its value."""
+    header, footer = tag[:32], tag[-32:]
+    for block, is_header in ((header, True), (footer, False)):
+        preamble, version, size, items, flags, reserved = struct.unpack(
+            "<8sIIIIQ", block
+        )
+        assert preamble == b"APETAGEX"
+        assert version == 2000
+        # The size covers the items and footer, but not the header.
+        assert size == len(tag) - 32
+        assert items == 1
+        assert flags & (1 << 31), "Tag should say it has a header"
+        assert bool(flags & (1 << 29)) == is_header
+        assert reserved == 0
+    value_size, item_flags = struct.unpack("<II", tag[32:40])
+    assert item_flags == 1 << 1, "Padding should be a binary item"
+    assert tag[40:48] == b"Padding\x00"
+    value = tag[48:-32]
+    assert len(value) == value_size
+    return value
+
+
+@pytest.mark.parametrize("size", [MIN_SIZE, MIN_SIZE + 1, MIN_SIZE + 4096])
+def test_trailing_padding_parts_build_a_valid_tag(size):
+    parts = id3_padding.trailing_padding_parts(size)
+
+    tag = b"".join(parts)
+
+    assert len(tag) == size
+    assert parse_ape_tag(tag) == bytes(size - MIN_SIZE)
+    assert tag == id3_padding.trailing_padding(size)
+
+
+def test_trailing_padding_parts_share_the_filler():
+    first = id3_padding.trailing_padding_parts(MIN_SIZE + 100)
+    second = id3_padding.trailing_padding_parts(MIN_SIZE + 50)
+
+    assert isinstance(first[1], memoryview)
+    assert first[1].obj is second[1].obj
+
+
+def test_trailing_padding_parts_reject_sizes_smaller_than_a_tag():
+    with pytest.raises(AssertionError):
+        id3_padding.trailing_padding_parts(MIN_SIZE - 1)
+
+
+@pytest.mark.parametrize("gap", [0, 1, MIN_SIZE - 1, MIN_SIZE, MIN_SIZE + 1, 100_000])
+def test_pad_at_end_hits_the_target_size_exactly(gap):
+    target = UNPADDED_SIZE + gap
+
+    padded = id3_padding.pad_at_end(FRAMES, AUDIO, TRAILER, target)
+
+    assert len(padded) == target
+    assert padded.endswith(TRAILER)
+    version, flags, frames, tag_size = id3_padding.read_tag(padded)
+    assert (version, flags, frames) == (3, 0, FRAMES)
+    assert padded[tag_size : tag_size + len(AUDIO)] == AUDIO
+    tail = padded[tag_size + len(AUDIO) : -len(TRAILER)]
+    if gap < MIN_SIZE:
+        # Too small for a tag of its own, so it pads the leading tag.
+        assert tag_size == 10 + len(FRAMES) + gap
+        assert tail == b""
+    else:
+        assert tag_size == 10 + len(FRAMES)
+        assert parse_ape_tag(tail) == bytes(gap - MIN_SIZE)
+
+
+def test_pad_at_end_keeps_the_tag_version_and_flags():
+    gap = 5
+    target = UNPADDED_SIZE - len(TRAILER) + gap
+
+    padded = id3_padding.pad_at_end(FRAMES, AUDIO, b"", target, 4, 0x40)
+
+    assert padded[3:6] == bytes((4, 0, 0x40))
+    assert padded.startswith(id3_padding.leading_tag(FRAMES, gap, 4, 0x40))
+
+
+def test_pad_at_end_rejects_targets_smaller_than_the_data():
+    with pytest.raises(ValueError):
+        id3_padding.pad_at_end(FRAMES, AUDIO, TRAILER, UNPADDED_SIZE - 1)
+
+
+def test_minimum_size_counts_the_frames_kept():
+    tag = id3_padding.leading_tag(FRAMES, 10)
+
+    assert id3_padding.minimum_size(tag + AUDIO) == 10 + len(FRAMES)
+    assert id3_padding.minimum_size(AUDIO) == 10
@@ -0,0 +1,239 @@
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+if shutil.which("ffprobe") is None:
+    pytest.skip("Loading the app's media needs ffprobe", allow_module_level=True)
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.size_preserving_podcast_splicer.render_engine import RenderQueueFull
+
+DATA = bytes(range(256)) * 40
+ETAG = '"render"'
+
+
+class FakeSplicer:
+    """Serves DATA as every render, counting the renders asked for."""
+
+    def __init__(self, cache_path=None, busy=False):
+        self.cache_path = cache_path
+        self.busy = busy
+        self.renders = 0
+
+    def etag(self, original_audio, ad, target_size_bytes):
+        return ETAG
+
+    def cached_file(self, original_audio, ad, target_size_bytes):
+        if self.cache_path is None:
+            return None
+        return open(self.cache_path, "rb"), memoryview(DATA)
+
+    def _render(self):
+        if self.busy:
+            raise RenderQueueFull("Render queue is full")
+        self.renders += 1
+
+    async def read_range_async(self, original_audio, ad, target_size_bytes, start, end):
+        self._render()
+        return len(DATA), [memoryview(DATA)[start:end]]
+
+    async def stream_ad_and_pad_async(self, original_audio, ad, target_size_bytes):
+        self._render()
+
+        async def body():
+            yield DATA[:1000]
+            yield DATA[1000:]
+
+        return len(DATA), body()
+
+
+@pytest.fixture(params=["rendered", "on disk"])
+def splicer(request, monkeypatch, tmp_path):
+    cache_path = None
+    if request.param == "on disk":
+        cache_path = tmp_path / "render.mp3"
+        cache_path.write_bytes(DATA)
+    fake = FakeSplicer(cache_path)
+    monkeypatch.setattr(main, "splicer", fake)
+    monkeypatch.setattr(
+        main,
+        "loader",
+        SimpleNamespace(
+            music_track=SimpleNamespace(probe={"format": {"filename": "/m/music.mp3"}}),
+            sticky_ad=lambda listener, rotation: "ad",
+            target_bytes_size=lambda: len(DATA),
+        ),
+    )
+    return fake
+
+
+@pytest.fixture
+def client(splicer):
+    # Not used as a context manager, so the app doesn't warm up its cache.
+    return TestClient(main.app)
+
+
+def get(client, **headers):
+    return client.get(main.EPISODE_PATH, headers=headers)
+
+
+def test_full_episode(client):
+    response = get(client)
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["content-length"] == str(len(DATA))
+    assert response.headers["content-type"] == "audio/mpeg"
+    assert response.headers["etag"] == ETAG
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_head_sends_the_get_headers_without_rendering(client, splicer):
+    response = client.head(main.EPISODE_PATH)
+
+    expected = get(client).headers
+    assert response.status_code == 200
+    assert response.content == b""
+    for header in (
+        "content-length",
+        "content-type",
+        "content-disposition",
+        "accept-ranges",
+        "etag",
+        "cache-control",
+    ):
+        assert response.headers[header] == expected[header]
+    splicer.renders = 0
+    client.head(main.EPISODE_PATH)
+    client.head(main.EPISODE_PATH, headers={"if-none-match": ETAG})
+    assert splicer.renders == 0
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [
+        ("bytes=0-99", 0, 100),
+        ("bytes=5000-", 5000, len(DATA)),
+        ("bytes=-10", len(DATA) - 10, len(DATA)),
+        ("bytes=100-99999", 100, len(DATA)),
+    ],
+)
+def test_single_range(client, header, start, end):
+    response = get(client, range=header)
+
+    assert response.status_code == 206
+    assert response.content == DATA[start:end]
+    assert response.headers["content-length"] == str(end - start)
+    assert response.headers["content-range"] == f"bytes {start}-{end - 1}/{len(DATA)}"
+    assert response.headers["content-type"] == "audio/mpeg"
+
+
+def test_multiple_ranges(client):
+    response = get(client, range="bytes=0-9, 5000-5019")
+
+    assert response.status_code == 206
+    media_type, boundary = response.headers["content-type"].split("; boundary=")
+    assert media_type == "multipart/byteranges"
+    assert response.content == (
+        f"\r\n--{boundary}\r\n"
+        "Content-Type: audio/mpeg\r\n"
+        f"Content-Range: bytes 0-9/{len(DATA)}\r\n\r\n".encode()
+        + DATA[:10]
+        + f"\r\n--{boundary}\r\n"
+        "Content-Type: audio/mpeg\r\n"
+        f"Content-Range: bytes 5000-5019/{len(DATA)}\r\n\r\n".encode()
+        + DATA[5000:5020]
+        + f"\r\n--{boundary}--\r\n".encode()
+    )
+    assert response.headers["content-length"] == str(len(response.content))
+
+
+@pytest.mark.parametrize("if_none_match", [ETAG, f'"other", {ETAG}', "*"])
+def test_not_modified(client, splicer, if_none_match):
+    response = get(client, **{"if-none-match": if_none_match})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == ETAG
+    assert splicer.renders == 0
+
+
+def test_modified(client):
+    response = get(client, **{"if-none-match": '"other"'})
+
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+def test_if_range_matching_the_etag_sends_the_range(client):
+    response = get(client, range="bytes=0-9", **{"if-range": ETAG})
+
+    assert response.status_code == 206
+    assert response.content == DATA[:10]
+
+
+@pytest.mark.parametrize("if_range", ['"other"', f"W/{ETAG}", "Wed, 21 Oct 2015"])
+def test_if_range_not_matching_sends_the_whole_episode(client, if_range):
+    response = get(client, range="bytes=0-9", **{"if-range": if_range})
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert "content-range" not in response.headers
+
+
+@pytest.mark.parametrize(
+    "header", [f"bytes={len(DATA)}-", "bytes=99999-100000", "bytes=-0"]
+)
+def test_unsatisfiable_range(client, splicer, header):
+    response = get(client, range=header)
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+    assert splicer.renders == 0
+
+
+def test_busy_renderer_turns_requests_away(client, splicer):
+    if splicer.cache_path is not None:
+        pytest.skip("Renders on disk never need the renderer")
+    splicer.busy = True
+
+    for headers in ({}, {"range": "bytes=0-9"}):
+        response = get(client, **headers)
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == str(main.RETRY_AFTER_SECONDS)
+
+
+def listener_of(client, monkeypatch, **headers):
+    listeners = []
+    monkeypatch.setattr(
+        main.loader,
+        "sticky_ad",
+        lambda listener, rotation: listeners.append(listener) or "ad",
+    )
+    client.head(main.EPISODE_PATH, headers={"user-agent": "app", **headers})
+    return listeners[0]
+
+
+def test_listeners_are_told_apart_by_their_address(client, monkeypatch):
+    monkeypatch.setattr(main, "CLIENT_IP_HEADER", None)
+
+    assert listener_of(client, monkeypatch) == "client:testclient:app"
+    # Headers are only trusted when the deployment names one.
+    assert (
+        listener_of(client, monkeypatch, **{"fly-client-ip": "203.0.113.7"})
+        == "client:testclient:app"
+    )
+
+
+def test_listener_address_comes_from_the_proxy_header(client, monkeypatch):
+    monkeypatch.setattr(main, "CLIENT_IP_HEADER", "Fly-Client-IP")
+
+    assert (
+        listener_of(client, monkeypatch, **{"fly-client-ip": "203.0.113.7"})
+        == "client:203.0.113.7:app"
+    )
+    assert listener_of(client, monkeypatch) == "client:testclient:app"
@@ -0,0 +1,56 @@
+import pytest
+
+from app.size_preserving_podcast_splicer.media_loader import MediaLoader
+
+
+class FakeAd:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def content_hash(self) -> str:
+        return self.name
+
+
+def loader_with_ads(*names: str) -> MediaLoader:
+    loader = MediaLoader.__new__(MediaLoader)
+    loader.ads = [FakeAd(name) for name in names]  # type: ignore[misc]
+    return loader
+
+
+def test_sticky_ad_changes_at_most_once_a_rotation():
+    loader = loader_with_ads(*"abcdefgh")
+
+    for listener in map(str, range(20)):
+        ads = [
+            loader.sticky_ad(listener, 3600, now=1_000_000 + i * 60).name
+            for i in range(60)
+        ]
+        changes = sum(ads[i] != ads[i + 1] for i in range(len(ads) - 1))
+        assert changes <= 1
+        assert loader.sticky_ad(listener, 3600, now=1_000_000).name == ads[0]
+
+
+def test_sticky_ad_changes_between_rotations():
+    loader = loader_with_ads(*"abcdefgh")
+
+    ads = {loader.sticky_ad("listener", 60, now=i * 60).name for i in range(100)}
+
+    assert len(ads) > 1
+
+
+def test_sticky_ad_only_moves_listeners_of_a_removed_ad():
+    loader = loader_with_ads(*"abcdefgh")
+    before = {i: loader.sticky_ad(str(i), 3600, now=0).name for i in range(200)}
+
+    loader.ads = [ad for ad in loader.ads if ad.name != "a"]
+    after = {i: loader.sticky_ad(str(i), 3600, now=0).name for i in range(200)}
+
+    assert all(after[i] == before[i] for i in before if before[i] != "a")
+
+
+@pytest.mark.parametrize("rotation_seconds", [0, -1])
+def test_sticky_ad_rejects_rotations_that_arent_positive(rotation_seconds):
+    loader = loader_with_ads("a")
+
+    with pytest.raises(ValueError):
+        loader.sticky_ad("listener", rotation_seconds)
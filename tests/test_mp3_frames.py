@@ -0,0 +1,266 @@
+import shutil
+import subprocess
+
+import pytest
+
+from app.size_preserving_podcast_splicer import mp3_frames
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo, no CRC or padding.
+HEADER_128K = bytes((0xFF, 0xFB, 0x90, 0x64))
+FRAME_128K = 417
+SIDE_INFO_SIZE = 32
+# Offset of the Xing/Info marker in a stereo MPEG-1 frame without a CRC.
+XING_OFFSET = 4 + SIDE_INFO_SIZE
+
+
+def frame(header: bytes = HEADER_128K, main_data_begin: int = 0) -> bytes:
+    parsed = mp3_frames.parse_frame_header(header, 0)
+    assert parsed is not None
+    side_info = mp3_frames.with_main_data_begin(
+        parsed, bytes(parsed.side_info_size), main_data_begin
+    )
+    payload = bytes(parsed.length - parsed.payload_offset)
+    return mp3_frames.build_frame(parsed, side_info, payload)
+
+
+def id3v2_tag(body_size: int) -> bytes:
+    return b"ID3\x03\x00\x00" + bytes((0, 0, 0, body_size)) + bytes(body_size)
+
+
+def info_frame(frame_count: int = 0, delay: int = 576, padding: int = 1000) -> bytes:
+    """Build an Info frame with every Xing field and a LAME tag."""
+    body = bytearray(FRAME_128K)
+    body[:4] = HEADER_128K
+    position = XING_OFFSET
+    body[position : position + 8] = b"Info" + (0x0F).to_bytes(4, "big")
+    position += 8
+    body[position : position + 4] = frame_count.to_bytes(4, "big")
+    position += 4 + 4 + 100 + 4  # Byte count, TOC and quality.
+    body[position : position + 9] = b"LAME3.100"
+    body[position + 21 : position + 24] = ((delay << 12) | padding).to_bytes(3, "big")
+    return bytes(body)
+
+
+def test_parse_frame_header():
+    header = mp3_frames.parse_frame_header(HEADER_128K, 0)
+
+    assert header is not None
+    assert header.is_mpeg1
+    assert header.bitrate_kbps == 128
+    assert header.sample_rate == 44100
+    assert header.channels == 2
+    assert header.samples_per_frame == 1152
+    assert header.length == FRAME_128K
+    assert header.payload_offset == 4 + SIDE_INFO_SIZE
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        bytes((0xFF, 0xFD, 0x90, 0x64)),  # Layer II
+        bytes((0xFF, 0xFB, 0x00, 0x64)),  # Free format
+        bytes((0xFF, 0xFB, 0xF0, 0x64)),  # Bad bitrate index
+        bytes((0xFF, 0xFB, 0x9C, 0x64)),  # Reserved sample rate
+        bytes((0xFF, 0xEB, 0x90, 0x64)),  # Reserved version
+        bytes((0xFE, 0xFB, 0x90, 0x64)),  # No sync word
+        HEADER_128K[:3],
+    ],
+)
+def test_parse_frame_header_rejects_invalid_headers(data):
+    assert mp3_frames.parse_frame_header(data, 0) is None
+
+
+def test_with_bitrate_changes_only_the_size():
+    header = mp3_frames.parse_frame_header(HEADER_128K, 0)
+    assert header is not None
+
+    resized = header.with_bitrate(mp3_frames.bitrate_index(True, 320), 1)
+
+    assert resized.bitrate_kbps == 320
+    assert resized.length == mp3_frames.frame_length(True, 320, 44100, 1)
+    assert mp3_frames.parse_frame_header(resized.raw, 0) == resized
+    assert resized.raw[3] == header.raw[3]
+
+
+def test_bitrate_index_round_trips():
+    for is_mpeg1 in (True, False):
+        for rate in mp3_frames.bitrates(is_mpeg1):
+            index = mp3_frames.bitrate_index(is_mpeg1, rate)
+            assert 1 <= index <= mp3_frames.MAX_BITRATE_INDEX
+    with pytest.raises(ValueError):
+        mp3_frames.bitrate_index(True, 100)
+
+
+def test_lame_cbr_size_splits_at_any_frame():
+    whole = mp3_frames.lame_cbr_size(True, 128, 44100, 0, 1000)
+
+    for split in (1, 7, 500, 999):
+        assert whole == mp3_frames.lame_cbr_size(
+            True, 128, 44100, 0, split
+        ) + mp3_frames.lame_cbr_size(True, 128, 44100, split, 1000)
+    # Padding keeps the average bitrate exact to within a byte.
+    assert abs(whole - 1000 * 144000 * 128 / 44100) < 1
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+@pytest.mark.parametrize("bitrate", [32, 128, 320])
+def test_lame_cbr_size_matches_libmp3lame(bitrate):
+    sample_count = 44100 * 3 + 123
+    encoded = subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:sample_rate=44100:duration={sample_count / 44100}",
+            "-ac",
+            "2",
+            "-c:a",
+            "libmp3lame",
+            "-b:a",
+            f"{bitrate}k",
+            "-write_xing",
+            "0",
+            "-id3v2_version",
+            "0",
+            "-f",
+            "mp3",
+            "pipe:",
+        ],
+        check=True,
+        capture_output=True,
+    ).stdout
+    frames = mp3_frames.Mp3Frames(encoded)
+    count = len(frames.offsets)
+
+    assert count == mp3_frames.lame_frame_count(sample_count, 1152)
+    assert frames.audio_end - frames.audio_start == mp3_frames.lame_cbr_size(
+        True, bitrate, 44100, 0, count
+    )
+
+
+def test_mp3_frames_splits_tags_and_frames():
+    tag = id3v2_tag(20)
+    trailer = b"TAG" + bytes(125)
+    audio = b"".join(frame() for _ in range(5))
+
+    frames = mp3_frames.Mp3Frames(tag + audio + trailer)
+
+    assert frames.tag_bytes() == tag
+    assert frames.trailer_bytes() == trailer
+    assert frames.offsets == [len(tag) + i * FRAME_128K for i in range(5)]
+    assert frames.frame_bytes(1, 3) == audio[FRAME_128K : 3 * FRAME_128K]
+    assert frames.frame_bytes(3, 10) == audio[3 * FRAME_128K :]
+    assert frames.frame_bytes(2, 2) == b""
+    assert frames.xing is None
+    assert frames.sample_count() == 5 * 1152
+
+
+def test_mp3_frames_rejects_data_without_frames():
+    with pytest.raises(ValueError):
+        mp3_frames.Mp3Frames(id3v2_tag(10) + b"not audio")
+
+
+def test_mp3_frames_rejects_changing_stream_parameters():
+    mono = bytes((0xFF, 0xFB, 0x90, 0xC4))
+    with pytest.raises(ValueError):
+        mp3_frames.Mp3Frames(frame() + frame(mono))
+
+
+def test_main_data_begin_round_trips():
+    header = mp3_frames.parse_frame_header(HEADER_128K, 0)
+    assert header is not None
+    side_info = bytes(range(SIDE_INFO_SIZE))
+
+    for value in (0, 1, 255, 256, mp3_frames.max_main_data_begin(header)):
+        updated = mp3_frames.with_main_data_begin(header, side_info, value)
+        assert mp3_frames.main_data_begin(header, updated) == value
+        # Only the 9 bits of main_data_begin change.
+        assert updated[1] & 0x7F == side_info[1] & 0x7F
+        assert updated[2:] == side_info[2:]
+
+
+def test_reservoir_needed_and_bytes():
+    data = frame() + frame() + frame(main_data_begin=100) + frame()
+    frames = mp3_frames.Mp3Frames(data)
+    payload_size = FRAME_128K - 4 - SIDE_INFO_SIZE
+
+    assert frames.reservoir_needed(2) == 100
+    assert frames.reservoir_needed(3) == 0
+    # Frame 1's payload holds all of what frame 2 needs.
+    assert frames.reservoir_needed(1) == 0
+    reservoir = frames.reservoir_bytes(2, 100)
+    assert reservoir == frames.payload(1)[-100:]
+    # The reservoir can span frames, but not go back past the first one.
+    assert len(frames.reservoir_bytes(2, payload_size + 10)) == payload_size + 10
+    assert frames.reservoir_bytes(1, payload_size + 10) == frames.payload(0)
+
+
+def test_build_frame_checks_the_size():
+    header = mp3_frames.parse_frame_header(HEADER_128K, 0)
+    assert header is not None
+
+    with pytest.raises(AssertionError):
+        mp3_frames.build_frame(header, bytes(SIDE_INFO_SIZE), b"too short")
+
+
+def test_xing_header_is_parsed_and_skipped():
+    frames = mp3_frames.Mp3Frames(info_frame(3) + frame() * 3)
+
+    assert frames.xing is not None
+    assert frames.xing.frame_count() == 3
+    assert frames.xing.encoder_delay() == 576
+    assert frames.xing.encoder_padding() == 1000
+    assert len(frames.offsets) == 3
+    assert frames.decoder_skip() == 576 + mp3_frames.DECODER_DELAY
+    assert frames.sample_count() == 3 * 1152 - 576 - 1000
+
+
+def test_xing_rebuild_describes_the_new_frames():
+    frames = mp3_frames.Mp3Frames(info_frame(3) + frame() * 3)
+    assert frames.xing is not None
+    header = frames.headers[0]
+    loud = header.with_bitrate(mp3_frames.bitrate_index(True, 320), 0)
+    headers = [header] * 10 + [loud] * 10
+
+    rebuilt = mp3_frames.Mp3Frames(frames.xing.rebuild(headers, (576, 42)) + frame())
+    xing = rebuilt.xing
+    assert xing is not None
+    lame = xing.lame_offset
+    assert lame is not None
+    byte_count = FRAME_128K + sum(h.length for h in headers)
+
+    # Mixed bitrates are marked as VBR.
+    assert xing.frame[XING_OFFSET : XING_OFFSET + 4] == b"Xing"
+    assert xing.frame_count() == 20
+    assert xing.bytes_offset is not None
+    assert (
+        int.from_bytes(xing.frame[xing.bytes_offset : xing.bytes_offset + 4], "big")
+        == byte_count
+    )
+    assert xing.encoder_delay() == 576
+    assert xing.encoder_padding() == 42
+    assert int.from_bytes(xing.frame[lame + 28 : lame + 32], "big") == byte_count
+    assert int.from_bytes(
+        xing.frame[lame + 34 : lame + 36], "big"
+    ) == mp3_frames._crc16(xing.frame[: lame + 34])
+    assert xing.toc_offset is not None
+    toc = list(xing.frame[xing.toc_offset : xing.toc_offset + 100])
+    assert toc == sorted(toc)
+    # Halfway through the frames is after the ten 128k frames.
+    assert toc[50] == 256 * (FRAME_128K + 10 * FRAME_128K) // byte_count
+
+
+def test_xing_rebuild_keeps_gapless_info_by_default():
+    frames = mp3_frames.Mp3Frames(info_frame(3) + frame() * 3)
+    assert frames.xing is not None
+
+    rebuilt = frames.xing.rebuild(frames.headers)
+
+    assert rebuilt[XING_OFFSET : XING_OFFSET + 4] == b"Info"
+    parsed = mp3_frames.XingHeader.parse(rebuilt, frames.xing.header)
+    assert parsed is not None
+    assert parsed.encoder_delay() == 576
+    assert parsed.encoder_padding() == 1000
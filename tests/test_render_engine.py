@@ -0,0 +1,35 @@
+import concurrent.futures.process
+import os
+
+import pytest
+
+from app.size_preserving_podcast_splicer.render_engine import (
+    RenderEngine,
+    RenderQueueFull,
+)
+
+
+def test_rejects_jobs_once_the_queue_is_full():
+    engine = RenderEngine(max_workers=1, max_queue=0)
+    try:
+        job = engine.submit(abs, -1)
+        with pytest.raises(RenderQueueFull):
+            engine.submit(abs, -2)
+
+        assert job.result() == 1
+        assert engine.stats()["rejected"] == 1
+    finally:
+        engine.shutdown()
+
+
+def test_recovers_when_a_worker_dies():
+    engine = RenderEngine(max_workers=1)
+    try:
+        died = engine.submit(os._exit, 1)
+
+        with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+            died.result()
+        assert engine.submit(abs, -1).result() == 1
+        assert engine.stats()["restarts"] == 1
+    finally:
+        engine.shutdown()
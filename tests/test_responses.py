@@ -0,0 +1,69 @@
+import asyncio
+
+from app import responses
+from app.byte_ranges import ByteRange
+from app.responses import SendfileResponse
+
+DATA = bytes(range(256)) * 4096
+
+
+def send_response(tmp_path, body, extensions=None, method="GET"):
+    path = tmp_path / "render.mp3"
+    path.write_bytes(DATA)
+    file = open(path, "rb")
+    response = SendfileResponse(file, memoryview(DATA), body, status_code=206)
+    scope = {"type": "http", "method": method, "extensions": extensions or {}}
+    messages = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            # Read the range as the server would send it, while it's open.
+            message["file"].seek(message["offset"])
+            message = {**message, "sent": message["file"].read(message["count"])}
+        messages.append(message)
+
+    asyncio.run(response(scope, None, send))
+    assert file.closed
+    return messages
+
+
+def body_of(messages):
+    return b"".join(
+        bytes(message.get("body") or message.get("sent") or b"")
+        for message in messages[1:]
+    )
+
+
+def test_servers_with_zero_copy_send_are_handed_the_file(tmp_path):
+    body = [b"head", ByteRange(10, 20), b"middle", ByteRange(500_000, 500_010)]
+
+    messages = send_response(tmp_path, body, {"http.response.zerocopysend": {}})
+
+    assert messages[0]["status"] == 206
+    zero_copy = [m for m in messages if m["type"] == "http.response.zerocopysend"]
+    assert [(m["offset"], m["count"]) for m in zero_copy] == [
+        (10, 10),
+        (500_000, 10),
+    ]
+    assert body_of(messages) == (
+        b"head" + DATA[10:20] + b"middle" + DATA[500_000:500_010]
+    )
+    assert messages[-1] == {"type": "http.response.body", "body": b""}
+
+
+def test_other_servers_are_sent_chunks_of_the_view(tmp_path):
+    body = [ByteRange(0, len(DATA))]
+
+    messages = send_response(tmp_path, body)
+
+    chunks = [m["body"] for m in messages[1:-1]]
+    assert all(isinstance(chunk, memoryview) for chunk in chunks)
+    assert max(len(chunk) for chunk in chunks) == responses.CHUNK_SIZE
+    assert body_of(messages) == DATA
+
+
+def test_head_requests_get_no_body(tmp_path):
+    messages = send_response(tmp_path, [ByteRange(0, 10)], method="HEAD")
+
+    assert body_of(messages) == b""
+    assert len(messages) == 2